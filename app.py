@@ -1,31 +1,74 @@
+import atexit
+import bisect
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import decimal
+import functools
 import glob
+import gzip
+import hashlib
+import io
+import itertools
+import json
 import logging
+import mimetypes
+import multiprocessing
 import os
 import platform
+import queue
+import random
 import re
+import signal
 import subprocess
 import sys
 import tempfile
 import threading
+import time
+import unicodedata
+import uuid
+import weakref
 import webbrowser
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 
-import eel
-import psycopg2
-import psycopg2.extras
+# Tempos da inicialização por etapa, mostrados ao subir (ver startup_step). Módulos
+# pesados ficam fora daqui: psycopg2 só com PostgreSQL configurado, pypdf só na
+# mesclagem/contagem de páginas, eel só no modo desktop.
+startup_times = {}
+_startup_mark = time.perf_counter()
+
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_from_directory
 from flask_cors import CORS
-from pypdf import PdfReader, PdfWriter
 from driftbrake import DriftBrake
 
-load_dotenv()
+import pdf_blank
+
+
+def startup_step(etapa):
+    """Fecha a etapa da inicialização que terminou agora (segundos desde a anterior)."""
+    global _startup_mark
+    now = time.perf_counter()
+    startup_times[etapa] = now - _startup_mark
+    _startup_mark = now
+
+
+startup_step('imports')
+
+# Importar este módulo só define funções, rotas e objetos em memória: banco, pasta de
+# rede, threads e arquivos ficam em init_app(), chamada pelos pontos de entrada
+# (__main__ abaixo, importar_planilhas.py, benchmarks). Os processos do pool de
+# páginas em branco (spawn no Windows) reimportam este script como __mp_main__ e não
+# podem repetir a inicialização: auditoria, DDL, sondagem da rede etc.
+# Executável (PyInstaller): freeze_support desvia esses processos aqui.
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
 
-DriftBrake.run_from_env()
-# Se drift foi detectado e corresponde a fail_on, o processo encerra aqui com o código certo.
-# Se não há drift, a execução continua.
+load_dotenv()
 
 # CONFIGURAÇÃO DE CAMINHOS
 def get_application_path():
@@ -35,25 +78,74 @@ def get_application_path():
     return os.path.dirname(os.path.abspath(__file__))
 
 # Registro de logs de erros
+# Compartilhamento lento ou fora do ar não pode segurar a subida do serviço: cada
+# caminho é testado em thread própria e quem não responde em NETWORK_PROBE_TIMEOUT
+# segundos fica de fora (a thread presa é daemon e não impede o processo de sair).
+NETWORK_PROBE_TIMEOUT = float(os.getenv('NETWORK_PROBE_TIMEOUT', '5'))
+
+
+def _probe_data_path(path):
+    """Cria a pasta e testa escrita nela. Levanta exceção se não der."""
+    os.makedirs(path, exist_ok=True)
+    test_file = os.path.join(path, '.write_test')
+    with open(test_file, 'w') as f:
+        f.write('ok')
+    os.remove(test_file)
+
+
 def get_network_data_path():
-    """Retorna pasta de dados, com fallback se rede não estiver disponível."""
-    network_paths = [
+    """Retorna pasta de dados, com fallback se rede não estiver disponível.
+
+    Os caminhos são testados em paralelo; vale o primeiro da lista que respondeu
+    a tempo, sem esperar pelos seguintes.
+    """
+    network_paths = [path for path in (
         os.getenv('NETWORK_DATA_PATH', ''),
         r"",
-    ]
+    ) if path]
 
-    for path in network_paths:
+    results = {}  # caminho -> None (ok) ou exceção
+    cond = threading.Condition()
+
+    def probe(path):
         try:
-            os.makedirs(path, exist_ok=True)
-            test_file = os.path.join(path, '.write_test')
-            with open(test_file, 'w') as f:
-                f.write('ok')
-            os.remove(test_file)
-            print(f"Usando pasta de rede: {path}")
-            return path
+            _probe_data_path(path)
+            error = None
         except Exception as e:
-            print(f"Caminho {path} não acessível: {e}")
-            continue
+            error = e
+        with cond:
+            results[path] = error
+            cond.notify_all()
+
+    for path in network_paths:
+        threading.Thread(target=probe, args=(path,), name='sonda-rede', daemon=True).start()
+
+    deadline = time.monotonic() + NETWORK_PROBE_TIMEOUT
+    with cond:
+        while True:
+            remaining = deadline - time.monotonic()
+            chosen = None
+            for path in network_paths:
+                if path not in results:
+                    if remaining > 0:
+                        chosen = ''  # caminho preferido ainda testando
+                        break
+                elif results[path] is None:
+                    chosen = path
+                    break
+            if chosen != '':
+                break
+            cond.wait(remaining)
+        answered = dict(results)
+
+    if chosen:
+        print(f"Usando pasta de rede: {chosen}")
+        return chosen
+    for path in network_paths:
+        if path in answered:
+            print(f"Caminho {path} não acessível: {answered[path]}")
+        else:
+            print(f"Caminho {path} não respondeu em {NETWORK_PROBE_TIMEOUT:g}s")
 
     local_path = os.path.join(os.path.expanduser('~'), 'SISREGIP_Data')
     os.makedirs(local_path, exist_ok=True)
@@ -62,14 +154,23 @@ def get_network_data_path():
 
 
 application_path = get_application_path()
-network_data_path = get_network_data_path()
+network_data_path = None  # sondada em init_app
 
-log_file = os.path.join(network_data_path, 'app_errors.log')
-logging.basicConfig(
-    filename=log_file,
-    level=logging.ERROR,
-    format='%(asctime)s %(levelname)s:%(message)s'
-)
+
+def setup_logging():
+    """Log de erros e de consultas lentas na pasta de dados."""
+    log_file = os.path.join(network_data_path, 'app_errors.log')
+    logging.basicConfig(
+        filename=log_file,
+        level=logging.ERROR,
+        format='%(asctime)s %(levelname)s:%(message)s'
+    )
+    if SLOW_QUERY_MS > 0:
+        slow_handler = logging.FileHandler(SLOW_QUERY_LOG or os.path.join(network_data_path, 'consultas_lentas.log'),
+                                           encoding='utf-8')
+        slow_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_query_log.addHandler(slow_handler)
+        slow_query_log.setLevel(logging.WARNING)
 
 # Primário: PostgreSQL via variáveis no .env
 # Secundário: SQLite quando credenciais PostgreSQL não estiverem no .env
@@ -81,219 +182,1750 @@ _PG_USER = os.getenv('DB_USER')
 _PG_PASS = os.getenv('DB_PASSWORD')
 USE_POSTGRES = all([_PG_URL])
 
+if USE_POSTGRES:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+
 SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH')
 SECRETARIA_DB_PATH = os.getenv('SECRETARIA_DB_PATH')
 
+# MÉTRICAS
+# Contadores e histogramas em memória, expostos em /metrics no formato texto do
+# Prometheus. Registrar custa um lock e uma busca binária nos buckets; os gauges de
+# pool, fila de auditoria, jobs de PDF etc. só são lidos quando /metrics é coletado.
+# Consultas que passam de SLOW_QUERY_MS vão para consultas_lentas.log (0 desliga).
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '500'))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG')  # vazio: consultas_lentas.log na pasta de dados
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _metric_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+class Metrics:
+    """Registro de métricas do processo, seguro entre threads.
+
+    Rótulos são tuplas de pares (nome, valor), usadas direto como chave de dicionário.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}        # nome -> (tipo, descrição)
+        self._values = {}      # contadores e gauges: nome -> {rótulos: valor}
+        self._buckets = {}     # histogramas: nome -> limites
+        self._histograms = {}  # histogramas: nome -> {rótulos: [contagem por bucket..., soma, total]}
+        self._collectors = []  # (nome, função) chamadas na coleta
+        self.started_at = time.time()
+
+    def counter(self, name, description):
+        self._meta[name] = ('counter', description)
+        self._values[name] = {}
+
+    def gauge(self, name, description):
+        self._meta[name] = ('gauge', description)
+        self._values[name] = {}
+
+    def histogram(self, name, description, buckets):
+        self._meta[name] = ('histogram', description)
+        self._buckets[name] = buckets
+        self._histograms[name] = {}
+
+    def collector(self, name, kind, description, func):
+        """Métrica lida na coleta: func() retorna um número ou [(rótulos, valor), ...]."""
+        self._meta[name] = (kind, description)
+        self._collectors.append((name, func))
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            series = self._values[name]
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self._buckets[name]
+        i = bisect.bisect_left(buckets, value)
+        with self._lock:
+            series = self._histograms[name].get(labels)
+            if series is None:
+                series = self._histograms[name][labels] = [0] * (len(buckets) + 3)
+            series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        """Texto no formato de exposição do Prometheus (version 0.0.4)."""
+        with self._lock:
+            values = {name: dict(series) for name, series in self._values.items()}
+            histograms = {name: {k: list(v) for k, v in series.items()} for name, series in self._histograms.items()}
+        for name, func in self._collectors:
+            try:
+                result = func()
+            except Exception:
+                logging.error(f"Erro ao coletar métrica {name}", exc_info=True)
+                continue
+            values[name] = {(): result} if isinstance(result, (int, float)) else dict(result)
+
+        lines = []
+        for name, (kind, description) in self._meta.items():
+            if name not in values and name not in histograms:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != 'histogram':
+                for labels, value in values[name].items():
+                    lines.append(f"{name}{_metric_labels(labels)} {value}")
+                continue
+            buckets = self._buckets[name]
+            for labels, series in histograms[name].items():
+                acumulado = 0
+                for limite, count in zip(buckets + ('+Inf',), series):
+                    acumulado += count
+                    lines.append(f"{name}_bucket{_metric_labels(labels + (('le', limite),))} {acumulado}")
+                lines.append(f"{name}_sum{_metric_labels(labels)} {series[-2]}")
+                lines.append(f"{name}_count{_metric_labels(labels)} {series[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.histogram('sisregip_http_request_duration_seconds',
+                  "Tempo até a resposta (streams: até os cabeçalhos).", HTTP_BUCKETS)
+metrics.counter('sisregip_http_requests_total', "Requisições por rota, método e status.")
+metrics.gauge('sisregip_http_requests_in_flight', "Requisições em andamento por rota.")
+metrics.histogram('sisregip_db_query_seconds', "Tempo de execução das consultas ao banco.", QUERY_BUCKETS)
+metrics.counter('sisregip_db_rows_total', "Linhas lidas (fetch) ou afetadas (escrita) pelas consultas.")
+metrics.counter('sisregip_db_slow_queries_total', f"Consultas acima de {SLOW_QUERY_MS:g} ms.")
+metrics.counter('sisregip_db_busy_retries_total', "Repetições de comandos SQLite após SQLITE_BUSY.")
+
+slow_query_log = logging.getLogger('sisregip.consultas_lentas')  # arquivo em setup_logging
+slow_query_log.propagate = False
+
+_QUERY_TABLE_RE = {
+    'select': re.compile(r'\bFROM\s+(\w+)', re.IGNORECASE),
+    'insert': re.compile(r'\bINTO\s+(\w+)', re.IGNORECASE),
+    'update': re.compile(r'^\s*UPDATE\s+(\w+)', re.IGNORECASE),
+    'delete': re.compile(r'\bFROM\s+(\w+)', re.IGNORECASE),
+}
+
+
+@functools.lru_cache(maxsize=2048)
+def query_labels(sql):
+    """Rótulos (operação, tabela) de uma consulta, para não usar o SQL como rótulo."""
+    op = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else ''
+    if op == 'with':
+        op = 'select'
+    pattern = _QUERY_TABLE_RE.get(op)
+    if pattern is None:
+        return (('op', 'outro'), ('tabela', ''))
+    match = pattern.search(sql)
+    return (('op', op), ('tabela', match.group(1).lower() if match else ''))
+
+
+def observe_query(sql, params, started, rowcount):
+    """Registra tempo e linhas afetadas de uma consulta; anota no log se for lenta."""
+    elapsed = time.perf_counter() - started
+    labels = query_labels(sql)
+    metrics.observe('sisregip_db_query_seconds', labels, elapsed)
+    if rowcount > 0:
+        metrics.inc('sisregip_db_rows_total', labels, rowcount)
+    if SLOW_QUERY_MS > 0 and elapsed * 1000 >= SLOW_QUERY_MS:
+        metrics.inc('sisregip_db_slow_queries_total', labels)
+        # Só a quantidade de parâmetros: os valores têm nomes de pacientes
+        slow_query_log.warning("%.1f ms linhas=%d parametros=%d %s", elapsed * 1000, rowcount,
+                               len(params or ()), ' '.join(sql.split()))
+    return labels
+
+
+# POOL DE CONEXÕES
+# Threads do servidor (ver SERVIDOR): cada dashboard conectado ao SSE prende uma
+# enquanto estiver aberto, sem conexão de banco; as demais atendem requisições e
+# cada uma pode segurar uma conexão. O pool acompanha as threads: menor que isso,
+# relatórios e importações lentas esgotam o pool e o resto cai em PoolTimeoutError.
+SSE_MAX_CLIENTS = int(os.getenv('SSE_MAX_CLIENTS', '50'))
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', str(SSE_MAX_CLIENTS + 16)))
+# Tamanho máximo, espera por conexão livre, idade máxima e intervalo do health check
+# (segundos). Conexões só são abertas sob demanda: o tamanho é só o teto.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', str(SERVER_THREADS)))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', '30'))
+
+
+class PoolTimeoutError(Exception):
+    """Nenhuma conexão do pool ficou livre dentro de DB_POOL_TIMEOUT."""
+
+
+class _ConnectionPool:
+    """Pool limitado de conexões, seguro entre threads.
+
+    Guarda conexões brutas (psycopg2 ou sqlite3) ociosas em pilha (LIFO), para que a
+    conexão mais recente, ainda quente, seja a próxima a ser reutilizada. Conexões
+    mais velhas que `recycle` são descartadas; as ociosas há mais de `ping_after`
+    passam por um health check antes de voltar ao uso.
+    """
+
+    def __init__(self, connect, ping, reset, size, timeout, recycle, ping_after):
+        self._connect = connect
+        self._ping = ping
+        self._reset = reset
+        self._size = size
+        self._timeout = timeout
+        self._recycle = recycle
+        self._ping_after = ping_after
+        self._idle = []  # (conexão, criada_em, devolvida_em)
+        self._cond = threading.Condition()
+        self._checked_out = 0
+        self._waiting = 0
+        self._created = 0
+        self._recycled = 0
+        self._timeouts = 0
+
+    def acquire(self):
+        """Retorna (conexão, criada_em). Bloqueia até `timeout` se o pool estiver cheio."""
+        deadline = time.monotonic() + self._timeout
+        with self._cond:
+            while not self._idle and self._checked_out >= self._size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Pool esgotado: {self._checked_out} conexões em uso há mais de {self._timeout}s"
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._checked_out += 1
+            entry = self._idle.pop() if self._idle else None
+
+        # Fora do lock: health check e conexão nova podem ir à rede
+        try:
+            if entry is not None:
+                conn, born, returned = entry
+                now = time.monotonic()
+                if now - born > self._recycle or (now - returned > self._ping_after and not self._alive(conn)):
+                    self._close_quietly(conn)
+                    with self._cond:
+                        self._recycled += 1
+                    entry = None
+            if entry is None:
+                conn, born = self._connect(), time.monotonic()
+                with self._cond:
+                    self._created += 1
+            return conn, born
+        except Exception:
+            with self._cond:
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, born):
+        """Devolve a conexão ao pool, desfazendo transação pendente."""
+        keep = time.monotonic() - born <= self._recycle
+        if keep:
+            try:
+                self._reset(conn)
+            except Exception:
+                keep = False
+        if not keep:
+            self._close_quietly(conn)
+        with self._cond:
+            self._checked_out -= 1
+            if keep:
+                self._idle.append((conn, born, time.monotonic()))
+            else:
+                self._recycled += 1
+            self._cond.notify()
+
+    def close_all(self):
+        """Fecha as conexões ociosas (usado no encerramento)."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Estatísticas do pool para inspeção em tempo de execução."""
+        with self._cond:
+            return {
+                "size": self._size,
+                "checked_out": self._checked_out,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "created": self._created,
+                "recycled": self._recycled,
+                "timeouts": self._timeouts,
+            }
+
+    def _alive(self, conn):
+        try:
+            self._ping(conn)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# CACHE DE COMANDOS (PostgreSQL)
+# A tradução de uma consulta no estilo sqlite3 (? -> %s, RETURNING id nos INSERTs)
+# é feita uma vez por texto e fica em cache. Depois de PG_PREPARE_THRESHOLD
+# execuções o comando vira prepared statement na conexão (PREPARE uma vez, depois
+# EXECUTE): o PostgreSQL deixa de analisar e planejar o texto a cada requisição.
+# PG_PREPARE_THRESHOLD=0 desliga; PG_PREPARED_MAX limita os comandos por conexão.
+PG_PREPARE_THRESHOLD = int(os.getenv('PG_PREPARE_THRESHOLD', '5'))
+PG_PREPARED_MAX = int(os.getenv('PG_PREPARED_MAX', '200'))
+PG_STATEMENT_CACHE = 1024
+PG_BATCH_PAGE_SIZE = 500   # linhas por comando em executemany/execute_values
+PG_ITER_SIZE = 2000        # linhas por ida ao servidor ao iterar o cursor
+_PG_PREPARABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+# Prepared statements existem por sessão: nomes já preparados em cada conexão
+_pg_prepared = weakref.WeakKeyDictionary()
+_pg_statement_ids = itertools.count(1)
+
+
+class _PgStatement:
+    """Consulta traduzida para o psycopg2 (uma instância por texto original)."""
+
+    def __init__(self, query):
+        parts = query.split('?')
+        verb = query.lstrip()[:6].upper()
+        # Com parâmetros o psycopg2 interpola o texto: '%' literal vira '%%'
+        self.text = '%s'.join(part.replace('%', '%%') for part in parts)
+        self.returning = verb == 'INSERT' and 'RETURNING' not in query.upper()
+        self.sql = self.text.rstrip().rstrip(';') + ' RETURNING id' if self.returning else self.text
+        self.preparable = PG_PREPARE_THRESHOLD > 0 and verb.startswith(_PG_PREPARABLE)
+        self.executions = 0
+        self.name = f"sisregip_{next(_pg_statement_ids)}"
+        body = parts[0] + ''.join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+        self.prepare_sql = f"PREPARE {self.name} AS {body.rstrip().rstrip(';')}" + (
+            ' RETURNING id' if self.returning else '')
+        args = ', '.join(['%s'] * (len(parts) - 1))
+        self.execute_sql = f"EXECUTE {self.name} ({args})" if args else f"EXECUTE {self.name}"
+
+
+@functools.lru_cache(maxsize=PG_STATEMENT_CACHE)
+def pg_statement(query):
+    return _PgStatement(query)
+
+
 class _PgCursor:
     """Faz o cursor psycopg2 se comportar como sqlite3"""
 
-    def __init__(self, cursor):
+    def __init__(self, cursor, named=False):
         self._c = cursor
+        self._named = named
         self.lastrowid = None
+        self._labels = None
+
+    def _prepared(self, stmt):
+        """True se `stmt` está (ou acabou de ficar) preparado nesta conexão."""
+        if not stmt.preparable or self._named:
+            return False
+        names = _pg_prepared.setdefault(self._c.connection, set())
+        if stmt.name in names:
+            return True
+        stmt.executions += 1
+        if stmt.executions < PG_PREPARE_THRESHOLD or len(names) >= PG_PREPARED_MAX:
+            return False
+        # Savepoint: PREPARE que falha (ex.: tipo de parâmetro indefinido) não pode
+        # abortar a transação da rota; o comando segue sem preparar
+        self._c.execute("SAVEPOINT sisregip_prepare")
+        try:
+            self._c.execute(stmt.prepare_sql)
+        except psycopg2.Error:
+            self._c.execute("ROLLBACK TO SAVEPOINT sisregip_prepare")
+            stmt.preparable = False
+            return False
+        finally:
+            self._c.execute("RELEASE SAVEPOINT sisregip_prepare")
+        names.add(stmt.name)
+        return True
 
     def execute(self, query, params=None):
-        sql = query.replace('?', '%s')
-        is_insert = bool(re.match(r'\s*INSERT\b', sql, re.IGNORECASE))
-        if is_insert and 'RETURNING' not in sql.upper():
-            sql = sql.rstrip().rstrip(';') + ' RETURNING id'
-            self._c.execute(sql, params or ())
+        started = time.perf_counter()
+        stmt = pg_statement(query)
+        if self._prepared(stmt):
+            self._c.execute(stmt.execute_sql, params or ())
+        else:
+            self._c.execute(stmt.sql, params or ())
+        if stmt.returning:
             row = self._c.fetchone()
             self.lastrowid = row[0] if row else None
-        else:
-            self._c.execute(sql, params or ())
+        # SELECT: as linhas contam no fetch (rowcount do psycopg2 já seria o total)
+        rowcount = self._c.rowcount if self._c.description is None or stmt.returning else 0
+        self._labels = observe_query(query, params, started, rowcount)
+
+    def executemany(self, query, seq_of_params):
+        """Mesmo comando para cada conjunto de parâmetros, em lotes (execute_batch)."""
+        started = time.perf_counter()
+        stmt = pg_statement(query)
+        psycopg2.extras.execute_batch(self._c, stmt.text, seq_of_params, page_size=PG_BATCH_PAGE_SIZE)
+        self._labels = observe_query(query, None, started, max(self._c.rowcount, 0))
+
+    def execute_values(self, query, rows, template=None):
+        """INSERT com várias linhas por comando: o `?` de `VALUES ?` recebe as linhas.
+
+        template: formato de cada linha no estilo de query, ex. '(?, ?, CURRENT_TIMESTAMP)'.
+        """
+        started = time.perf_counter()
+        sql = pg_statement(query).text
+        if template is not None:
+            template = pg_statement(template).text
+        psycopg2.extras.execute_values(self._c, sql, rows, template=template, page_size=PG_BATCH_PAGE_SIZE)
+        self._labels = observe_query(query, None, started, len(rows))
+
+    @property
+    def rowcount(self):
+        return self._c.rowcount
+
+    def _fetched(self, rows):
+        if rows and self._labels is not None:
+            metrics.inc('sisregip_db_rows_total', self._labels, len(rows))
+        return rows
 
     def fetchall(self):
-        return self._c.fetchall()
+        return self._fetched(self._c.fetchall())
 
     def fetchone(self):
-        return self._c.fetchone()
+        row = self._c.fetchone()
+        if row is not None and self._labels is not None:
+            metrics.inc('sisregip_db_rows_total', self._labels)
+        return row
 
+    def fetchmany(self, size):
+        return self._fetched(self._c.fetchmany(size))
 
-class _PgConnection:
-    """Faz a conexão psycopg2 se comportar como sqlite3."""
+    def __iter__(self):
+        # Em lotes: no cursor do servidor (name=...) fetchone seria uma ida por linha
+        while True:
+            rows = self.fetchmany(PG_ITER_SIZE)
+            if not rows:
+                return
+            yield from rows
 
-    def __init__(self):
-        if _PG_URL:
-            self._conn = psycopg2.connect(_PG_URL)
-        else:
-            self._conn = psycopg2.connect(
-                host=_PG_HOST, port=_PG_PORT,
-                dbname=_PG_NAME, user=_PG_USER, password=_PG_PASS
-            )
+    def close(self):
+        self._c.close()
+
+
+class _SqliteCursor:
+    """Cursor sqlite3 com as mesmas métricas por consulta do _PgCursor."""
 
-    def cursor(self):
-        return _PgCursor(self._conn.cursor(cursor_factory=psycopg2.extras.DictCursor))
+    def __init__(self, cursor):
+        self._c = cursor
+        self._labels = None
+
+    def _run(self, method, query, params):
+        conn = self._c.connection
+        if conn.in_transaction:
+            # No meio da transação repetir só este comando não basta (a leitura já
+            # feita pode estar velha): o erro sobe e a rota desfaz tudo
+            return method(query, params)
+
+        def desfazer():
+            # BEGIN implícito aberto por este comando: ainda não há nada a perder
+            if conn.in_transaction:
+                conn.rollback()
+
+        return sqlite_retry(method, query, params, on_busy=desfazer)
 
     def execute(self, query, params=None):
-        # Chamado apenas para PRAGMA no SQLite, ignorado no PostgreSQL
-        pass
+        started = time.perf_counter()
+        self._run(self._c.execute, query, params or ())
+        self._labels = observe_query(query, params, started, max(self._c.rowcount, 0))
+        return self
+
+    def executemany(self, query, seq_of_params):
+        started = time.perf_counter()
+        self._run(self._c.executemany, query, seq_of_params)
+        self._labels = observe_query(query, None, started, max(self._c.rowcount, 0))
+        return self
+
+    def _fetched(self, rows):
+        if rows and self._labels is not None:
+            metrics.inc('sisregip_db_rows_total', self._labels, len(rows))
+        return rows
+
+    def fetchall(self):
+        return self._fetched(self._c.fetchall())
+
+    def fetchone(self):
+        row = self._c.fetchone()
+        if row is not None and self._labels is not None:
+            metrics.inc('sisregip_db_rows_total', self._labels)
+        return row
+
+    def fetchmany(self, size):
+        return self._fetched(self._c.fetchmany(size))
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        # lastrowid, rowcount, description, close...
+        return getattr(self._c, name)
+
+
+class _PooledConnection:
+    """Conexão emprestada do pool: close() devolve ao pool em vez de fechar."""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn, self._born = pool.acquire()
 
     def commit(self):
         self._conn.commit()
 
+    def rollback(self):
+        self._conn.rollback()
+
     def close(self):
-        self._conn.close()
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn, self._born)
 
+    def __enter__(self):
+        return self
 
-if not USE_POSTGRES and not os.path.exists(SQLITE_DB_PATH):
-    print("=" * 60)
-    print("ERRO: Sem credenciais PostgreSQL no .env e banco SQLite não encontrado:")
-    print(f"  {SQLITE_DB_PATH}")
-    print("=" * 60)
-    input("\nPressione ENTER para sair...")
-    sys.exit(1)
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
 
-if USE_POSTGRES:
-    print(f"Banco de dados: PostgreSQL ({_PG_HOST}:{_PG_PORT}/{_PG_NAME})")
-else:
-    print(f"Banco de dados: SQLite ({SQLITE_DB_PATH})")
+    def __del__(self):
+        # Só rede de segurança (depende do GC): o código devolve a conexão com
+        # `with get_connection() as conn` ou try/finally
+        try:
+            self.close()
+        except Exception:
+            pass
 
 
-def get_connection():
-    """Retorna conexão com PostgreSQL (primário) ou SQLite (secundário)."""
-    if USE_POSTGRES:
-        return _PgConnection()
-    conn = sqlite3.connect(SQLITE_DB_PATH)
+class _PgConnection(_PooledConnection):
+    """Faz a conexão psycopg2 se comportar como sqlite3."""
+
+    def cursor(self, name=None):
+        # Com name, cursor do lado do servidor: fetchmany traz lotes sem materializar tudo
+        return _PgCursor(self._conn.cursor(name=name, cursor_factory=psycopg2.extras.DictCursor), named=name is not None)
+
+    def execute(self, query, params=None):
+        # Chamado apenas para PRAGMA no SQLite, ignorado no PostgreSQL
+        pass
+
+
+class _SqliteConnection(_PooledConnection):
+    """Conexão sqlite3 reaproveitada entre requisições."""
+
+    def commit(self):
+        # COMMIT que esbarra em SQLITE_BUSY mantém a transação aberta: pode repetir
+        sqlite_retry(self._conn.commit)
+
+    def cursor(self, name=None):
+        # O sqlite3 já lê linhas sob demanda; name só existe para o PostgreSQL
+        return _SqliteCursor(self._conn.cursor())
+
+    def execute(self, query, params=None):
+        return self.cursor().execute(query, params)
+
+
+def _pg_connect():
+    if _PG_URL:
+        return psycopg2.connect(_PG_URL)
+    return psycopg2.connect(
+        host=_PG_HOST, port=_PG_PORT,
+        dbname=_PG_NAME, user=_PG_USER, password=_PG_PASS
+    )
+
+
+def _pg_ping(conn):
+    with conn.cursor() as cur:
+        cur.execute('SELECT 1')
+    conn.rollback()
+
+
+def _pg_reset(conn):
+    if conn.closed:
+        raise psycopg2.InterfaceError("conexão fechada")
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+
+
+# PERFIL SQLITE
+# WAL: leitores não esperam o escritor e o escritor não espera os leitores; com WAL,
+# synchronous=NORMAL não corrompe o banco numa queda de energia (pode perder só as
+# últimas transações). WAL exige que todos os processos que abrem o banco rodem na
+# mesma máquina: se outros computadores abrem o arquivo pela rede, use
+# SQLITE_JOURNAL_MODE=DELETE. cache_size negativo é em KiB; mmap_size 0 desliga.
+SQLITE_JOURNAL_MODES = ('WAL', 'DELETE', 'TRUNCATE', 'PERSIST')
+SQLITE_SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL').upper()
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', '-65536'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))  # ms, espera dentro do SQLite
+SQLITE_CACHED_STATEMENTS = 256  # comandos compilados em cache por conexão (padrão do sqlite3: 128)
+# SQLITE_BUSY que o SQLite devolve sem esperar (ex.: dois escritores trocando de
+# leitura para escrita em WAL) é repetido com espera exponencial
+SQLITE_BUSY_RETRIES = int(os.getenv('SQLITE_BUSY_RETRIES', '5'))
+SQLITE_BUSY_BACKOFF = 0.05
+SQLITE_OPTIMIZE_INTERVAL = float(os.getenv('SQLITE_OPTIMIZE_INTERVAL', '3600'))
+
+if SQLITE_JOURNAL_MODE not in SQLITE_JOURNAL_MODES:
+    print(f"AVISO: SQLITE_JOURNAL_MODE={SQLITE_JOURNAL_MODE} inválido; usando WAL")
+    SQLITE_JOURNAL_MODE = 'WAL'
+if SQLITE_SYNCHRONOUS not in SQLITE_SYNCHRONOUS_MODES:
+    print(f"AVISO: SQLITE_SYNCHRONOUS={SQLITE_SYNCHRONOUS} inválido; usando NORMAL")
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+
+
+def sqlite_busy(exc):
+    """True se o erro do sqlite3 é SQLITE_BUSY/SQLITE_LOCKED (banco ocupado)."""
+    message = str(exc)
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def sqlite_retry(func, *args, on_busy=None):
+    """Chama func(*args), repetindo em SQLITE_BUSY com espera exponencial e jitter.
+
+    on_busy roda antes de cada nova tentativa (ex.: desfazer BEGIN implícito).
+    """
+    for tentativa in range(SQLITE_BUSY_RETRIES + 1):
+        try:
+            return func(*args)
+        except sqlite3.OperationalError as e:
+            if tentativa == SQLITE_BUSY_RETRIES or not sqlite_busy(e):
+                raise
+            if on_busy is not None:
+                on_busy()
+            metrics.inc('sisregip_db_busy_retries_total')
+            time.sleep(SQLITE_BUSY_BACKOFF * 2 ** tentativa * random.uniform(0.5, 1.5))
+
+
+def _sqlite_connect():
+    # check_same_thread=False: a conexão troca de thread entre requisições, mas
+    # o pool garante que só uma thread a usa por vez
+    conn = sqlite3.connect(SQLITE_DB_PATH, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT / 1000,
+                           cached_statements=SQLITE_CACHED_STATEMENTS)
     conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = {SQLITE_CACHE_SIZE}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    # Mesma normalização da busca (fold_text) disponível no SQL, como no PostgreSQL
+    conn.create_function('sisregip_fold', 1, _sqlite_fold, deterministic=True)
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def get_secretaria_connection():
-    """Retorna conexão READ-ONLY com SQLite (Secretaria SAME)."""
-    uri = f"file:{SECRETARIA_DB_PATH}?mode=ro"
-    conn = sqlite3.connect(uri, uri=True)
-    conn.row_factory = sqlite3.Row
-    return conn
+def _sqlite_fold(value):
+    return None if value is None else fold_text(value)
 
-# FUNÇÕES AUXILIARES (extraídas para eliminar duplicação)
-def registrar_acao(operador, acao, detalhes=''):
-    """Registra ação de auditoria no banco. Falha silenciosa."""
+
+def _sqlite_ping(conn):
+    conn.execute('SELECT 1').fetchone()
+
+
+def _sqlite_reset(conn):
+    if conn.in_transaction:
+        conn.rollback()
+
+
+def check_database():
+    """Mostra o banco em uso; sem PostgreSQL e sem o arquivo SQLite, encerra."""
+    if USE_POSTGRES:
+        print(f"Banco de dados: PostgreSQL ({_PG_HOST}:{_PG_PORT}/{_PG_NAME})")
+        return
+    if not os.path.exists(SQLITE_DB_PATH):
+        print("=" * 60)
+        print("ERRO: Sem credenciais PostgreSQL no .env e banco SQLite não encontrado:")
+        print(f"  {SQLITE_DB_PATH}")
+        print("=" * 60)
+        input("\nPressione ENTER para sair...")
+        sys.exit(1)
+    print(f"Banco de dados: SQLite ({SQLITE_DB_PATH})")
+
+
+# As conexões só são abertas no primeiro uso
+if USE_POSTGRES:
+    _pool = _ConnectionPool(_pg_connect, _pg_ping, _pg_reset, DB_POOL_SIZE,
+                            DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PING_AFTER)
+else:
+    _pool = _ConnectionPool(_sqlite_connect, _sqlite_ping, _sqlite_reset, DB_POOL_SIZE,
+                            DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PING_AFTER)
+atexit.register(_pool.close_all)
+
+
+def get_connection():
+    """Retorna conexão do pool com PostgreSQL (primário) ou SQLite (secundário)."""
+    if USE_POSTGRES:
+        return _PgConnection(_pool)
+    return _SqliteConnection(_pool)
+
+
+def ensure_sqlite_profile():
+    """Journal do banco SQLite (fica gravado no arquivo) e estatísticas do otimizador."""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO registro_operacional (operador, acao, detalhes, data_hora)
-            VALUES (?, ?, ?, ?)
-        ''', (operador or 'NÃO IDENTIFICADO', acao, detalhes, datetime.now().strftime('%d/%m/%Y %H:%M:%S')))
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            mode = conn.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}").fetchone()[0]
+            if mode.upper() != SQLITE_JOURNAL_MODE:
+                print(f"AVISO: SQLite em journal_mode={mode} (pedido {SQLITE_JOURNAL_MODE}); banco em uso?")
+            # Analisa só o que estiver desatualizado, com limite de trabalho
+            conn.execute("PRAGMA optimize = 0x10002")
     except Exception:
-        logging.error("Erro ao registrar auditoria", exc_info=True)
+        logging.error("Erro ao configurar o SQLite", exc_info=True)
 
-def parse_date(value, fmt='%d/%m/%Y'):
-    """Converte string de data para date. Retorna None se inválido/vazio."""
-    if not value or not value.strip():
-        return None
-    try:
-        return datetime.strptime(value.strip(), fmt).date().isoformat()
-    except ValueError:
-        return None
 
+class SqliteOptimizer:
+    """Roda PRAGMA optimize a cada SQLITE_OPTIMIZE_INTERVAL segundos e no encerramento.
 
-def format_date_br(date_str):
-    """Converte data ISO (YYYY-MM-DD) para formato BR (DD/MM/YYYY)."""
-    if date_str is None:
-        return ''
-    # psycopg2 retorna datetime.date, não string
-    if hasattr(date_str, 'strftime'):
-        return date_str.strftime('%d/%m/%Y')
-    if not str(date_str).strip():
-        return ''
-    try:
-        return datetime.strptime(str(date_str).strip(), '%Y-%m-%d').strftime('%d/%m/%Y')
-    except ValueError:
-        return str(date_str)
+    O SQLite recomenda o comando periódico em processos de vida longa: ele refaz
+    ANALYZE das tabelas cujas estatísticas ficaram velhas.
+    """
 
+    def __init__(self, interval):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sqlite-optimize', daemon=True)
+        self.runs = 0
 
-def get_or_none(value):
-    """Retorna None se valor for vazio/whitespace, senão retorna o valor."""
-    if not value or not str(value).strip():
-        return None
-    return value
+    def start(self):
+        if self._interval > 0:
+            self._thread.start()
 
+    def optimize(self):
+        try:
+            with get_connection() as conn:
+                conn.execute("PRAGMA optimize")
+            self.runs += 1
+        except Exception:
+            logging.error("Erro no PRAGMA optimize", exc_info=True)
 
-def resolve_usuario(cursor, nome, pmh=None):
-    """Busca usuario por nome ou cria novo. Retorna id ou None."""
-    if not nome or not nome.strip():
-        return None
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.optimize()
 
-    cursor.execute('SELECT id FROM usuario WHERE nome = ?', (nome,))
-    result = cursor.fetchone()
-    if result:
-        return result[0]
+    def close(self):
+        self._stop.set()
+        self.optimize()
 
-    cursor.execute(
-        'INSERT INTO usuario (nome, prontuario) VALUES (?, ?)',
-        (nome, get_or_none(pmh))
-    )
-    return cursor.lastrowid
 
+sqlite_optimizer = SqliteOptimizer(SQLITE_OPTIMIZE_INTERVAL)  # iniciado em init_app (só SQLite)
 
-def resolve_recebedor(cursor, nome):
-    """Busca recebedor por nome ou cria novo. Retorna id ou None."""
-    if not nome or not nome.strip():
-        return None
 
-    cursor.execute('SELECT id FROM recebedor WHERE nome = ?', (nome,))
-    result = cursor.fetchone()
-    if result:
-        return result[0]
+# Carimbo de escrita (updated_at). No SQLite, CURRENT_TIMESTAMP só tem segundos;
+# strftime('%f') mantém o mesmo formato UTC com milissegundos. No PostgreSQL,
+# CURRENT_TIMESTAMP é o início da transação: clock_timestamp() é a hora da escrita.
+NOW_SQL = "clock_timestamp()" if USE_POSTGRES else "strftime('%Y-%m-%d %H:%M:%f', 'now')"
 
-    cursor.execute(
-        'INSERT INTO recebedor (nome) VALUES (?)',
-        (nome,)
-    )
-    return cursor.lastrowid
+# Índices auxiliares criados na inicialização se ainda não existirem
+SCHEMA_STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS idx_protocolo_updated_at ON protocolo (updated_at)",
+    # Filtros por período sempre vêm com ativo = TRUE: busca por faixa de datas no índice
+    "CREATE INDEX IF NOT EXISTS idx_protocolo_ativo_data ON protocolo (ativo, data_protocolo)",
+]
 
 
-def open_file(filepath):
-    """Abre arquivo com aplicativo padrão do sistema."""
+def ensure_schema():
+    """Cria índices auxiliares que faltarem. Falha silenciosa (apenas log)."""
     try:
-        system = platform.system()
-        if system == "Windows":
-            os.startfile(filepath)
-        elif system == "Darwin":
-            subprocess.Popen(['open', filepath])
-        else:
-            subprocess.Popen(['xdg-open', filepath])
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            for statement in SCHEMA_STATEMENTS:
+                cursor.execute(statement)
+            conn.commit()
     except Exception:
-        logging.error(f"Erro ao abrir arquivo {filepath}", exc_info=True)
+        logging.error("Erro ao criar índices auxiliares", exc_info=True)
 
 
-def is_page_blank(page, content_threshold=100):
-    """Verifica se página PDF está em branco."""
-    text = page.extract_text()
-    if text and text.strip():
-        return False
-    content = page.get_contents()
-    if not content or len(content.get_data()) < content_threshold:
-        return True
-    return False
 
 
-def build_report_html(rows, total, entregues, pendentes):
-    """Gera HTML do relatório de protocolos."""
-    now = datetime.now().strftime('%d/%m/%Y %H:%M')
+# ÍNDICE DE BUSCA
+# PostgreSQL: índices GIN de trigramas (pg_trgm) sobre o texto sem acento.
+# SQLite: tabela FTS5 `protocolo_busca` (rowid = protocolo.id), mantida por triggers.
+# Sem as extensões/FTS5, a busca cai para LIKE sem índice.
+SEARCH_PG_STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() não é IMMUTABLE; o wrapper com dicionário fixo pode ser usado em índice
+    '''CREATE OR REPLACE FUNCTION sisregip_fold(text) RETURNS text
+        LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+        AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, lower($1)) $$''',
+    "CREATE INDEX IF NOT EXISTS idx_usuario_nome_trgm ON usuario USING gin (sisregip_fold(nome) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_recebedor_nome_trgm ON recebedor USING gin (sisregip_fold(nome) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_protocolo_prot_trgm ON protocolo USING gin (prot gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_protocolo_pmh_trgm ON protocolo USING gin (pmh gin_trgm_ops)",
+]
 
-    # Monta linhas da tabela com escape básico contra XSS
-    def esc(val):
-        return str(val).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+# Só protocolos ativos ficam no índice; nomes vêm de usuario/recebedor no momento da escrita
+_SEARCH_FTS_ROW = '''
+    new.id,
+    (SELECT nome FROM usuario WHERE id = new.usuario_id),
+    new.prot,
+    new.pmh,
+    (SELECT nome FROM recebedor WHERE id = new.recebedor_id)
+'''
 
-    rows_html = ""
-    for row in rows:
-        rows_html += (
-            f"<tr>"
-            f"<td>{esc(row[0])}</td>"
-            f"<td>{esc(row[1])}</td>"
-            f'<td style="text-align: left;">{esc(row[2])}</td>'
-            f"<td>{esc(row[3])}</td>"
-            f"<td>{esc(row[4])}</td>"
-            f"<td>{esc(row[5])}</td>"
-            f"</tr>\n"
-        )
+SEARCH_SQLITE_STATEMENTS = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS protocolo_busca USING fts5(
+        nome, prot, pmh, recebedor,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )''',
+    f'''CREATE TRIGGER IF NOT EXISTS protocolo_busca_ai AFTER INSERT ON protocolo
+        WHEN new.ativo BEGIN
+            INSERT INTO protocolo_busca (rowid, nome, prot, pmh, recebedor) VALUES ({_SEARCH_FTS_ROW});
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS protocolo_busca_au AFTER UPDATE ON protocolo BEGIN
+            DELETE FROM protocolo_busca WHERE rowid = old.id;
+            INSERT INTO protocolo_busca (rowid, nome, prot, pmh, recebedor)
+                SELECT {_SEARCH_FTS_ROW} WHERE new.ativo;
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS protocolo_busca_ad AFTER DELETE ON protocolo BEGIN
+            DELETE FROM protocolo_busca WHERE rowid = old.id;
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS usuario_busca_au AFTER UPDATE OF nome ON usuario BEGIN
+            UPDATE protocolo_busca SET nome = new.nome
+            WHERE rowid IN (SELECT id FROM protocolo WHERE usuario_id = new.id AND ativo);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS recebedor_busca_au AFTER UPDATE OF nome ON recebedor BEGIN
+            UPDATE protocolo_busca SET recebedor = new.nome
+            WHERE rowid IN (SELECT id FROM protocolo WHERE recebedor_id = new.id AND ativo);
+        END''',
+]
 
-    return f'''<!DOCTYPE html>
+SEARCH_INDEX = False  # True quando pg_trgm/unaccent ou FTS5 estão disponíveis
+SEARCH_LIMIT = 20
+SEARCH_LIMIT_MAX = 100
+
+
+def ensure_search_index():
+    """Cria o índice de busca do backend ativo. Cada passo em transação própria:
+    sem permissão para CREATE EXTENSION (ou SQLite sem FTS5) a busca usa LIKE."""
+    global SEARCH_INDEX
+    statements = SEARCH_PG_STATEMENTS if USE_POSTGRES else SEARCH_SQLITE_STATEMENTS
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        for statement in statements:
+            cursor.execute(statement)
+            conn.commit()
+        if not USE_POSTGRES:
+            # Primeira criação (ou índice perdido): carrega os protocolos existentes
+            cursor.execute('SELECT COUNT(*) FROM protocolo_busca')
+            if cursor.fetchone()[0] == 0:
+                cursor.execute('''
+                    INSERT INTO protocolo_busca (rowid, nome, prot, pmh, recebedor)
+                    SELECT p.id, u.nome, p.prot, p.pmh, r.nome
+                    FROM protocolo p
+                    LEFT JOIN usuario u ON p.usuario_id = u.id
+                    LEFT JOIN recebedor r ON p.recebedor_id = r.id
+                    WHERE p.ativo
+                ''')
+                conn.commit()
+        SEARCH_INDEX = True
+    except Exception:
+        conn.rollback()
+        logging.error("Índice de busca indisponível; usando LIKE sem índice", exc_info=True)
+    finally:
+        conn.close()
+
+
+
+
+def fold_sql(expr):
+    """`expr` normalizado no banco como fold_text: sisregip_fold (registrada em toda
+    conexão SQLite; no PostgreSQL criada com unaccent). PostgreSQL sem unaccent:
+    só minúsculas."""
+    if USE_POSTGRES and not SEARCH_INDEX:
+        return f"LOWER({expr})"
+    return f"sisregip_fold({expr})"
+
+
+def fold_param(value):
+    """Texto comparado com fold_sql(...): a mesma normalização dos dois lados."""
+    if USE_POSTGRES and not SEARCH_INDEX:
+        return str(value).lower()
+    return fold_text(value)
+
+
+def search_tokens(term):
+    """Palavras do termo de busca, minúsculas e sem acento."""
+    return re.findall(r'[^\W_]+', fold_param(term or ''))
+
+
+def prot_substring(tokens):
+    """Padrão LIKE para achar o número do protocolo por trecho ('1234' acha '0001234').
+
+    O FTS5 só casa prefixos de token; só termos com dígito ganham o ramo por trecho
+    (varredura), para a busca por nome seguir só no índice. None se não houver dígito.
+    """
+    if not any(ch.isdigit() for t in tokens for ch in t):
+        return None
+    return '%' + '%'.join(tokens) + '%'
+
+
+def search_condition(term):
+    """Condição WHERE (sobre p/u) para o termo: nome do paciente ou número do protocolo.
+
+    Usa o índice de busca quando disponível. Retorna (sql, params) ou None se o
+    termo não tiver palavras.
+    """
+    tokens = search_tokens(term)
+    if not tokens:
+        return None
+    if SEARCH_INDEX and not USE_POSTGRES:
+        match = ' '.join(f'"{t}"*' for t in tokens)
+        condicao = "p.id IN (SELECT rowid FROM protocolo_busca WHERE protocolo_busca MATCH ?)"
+        padrao = prot_substring(tokens)
+        if padrao:
+            return f"({condicao} OR p.prot LIKE ?)", [match, padrao]
+        return condicao, [match]
+    padrao = '%' + '%'.join(tokens) + '%'
+    return f"({fold_sql('u.nome')} LIKE ? OR p.prot LIKE ?)", [padrao, padrao]
+
+
+# Secretaria em modo cópia (SECRETARIA_SNAPSHOT=1): o banco da rede é copiado para
+# o disco local pela API de backup do SQLite, que lê um retrato consistente mesmo
+# com a Secretaria gravando, e a cópia é aberta com immutable=1 (sem locks nem
+# checagem de mudança). A cópia só é refeita quando mtime/tamanho do original mudam.
+# Cada cópia é um arquivo novo (nome.N.db): leitores abertos seguem na versão que
+# abriram (no Windows não dá para substituir nem apagar arquivo aberto), e a versão
+# antiga é apagada quando o último leitor dela fecha. Nome padrão por host e pid:
+# dois processos na mesma máquina não disputam os arquivos.
+SECRETARIA_SNAPSHOT = os.getenv('SECRETARIA_SNAPSHOT', '0') == '1'
+SECRETARIA_SNAPSHOT_PATH = (os.getenv('SECRETARIA_SNAPSHOT_PATH')
+                            or os.path.join(tempfile.gettempdir(),
+                                            f"sisregip_secretaria_{platform.node() or 'local'}_{os.getpid()}.db"))
+_secretaria_snapshot_lock = threading.Lock()
+_secretaria_snapshot_signature = None
+_secretaria_snapshot_path = None  # versão atual; None até a primeira cópia
+_secretaria_snapshot_version = 0
+_secretaria_snapshot_readers = collections.Counter()  # caminho -> conexões abertas
+_secretaria_snapshot_retired = set()  # versões antigas esperando o último leitor
+
+
+def sqlite_file_signature(path):
+    """(mtime, tamanho) do banco e do -wal: muda quando alguém grava no banco."""
+    sig = []
+    for file_path in (path, f"{path}-wal"):
+        try:
+            st = os.stat(file_path)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            sig.append(None)
+    return tuple(sig)
+
+
+def _purge_secretaria_snapshots():
+    """Apaga versões antigas sem leitores. Chamar com _secretaria_snapshot_lock."""
+    for path in list(_secretaria_snapshot_retired):
+        if _secretaria_snapshot_readers[path]:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            continue  # ainda aberto por alguém (antivírus, indexador): próxima rodada
+        _secretaria_snapshot_retired.discard(path)
+        del _secretaria_snapshot_readers[path]
+
+
+def refresh_secretaria_snapshot():
+    """Atualiza a cópia local do banco da Secretaria se o original mudou.
+
+    Retorna o caminho da versão atual. Chamar com _secretaria_snapshot_lock.
+    """
+    global _secretaria_snapshot_signature, _secretaria_snapshot_path, _secretaria_snapshot_version
+    signature = sqlite_file_signature(SECRETARIA_DB_PATH)
+    if signature == _secretaria_snapshot_signature and _secretaria_snapshot_path:
+        return _secretaria_snapshot_path
+
+    _secretaria_snapshot_version += 1
+    raiz, ext = os.path.splitext(SECRETARIA_SNAPSHOT_PATH)
+    path = f"{raiz}.{_secretaria_snapshot_version}{ext or '.db'}"
+    source = sqlite3.connect(f"file:{SECRETARIA_DB_PATH}?mode=ro", uri=True)
+    try:
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    except Exception:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        raise
+    finally:
+        source.close()
+
+    if _secretaria_snapshot_path:
+        _secretaria_snapshot_retired.add(_secretaria_snapshot_path)
+    _secretaria_snapshot_path = path
+    _secretaria_snapshot_signature = signature
+    _purge_secretaria_snapshots()
+    return path
+
+
+def release_secretaria_snapshot(path):
+    """Um leitor da versão `path` fechou: apaga as versões antigas que ficaram sem leitores."""
+    with _secretaria_snapshot_lock:
+        _secretaria_snapshot_readers[path] -= 1
+        _purge_secretaria_snapshots()
+
+
+def remove_secretaria_snapshots():
+    """Na saída do processo: apaga a versão atual e as antigas (leitores já fecharam)."""
+    with _secretaria_snapshot_lock:
+        if _secretaria_snapshot_path:
+            _secretaria_snapshot_retired.add(_secretaria_snapshot_path)
+        _secretaria_snapshot_readers.clear()
+        _purge_secretaria_snapshots()
+
+
+atexit.register(remove_secretaria_snapshots)
+
+
+class _SnapshotConnection(sqlite3.Connection):
+    """Conexão com uma versão da cópia local: ao fechar, libera a versão."""
+
+    snapshot_path = None
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            path, self.snapshot_path = self.snapshot_path, None
+            if path:
+                release_secretaria_snapshot(path)
+
+
+def get_secretaria_connection():
+    """Retorna conexão READ-ONLY com SQLite (Secretaria SAME)."""
+    if not SECRETARIA_SNAPSHOT:
+        conn = sqlite3.connect(f"file:{SECRETARIA_DB_PATH}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    with _secretaria_snapshot_lock:
+        path = refresh_secretaria_snapshot()
+        _secretaria_snapshot_readers[path] += 1
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, factory=_SnapshotConnection)
+    except Exception:
+        release_secretaria_snapshot(path)
+        raise
+    conn.snapshot_path = path
+    conn.row_factory = sqlite3.Row
+    return conn
+
+# INSERT de várias linhas por comando. 999 é o limite de parâmetros do SQLite antigo
+# (SQLITE_MAX_VARIABLE_NUMBER); serve também para o PostgreSQL.
+SQL_MAX_PARAMS = 999
+
+
+def insert_many(cursor, tabela, colunas, rows, fixos=None, ignorar=False):
+    """Grava `rows` com VALUES (...), (...), em blocos dentro de SQL_MAX_PARAMS
+    (no PostgreSQL, com execute_values em páginas de PG_BATCH_PAGE_SIZE linhas).
+
+    fixos: {coluna: expressão SQL} repetida em toda linha (ex.: NOW_SQL).
+    ignorar: linhas que violam índice único são puladas em vez de abortar.
+    """
+    fixos = fixos or {}
+    linha = f"({', '.join(['?'] * len(colunas) + list(fixos.values()))})"
+    verbo = 'INSERT OR IGNORE' if ignorar and not USE_POSTGRES else 'INSERT'
+    sufixo = ' ON CONFLICT DO NOTHING' if ignorar and USE_POSTGRES else ''
+    prefixo = f"{verbo} INTO {tabela} ({', '.join(list(colunas) + list(fixos))}) VALUES "
+    if USE_POSTGRES:
+        # execute_values monta as linhas no cliente: sem o limite de parâmetros do SQLite
+        cursor.execute_values(f"{prefixo}?{sufixo}", rows, template=linha)
+        return
+    por_comando = max(SQL_MAX_PARAMS // len(colunas), 1)
+    for start in range(0, len(rows), por_comando):
+        chunk = rows[start:start + por_comando]
+        cursor.execute(prefixo + ', '.join([linha] * len(chunk)) + sufixo,
+                       [value for row in chunk for value in row])
+
+
+# AUDITORIA (gravação assíncrona)
+# Rotas só enfileiram a linha; uma thread grava em lotes (INSERT de várias linhas)
+# quando junta AUDIT_BATCH_SIZE linhas ou AUDIT_FLUSH_INTERVAL segundos passam.
+# Banco fora do ar: o lote vai para um diário local (JSON por linha) e é regravado
+# depois, a cada AUDIT_RETRY_INTERVAL segundos. O diário fica no disco da máquina,
+# um por computador: a pasta de rede é compartilhada por várias instâncias. Se
+# AUDIT_JOURNAL_PATH apontar para um lugar comum, travas de arquivo impedem que dois
+# processos regravem o mesmo diário (linhas duplicadas).
+AUDIT_QUEUE_MAX = int(os.getenv('AUDIT_QUEUE_MAX', '10000'))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '200'))
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', '1'))
+AUDIT_RETRY_INTERVAL = float(os.getenv('AUDIT_RETRY_INTERVAL', '30'))
+AUDIT_JOURNAL_PATH = os.getenv('AUDIT_JOURNAL_PATH') or os.path.join(
+    os.getenv('LOCALAPPDATA') or os.path.expanduser('~'), 'SISREGIP_Data',
+    f"auditoria_pendente_{platform.node() or 'local'}.jsonl")
+
+
+@contextlib.contextmanager
+def file_lock(path, wait=True):
+    """Trava exclusiva entre processos no arquivo `path` (criado se não existir).
+
+    Entrega True com a trava. Com wait=False entrega False na hora se outro
+    processo já tem a trava.
+    """
+    with open(path, 'a+b') as f:
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if wait else msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            if wait:
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            # No Windows a trava sai explicitamente; flock sai ao fechar o arquivo
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class AuditWriter:
+    """Fila limitada de registros de auditoria drenada por uma thread em lotes."""
+
+    def __init__(self, journal_path, queue_max, batch_size, flush_interval, retry_interval):
+        self._journal = journal_path
+        self._replaying = f"{journal_path}.replay"
+        # .lock: acréscimo x renomeação do diário; .replay.lock: quem está regravando
+        self._append_lock = f"{journal_path}.lock"
+        self._replay_lock = f"{journal_path}.replay.lock"
+        self._queue = queue.Queue(maxsize=queue_max)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._retry_interval = retry_interval
+        self._journal_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._retry_at = 0.0
+        self.written = 0
+        self.batches = 0
+        self.spilled = 0
+        self.replayed = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='auditoria', daemon=True)
+        self._thread.start()
+
+    def record(self, operador, acao, detalhes=''):
+        """Enfileira o registro com a hora atual. Não espera por banco nem disco."""
+        row = (operador, acao, detalhes, datetime.now().strftime('%d/%m/%Y %H:%M:%S'))
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Gravador travado (banco lento sem cair): não perde o registro
+            self._spill([row])
+
+    def _next_batch(self):
+        """Espera a primeira linha e junta as seguintes até encher o lote ou vencer o intervalo."""
+        try:
+            batch = [self._queue.get(timeout=self._flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        """Tudo que está na fila agora, sem esperar."""
+        rows = []
+        while True:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                return rows
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            try:
+                self._write(batch)
+            except Exception:
+                logging.error("Erro no gravador de auditoria", exc_info=True)
+
+    def _insert(self, rows):
+        """Grava as linhas numa única transação: ou entram todas ou nenhuma."""
+        conn = get_connection()
+        try:
+            insert_many(conn.cursor(), 'registro_operacional', ('operador', 'acao', 'detalhes', 'data_hora'), rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _write(self, batch):
+        """Grava o lote; com diário pendente, tenta antes regravá-lo para manter a ordem."""
+        if self._journal_pending():
+            if time.monotonic() < self._retry_at or not self._replay():
+                if batch:
+                    self._spill(batch)
+                return
+        if not batch:
+            return
+        try:
+            self._insert(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception:
+            logging.error("Banco indisponível para auditoria; lote salvo no diário local", exc_info=True)
+            self._retry_at = time.monotonic() + self._retry_interval
+            self._spill(batch)
+
+    def _spill(self, rows):
+        with self._journal_lock:
+            os.makedirs(os.path.dirname(self._journal) or '.', exist_ok=True)
+            with file_lock(self._append_lock), open(self._journal, 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.spilled += len(rows)
+
+    def _journal_pending(self):
+        return os.path.exists(self._replaying) or os.path.exists(self._journal)
+
+    def _replay(self):
+        """Regrava o diário no banco. Retorna True se não sobrou nada pendente.
+
+        O diário é renomeado antes da leitura: novos lotes que falharem vão para
+        um arquivo novo. Se a gravação falhar, o arquivo renomeado fica para a
+        próxima tentativa (a transação única evita linhas duplicadas). Outro
+        processo regravando o mesmo diário: retorna False e tenta na próxima rodada.
+        """
+        with file_lock(self._replay_lock, wait=False) as owner:
+            return owner and self._replay_locked()
+
+    def _replay_locked(self):
+        with self._journal_lock, file_lock(self._append_lock):
+            if not os.path.exists(self._replaying):
+                if not os.path.exists(self._journal):
+                    return True
+                os.replace(self._journal, self._replaying)
+
+        rows = []
+        with open(self._replaying, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    operador, acao, detalhes, data_hora = json.loads(line)
+                    rows.append((operador, acao, detalhes, data_hora))
+                except ValueError:
+                    logging.error(f"Linha inválida no diário de auditoria: {line!r}")
+        try:
+            self._insert(rows)
+        except Exception:
+            logging.error("Banco ainda indisponível para regravar o diário de auditoria", exc_info=True)
+            self._retry_at = time.monotonic() + self._retry_interval
+            return False
+        os.remove(self._replaying)
+        self.replayed += len(rows)
+        self.written += len(rows)
+        # Lotes que falharam durante a regravação: ficam para a próxima rodada
+        return not os.path.exists(self._journal)
+
+    def close(self):
+        """Para a thread e grava (ou salva no diário) o que ainda estiver na fila."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._flush_interval + 5)
+        self._retry_at = 0.0
+        try:
+            self._write(self._drain())
+        except Exception:
+            logging.error("Erro ao gravar auditoria no encerramento", exc_info=True)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "journal_pending": self._journal_pending(),
+        }
+
+
+audit_writer = AuditWriter(AUDIT_JOURNAL_PATH, AUDIT_QUEUE_MAX, AUDIT_BATCH_SIZE,
+                           AUDIT_FLUSH_INTERVAL, AUDIT_RETRY_INTERVAL)  # iniciado em init_app
+
+
+# FUNÇÕES AUXILIARES (extraídas para eliminar duplicação)
+def registrar_acao(operador, acao, detalhes=''):
+    """Registra ação de auditoria (gravação em segundo plano). Falha silenciosa."""
+    try:
+        audit_writer.record(operador or 'NÃO IDENTIFICADO', acao, detalhes)
+    except Exception:
+        logging.error("Erro ao registrar auditoria", exc_info=True)
+
+def parse_date(value, fmt='%d/%m/%Y'):
+    """Converte string de data para date. Retorna None se inválido/vazio."""
+    if not value or not value.strip():
+        return None
+    try:
+        return datetime.strptime(value.strip(), fmt).date().isoformat()
+    except ValueError:
+        return None
+
+
+def format_date_br(date_str):
+    """Converte data ISO (YYYY-MM-DD) para formato BR (DD/MM/YYYY)."""
+    if date_str is None:
+        return ''
+    # psycopg2 retorna datetime.date, não string
+    if hasattr(date_str, 'strftime'):
+        return date_str.strftime('%d/%m/%Y')
+    if not str(date_str).strip():
+        return ''
+    try:
+        return datetime.strptime(str(date_str).strip(), '%Y-%m-%d').strftime('%d/%m/%Y')
+    except ValueError:
+        return str(date_str)
+
+
+def get_or_none(value):
+    """Retorna None se valor for vazio/whitespace, senão retorna o valor."""
+    if not value or not str(value).strip():
+        return None
+    return value
+
+
+def fold_text(value):
+    """Normaliza texto para busca: minúsculas e sem acentos ('JOSÉ' -> 'jose')."""
+    decomposed = unicodedata.normalize('NFKD', str(value))
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def month_bounds(value):
+    """Converte 'YYYY-MM' em intervalo semiaberto [início, fim) de datas ISO."""
+    inicio = datetime.strptime(value.strip(), '%Y-%m').date()
+    fim = inicio.replace(year=inicio.year + 1, month=1) if inicio.month == 12 else inicio.replace(month=inicio.month + 1)
+    return inicio.isoformat(), fim.isoformat()
+
+
+def year_bounds(value):
+    """Converte 'YYYY' em intervalo semiaberto [início, fim) de datas ISO."""
+    ano = int(str(value).strip())
+    return f"{ano:04d}-01-01", f"{ano + 1:04d}-01-01"
+
+
+def range_bounds(inicio=None, fim=None):
+    """Converte período com datas inclusivas (ISO ou DD/MM/YYYY, qualquer ponta opcional)
+    em intervalo semiaberto [início, fim + 1 dia). Levanta ValueError se inválido."""
+    def parse(value):
+        value = (value or '').strip()
+        if not value:
+            return None
+        fmt = '%d/%m/%Y' if '/' in value else '%Y-%m-%d'
+        return datetime.strptime(value, fmt).date()
+
+    inicio, fim = parse(inicio), parse(fim)
+    if inicio and fim and inicio > fim:
+        raise ValueError("Data inicial maior que a final")
+    return (
+        inicio.isoformat() if inicio else None,
+        (fim + timedelta(days=1)).isoformat() if fim else None,
+    )
+
+
+def encode_cursor(data_protocolo, protocolo_id):
+    """Gera o cursor de paginação a partir da última linha entregue."""
+    data = data_protocolo.isoformat() if hasattr(data_protocolo, 'isoformat') else (data_protocolo or '')
+    return f"{data}~{protocolo_id}"
+
+
+def decode_cursor(token):
+    """Lê cursor 'YYYY-MM-DD~id' (data vazia = sem data). Levanta ValueError se inválido."""
+    data, _, protocolo_id = token.partition('~')
+    if data:
+        datetime.strptime(data, '%Y-%m-%d')
+    return data or None, int(protocolo_id)
+
+
+# CACHE DE NOMES (usuario / recebedor)
+# nome -> id em memória. O sistema só cria linhas nessas tabelas (não renomeia nem
+# apaga), então um id lido continua certo mesmo se outro terminal criar nomes.
+# Nome fora do cache: INSERT que ignora conflito no índice único de nome; se outro
+# terminal criou o mesmo nome ao mesmo tempo, o INSERT não faz nada e o id é lido.
+NAME_CACHE_SIZE = int(os.getenv('NAME_CACHE_SIZE', '2000'))
+
+
+class NameCache:
+    """LRU limitado de nome -> id, seguro entre threads."""
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._ids = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, nome):
+        with self._lock:
+            id_ = self._ids.get(nome)
+            if id_ is None:
+                self.misses += 1
+                return None
+            self._ids.move_to_end(nome)
+            self.hits += 1
+            return id_
+
+    def put(self, nome, id_):
+        with self._lock:
+            self._ids[nome] = id_
+            self._ids.move_to_end(nome)
+            while len(self._ids) > self._max_size:
+                self._ids.popitem(last=False)
+
+    def load(self, rows):
+        """Aquecimento: (nome, id) do menos para o mais recente."""
+        for nome, id_ in rows:
+            self.put(nome, id_)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._ids), "max_size": self._max_size,
+                    "hits": self.hits, "misses": self.misses}
+
+
+usuario_ids = NameCache(NAME_CACHE_SIZE)
+recebedor_ids = NameCache(NAME_CACHE_SIZE)
+
+# Índice único de nome criado em ensure_name_cache. Só vale True se a criação deu
+# certo: base com nomes repetidos gravados antes segue com SELECT antes do INSERT.
+NOME_UNICO_INDICES = {'usuario': 'uq_usuario_nome', 'recebedor': 'uq_recebedor_nome'}
+NOME_UNICO = {tabela: False for tabela in NOME_UNICO_INDICES}
+
+
+def insert_ignore_sql(tabela, colunas):
+    """INSERT que não faz nada se o nome já existir (rowcount 0)."""
+    sql = f"INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})"
+    if USE_POSTGRES:
+        return f"INSERT {sql} ON CONFLICT (nome) DO NOTHING"
+    return f"INSERT OR IGNORE {sql}"
+
+
+def ensure_name_cache():
+    """Cria os índices únicos de nome e aquece os caches. Falha silenciosa (apenas log)."""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            for tabela, indice in NOME_UNICO_INDICES.items():
+                try:
+                    cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {indice} ON {tabela} (nome)")
+                    conn.commit()
+                    NOME_UNICO[tabela] = True
+                except Exception:
+                    conn.rollback()
+                    logging.error(f"Índice único em {tabela}.nome não criado (nomes repetidos?); "
+                                  f"cadastro de {tabela} segue com SELECT antes do INSERT", exc_info=True)
+
+            cursor.execute('SELECT nome, id FROM recebedor ORDER BY id DESC LIMIT ?', (NAME_CACHE_SIZE,))
+            recebedor_ids.load(reversed(cursor.fetchall()))
+            # Pacientes com protocolo mais recente
+            cursor.execute('''
+                SELECT u.nome, u.id
+                FROM usuario u
+                JOIN (
+                    SELECT usuario_id, MAX(id) AS ultimo
+                    FROM protocolo
+                    WHERE usuario_id IS NOT NULL
+                    GROUP BY usuario_id
+                    ORDER BY ultimo DESC
+                    LIMIT ?
+                ) r ON r.usuario_id = u.id
+                ORDER BY r.ultimo
+            ''', (NAME_CACHE_SIZE,))
+            usuario_ids.load(cursor.fetchall())
+    except Exception:
+        logging.error("Erro ao aquecer cache de nomes", exc_info=True)
+
+
+def resolve_nome(cursor, tabela, cache, nome, colunas, valores):
+    """Id da linha de `tabela` com esse nome, criando se não existir. Retorna id ou None."""
+    if not nome or not nome.strip():
+        return None
+
+    id_ = cache.get(nome)
+    if id_ is not None:
+        return id_
+
+    if NOME_UNICO[tabela]:
+        cursor.execute(insert_ignore_sql(tabela, colunas), valores)
+        if cursor.rowcount == 1:
+            # Linha nova, ainda sem commit: entra no cache quando for lida de novo
+            return cursor.lastrowid
+
+    cursor.execute(f'SELECT id FROM {tabela} WHERE nome = ?', (nome,))
+    result = cursor.fetchone()
+    if result:
+        cache.put(nome, result[0])
+        return result[0]
+
+    cursor.execute(f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})", valores)
+    return cursor.lastrowid
+
+
+def resolve_usuario(cursor, nome, pmh=None):
+    """Busca usuario por nome ou cria novo. Retorna id ou None."""
+    return resolve_nome(cursor, 'usuario', usuario_ids, nome, ('nome', 'prontuario'), (nome, get_or_none(pmh)))
+
+
+def resolve_recebedor(cursor, nome):
+    """Busca recebedor por nome ou cria novo. Retorna id ou None."""
+    return resolve_nome(cursor, 'recebedor', recebedor_ids, nome, ('nome',), (nome,))
+
+
+def resolve_nomes(cursor, tabela, cache, valores, colunas):
+    """resolve_nome em lote: {nome: valores da linha nova} -> {nome: id}.
+
+    Uma consulta para os nomes fora do cache, um INSERT para os que não existem
+    e outra consulta para os ids criados (que só entram no cache depois, como em
+    resolve_nome).
+    """
+    ids = {}
+    faltam = []
+    for nome in valores:
+        id_ = cache.get(nome)
+        if id_ is None:
+            faltam.append(nome)
+        else:
+            ids[nome] = id_
+
+    def buscar(nomes):
+        achados = {}
+        for start in range(0, len(nomes), SQL_MAX_PARAMS):
+            part = nomes[start:start + SQL_MAX_PARAMS]
+            cursor.execute(f"SELECT nome, id FROM {tabela} WHERE nome IN ({', '.join('?' * len(part))})", part)
+            achados.update((nome, id_) for nome, id_ in cursor.fetchall())
+        return achados
+
+    if faltam:
+        achados = buscar(faltam)
+        for nome, id_ in achados.items():
+            cache.put(nome, id_)
+        ids.update(achados)
+        novos = [nome for nome in faltam if nome not in achados]
+        if novos:
+            insert_many(cursor, tabela, colunas, [valores[nome] for nome in novos], ignorar=NOME_UNICO[tabela])
+            ids.update(buscar(novos))
+    return ids
+
+
+
+
+def open_file(filepath):
+    """Abre arquivo com aplicativo padrão do sistema."""
+    try:
+        system = platform.system()
+        if system == "Windows":
+            os.startfile(filepath)
+        elif system == "Darwin":
+            subprocess.Popen(['open', filepath])
+        else:
+            subprocess.Popen(['xdg-open', filepath])
+    except Exception:
+        logging.error(f"Erro ao abrir arquivo {filepath}", exc_info=True)
+
+
+# Páginas em branco: análise em processos separados (pypdf é Python puro e a GIL
+# impediria usar mais de um núcleo com threads), com vereditos em cache por
+# hash do conteúdo do arquivo. BLANK_WORKERS=0 analisa na própria thread do job.
+BLANK_WORKERS = int(os.getenv('BLANK_WORKERS', str(min(4, os.cpu_count() or 1))))
+BLANK_CHUNK_PAGES = 16
+BLANK_CACHE_FILES = 1000
+
+
+def file_sha1(path):
+    """Hash SHA-1 do conteúdo do arquivo (lido em blocos)."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(bloco)
+    return digest.hexdigest()
+
+
+class BlankPageDetector:
+    """Detecta páginas em branco em paralelo, guardando os vereditos por arquivo.
+
+    A chave do cache é (hash do conteúdo, regras): mesclar de novo a mesma pasta
+    depois de incluir um arquivo só analisa as páginas do arquivo novo, e um
+    arquivo renomeado ou copiado continua aproveitando o cache.
+    """
+
+    def __init__(self, workers, cache_files):
+        self._workers = workers
+        self._executor = None
+        self._cache = collections.OrderedDict()  # (sha1, regras) -> [bool por página]
+        self._cache_files = cache_files
+        self._lock = threading.Lock()
+        self.pages_analyzed = 0
+        self.pages_cached = 0
+
+    def _get_executor(self):
+        # Processos só sobem na primeira mesclagem com remoção de páginas em branco
+        with self._lock:
+            if self._executor is None and self._workers > 0:
+                # spawn em todo sistema: fork copiaria as threads e travas do servidor
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self._workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _cache_get(self, key):
+        with self._lock:
+            verdicts = self._cache.get(key)
+            if verdicts is not None:
+                self._cache.move_to_end(key)
+            return verdicts
+
+    def _cache_put(self, key, verdicts):
+        with self._lock:
+            self._cache[key] = verdicts
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_files:
+                self._cache.popitem(last=False)
+
+    def analyze(self, files, job):
+        """Vereditos (True = em branco) de cada página.
+
+        files: lista de (caminho, nº de páginas). Atualiza job.pages_analyzed e
+        para (JobCancelled) se o job for cancelado. Retorna {caminho: [bool]}.
+        """
+        result = {}
+        chunks = []  # (caminho, índices)
+        keys = {}
+        copias = {}  # caminho -> caminho com o mesmo conteúdo já na fila
+        for path, total in files:
+            key = (file_sha1(path), pdf_blank.RULES)
+            cached = self._cache_get(key)
+            if cached is not None and len(cached) == total:
+                result[path] = cached
+                job.pages_analyzed += total
+                self.pages_cached += total
+                continue
+            original = next((p for p, k in keys.items() if k == key), None)
+            if original is not None:
+                copias[path] = original
+                continue
+            keys[path] = key
+            result[path] = [False] * total
+            for inicio in range(0, total, BLANK_CHUNK_PAGES):
+                chunks.append((path, list(range(inicio, min(inicio + BLANK_CHUNK_PAGES, total)))))
+
+        if chunks:
+            executor = self._get_executor()
+            if executor is None:
+                for path, indices in chunks:
+                    job.check_cancel()
+                    self._store(result, job, path, indices, pdf_blank.analyze_pages(path, indices))
+            else:
+                futures = {executor.submit(pdf_blank.analyze_pages, path, indices): (path, indices)
+                           for path, indices in chunks}
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        job.check_cancel()
+                        path, indices = futures[future]
+                        self._store(result, job, path, indices, future.result())
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+        for path, key in keys.items():
+            self._cache_put(key, result[path])
+        for path, original in copias.items():
+            result[path] = result[original]
+            job.pages_analyzed += len(result[path])
+        return result
+
+    def _store(self, result, job, path, indices, verdicts):
+        for i, blank in zip(indices, verdicts):
+            result[path][i] = blank
+        job.pages_analyzed += len(indices)
+        self.pages_analyzed += len(indices)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+blank_detector = BlankPageDetector(BLANK_WORKERS, BLANK_CACHE_FILES)
+atexit.register(blank_detector.shutdown)
+
+
+REPORT_FETCH_SIZE = 500
+
+
+def _report_esc(val):
+    """Escape básico contra XSS."""
+    return str(val).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def iter_report_body(rows):
+    """Linhas <tr> do relatório em lotes de REPORT_FETCH_SIZE.
+
+    `rows` pode ser qualquer iterável (inclusive um gerador lendo o cursor aos
+    poucos); o documento inteiro nunca fica em memória.
+    """
+    lote = []
+    for row in rows:
+        lote.append(
+            f"<tr>"
+            f"<td>{_report_esc(row[0])}</td>"
+            f"<td>{_report_esc(row[1])}</td>"
+            f'<td style="text-align: left;">{_report_esc(row[2])}</td>'
+            f"<td>{_report_esc(row[3])}</td>"
+            f"<td>{_report_esc(row[4])}</td>"
+            f"<td>{_report_esc(row[5])}</td>"
+            f"</tr>\n"
+        )
+        if len(lote) >= REPORT_FETCH_SIZE:
+            yield ''.join(lote)
+            lote = []
+    if lote:
+        yield ''.join(lote)
+
+
+def iter_report_html(body, total, entregues, pendentes):
+    """Gera o HTML do relatório em pedaços: cabeçalho, corpo (`body`, pedaços de
+    linhas <tr> já prontas) e rodapé."""
+    now = datetime.now().strftime('%d/%m/%Y %H:%M')
+
+    yield f'''<!DOCTYPE html>
 <html>
 <head>
     <meta charset="UTF-8">
@@ -360,329 +1992,2262 @@ def build_report_html(rows, total, entregues, pendentes):
     <h1>Relatório de Protocolos</h1>
     <div class="info">Data de Emissão: {now}</div>
 
-    <div class="resumo">
-        <div class="resumo-item">
-            <h3>{total}</h3>
-            <p>Total</p>
-        </div>
-        <div class="resumo-item entregue">
-            <h3>{entregues}</h3>
-            <p>Entregues</p>
-        </div>
-        <div class="resumo-item pendente">
-            <h3>{pendentes}</h3>
-            <p>Pendentes</p>
-        </div>
-    </div>
+    <div class="resumo">
+        <div class="resumo-item">
+            <h3>{total}</h3>
+            <p>Total</p>
+        </div>
+        <div class="resumo-item entregue">
+            <h3>{entregues}</h3>
+            <p>Entregues</p>
+        </div>
+        <div class="resumo-item pendente">
+            <h3>{pendentes}</h3>
+            <p>Pendentes</p>
+        </div>
+    </div>
+
+    <table>
+        <thead>
+            <tr>
+                <th style="width: 10%">PROT</th>
+                <th style="width: 12%">DATA</th>
+                <th style="width: 35%">NOME</th>
+                <th style="width: 10%">PMH</th>
+                <th style="width: 12%">ENTREGA</th>
+                <th style="width: 21%">RECEBIMENTO</th>
+            </tr>
+        </thead>
+        <tbody>
+'''
+
+    yield from body
+
+    yield '''        </tbody>
+    </table>
+</body>
+</html>'''
+
+# STREAM DE MUDANÇAS (Server-Sent Events)
+# Máximo de dashboards conectados: SSE_MAX_CLIENTS (junto do pool de conexões)
+SSE_QUEUE_SIZE = int(os.getenv('SSE_QUEUE_SIZE', '100'))
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', '15'))
+SSE_RETRY_MS = 5000
+
+
+class _SseClient:
+    """Fila limitada de eventos de um dashboard conectado.
+
+    Se o cliente ficar para trás e a fila encher, os eventos pendentes são
+    descartados e ele recebe um único 'resync' para recarregar a lista.
+    """
+
+    def __init__(self, maxlen):
+        self._events = collections.deque()
+        self._maxlen = maxlen
+        self._resync = False
+        self._cond = threading.Condition()
+        self.closed = False
+
+    def push(self, event):
+        with self._cond:
+            if self._resync:
+                return  # a recarga pendente já cobre este evento
+            if len(self._events) >= self._maxlen:
+                self._events.clear()
+                self._resync = True
+            else:
+                self._events.append(event)
+            self._cond.notify()
+
+    def close(self):
+        """Encerra o stream: next_event retorna na hora e o laço da rota termina."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def resync(self):
+        """Troca os eventos pendentes por um único 'resync'."""
+        with self._cond:
+            self._events.clear()
+            self._resync = True
+            self._cond.notify()
+
+    def next_event(self, timeout):
+        """Próximo evento SSE formatado, ou None se nada chegar dentro de `timeout`."""
+        with self._cond:
+            if not self._events and not self._resync and not self.closed:
+                self._cond.wait(timeout)
+            if self.closed:
+                return None
+            if self._resync:
+                self._resync = False
+                return "event: resync\ndata: {}\n\n"
+            if self._events:
+                return self._events.popleft()
+            return None
+
+
+class ProtocolBroadcaster:
+    """Distribui mudanças de protocolos para os dashboards conectados via SSE."""
+
+    def __init__(self, max_clients, queue_size):
+        self._max_clients = max_clients
+        self._queue_size = queue_size
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._published = 0
+        self._rejected = 0
+        self._closed = False
+
+    def subscribe(self):
+        """Registra novo cliente. Retorna None se o limite de conexões foi atingido."""
+        with self._lock:
+            if self._closed or len(self._clients) >= self._max_clients:
+                self._rejected += 1
+                return None
+            client = _SseClient(self._queue_size)
+            self._clients.add(client)
+            return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def has_clients(self):
+        return bool(self._clients)
+
+    def publish(self, event, payload):
+        """Serializa o evento uma vez e entrega a todos os clientes."""
+        message = f"event: {event}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+        with self._lock:
+            clients = list(self._clients)
+            self._published += 1
+        for client in clients:
+            client.push(message)
+
+    def close(self):
+        """Encerra todos os streams e recusa novos (desligamento do servidor)."""
+        with self._lock:
+            self._closed = True
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+
+    def resync_all(self):
+        """Pede a todos os clientes que recarreguem a lista (mudanças em massa)."""
+        with self._lock:
+            clients = list(self._clients)
+            self._published += 1
+        for client in clients:
+            client.resync()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "max_clients": self._max_clients,
+                "published": self._published,
+                "rejected": self._rejected,
+            }
+
+
+broadcaster = ProtocolBroadcaster(SSE_MAX_CLIENTS, SSE_QUEUE_SIZE)
+
+
+# APLICAÇÃO FLASK
+# Sem a rota /static embutida do Flask: /static/* sai de static_assets (hash, compressão)
+app = Flask(__name__, static_folder=None)
+CORS(app, expose_headers=['ETag'])
+
+
+# Métricas por rota: o rótulo é a regra da rota (/api/merge_pdfs/<job_id>), não o caminho.
+# O tempo é medido no after_request registrado primeiro, que roda por último (já com
+# a compressão); respostas em stream contam só até os cabeçalhos.
+@app.before_request
+def metrics_request_start():
+    g.metrics_started = time.perf_counter()
+    g.metrics_route = request.url_rule.rule if request.url_rule is not None else 'sem_rota'
+    metrics.inc('sisregip_http_requests_in_flight', (('rota', g.metrics_route),))
+
+
+def _observe_request(status):
+    labels = (('rota', g.metrics_route), ('metodo', request.method))
+    metrics.observe('sisregip_http_request_duration_seconds', labels,
+                    time.perf_counter() - g.metrics_started)
+    metrics.inc('sisregip_http_requests_total', labels + (('status', str(status)),))
+    g.metrics_observed = True
+
+
+@app.after_request
+def metrics_request_end(response):
+    if 'metrics_started' in g:
+        _observe_request(response.status_code)
+    return response
+
+
+@app.teardown_request
+def metrics_request_teardown(exc):
+    if 'metrics_started' not in g:
+        return
+    if not g.get('metrics_observed'):
+        _observe_request(500)
+    metrics.inc('sisregip_http_requests_in_flight', (('rota', g.metrics_route),), -1)
+
+
+# JSON das listagens: orjson quando instalado (bem mais rápido que o json da stdlib),
+# senão json.dumps compacto. Com format=compact as linhas saem como listas na ordem
+# de "columns", sem repetir as chaves em cada linha.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_default(value):
+    # Decimal vem de agregados do PostgreSQL; o resto (datas) sai como texto
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+
+def json_dumps(payload):
+    """Serializa para bytes UTF-8 com o codificador mais rápido disponível."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    """Como jsonify, usando json_dumps."""
+    return app.response_class(json_dumps(payload), status=status, mimetype='application/json')
+
+
+def wants_compact():
+    return request.args.get('format') == 'compact'
+
+
+PROTOCOLS_PAGE_SIZE = 100
+PROTOCOLS_PAGE_MAX = 500
+PROTOCOL_SYNC_MAX = 1000
+# Margem (s) do token de sincronização. No PostgreSQL transações concorrentes podem
+# confirmar fora da ordem do carimbo: uma linha carimbada antes de MAX(updated_at)
+# aparece depois. O token recua essa margem e o cliente recebe de novo o que mudou
+# nela (mescla por ID). No SQLite as escritas são serializadas: margem zero.
+PROTOCOL_SYNC_LAG = float(os.getenv('PROTOCOL_SYNC_LAG', '30' if USE_POSTGRES else '0'))
+
+
+
+def date_br_sql(coluna):
+    """Expressão SQL da data em DD/MM/YYYY ('' se nula). Texto que não é data ISO
+    sai como está no SQLite, como em format_date_br."""
+    if USE_POSTGRES:
+        return f"COALESCE(to_char({coluna}, 'DD/MM/YYYY'), '')"
+    return f"COALESCE(strftime('%d/%m/%Y', {coluna}), {coluna}, '')"
+
+
+# As colunas de PROTOCOL_FIELDS vêm primeiro e nessa ordem: a linha do banco já é a
+# linha do dashboard (datas formatadas no SQL). As datas cruas servem ao cursor.
+PROTOCOL_FIELDS = ("ID", "PROT", "DATA", "NOME", "PMH", "ENTREGA", "RECEBIMENTO")
+PROTOCOL_COLUMNS = f'''
+    SELECT
+        p.id as "ID",
+        p.prot as "PROT",
+        {date_br_sql('p.data_protocolo')} as "DATA",
+        u.nome as "NOME",
+        p.pmh as "PMH",
+        {date_br_sql('p.data_entrega')} as "ENTREGA",
+        r.nome as "RECEBIMENTO",
+        p.data_protocolo,
+        p.data_entrega
+'''
+PROTOCOL_SELECT = PROTOCOL_COLUMNS + '''    FROM protocolo p
+    LEFT JOIN usuario u ON p.usuario_id = u.id
+    LEFT JOIN recebedor r ON p.recebedor_id = r.id
+'''
+
+
+def protocol_period(args):
+    """Período pedido na query string (month, year ou from/to) como (início, fim)
+    semiaberto em ISO; pontas ausentes são None. Levanta ValueError se inválido."""
+    if args.get('month'):
+        return month_bounds(args['month'])
+    if args.get('year'):
+        return year_bounds(args['year'])
+    if args.get('from') or args.get('to'):
+        return range_bounds(args.get('from'), args.get('to'))
+    return None, None
+
+
+def period_conditions(inicio, fim):
+    """Condições sargáveis sobre p.data_protocolo para o período [início, fim)."""
+    conds, params = [], []
+    if inicio:
+        conds.append("p.data_protocolo >= ?")
+        params.append(inicio)
+    if fim:
+        conds.append("p.data_protocolo < ?")
+        params.append(fim)
+    return conds, params
+
+
+def build_protocol_filters(args):
+    """Monta cláusulas WHERE (sargáveis) e parâmetros a partir da query string."""
+    where = ["p.ativo = TRUE"]
+    params = []
+
+    status = (args.get('status') or '').strip().lower()
+    if status == 'pendente':
+        where.append("p.data_entrega IS NULL")
+    elif status == 'entregue':
+        where.append("p.data_entrega IS NOT NULL")
+
+    conds, cond_params = period_conditions(*protocol_period(args))
+    where += conds
+    params += cond_params
+
+    if args.get('name'):
+        where.append(f"{fold_sql('u.nome')} LIKE ?")
+        params.append(f"%{fold_param(args['name'].strip())}%")
+    if args.get('pmh'):
+        where.append("p.pmh = ?")
+        params.append(args['pmh'].strip())
+    if args.get('q'):
+        # Caixa de busca do dashboard: nome ou número do protocolo (índice de busca)
+        busca = search_condition(args['q'])
+        if busca:
+            where.append(busca[0])
+            params += busca[1]
+
+    return where, params
+
+
+def keyset_phases(cursor_token=None):
+    """Fases do percurso ORDER BY data_protocolo DESC, id DESC a partir do cursor.
+
+    Cada fase é uma consulta sargável: protocolos com data seguem idx_protocolo_data
+    com comparação de tupla (data, id); os sem data seguem a chave primária. A ordem
+    das fases respeita a posição natural de NULLs em cada banco (primeiro no
+    PostgreSQL, por último no SQLite). Retorna lista de (condição, parâmetros, ORDER BY).
+    """
+    datadas = ("p.data_protocolo IS NOT NULL", [], "p.data_protocolo DESC, p.id DESC")
+    nulas = ("p.data_protocolo IS NULL", [], "p.id DESC")
+    fases = [nulas, datadas] if USE_POSTGRES else [datadas, nulas]
+    if not cursor_token:
+        return fases
+
+    data, protocolo_id = decode_cursor(cursor_token)
+    if data is None:
+        atual = ("p.data_protocolo IS NULL AND p.id < ?", [protocolo_id], nulas[2])
+        seguinte = [datadas] if USE_POSTGRES else []
+    else:
+        atual = ("(p.data_protocolo, p.id) < (?, ?)", [data, protocolo_id], datadas[2])
+        seguinte = [] if USE_POSTGRES else [nulas]
+    return [atual] + seguinte
+
+
+STATS_MONTHS = 12
+STATS_RECEBEDORES = 10
+LEAD_TIME_PERCENTILES = (0.5, 0.9)
+
+# Mês (YYYY-MM) da data do protocolo, para GROUP BY
+MONTH_SQL = "to_char(p.data_protocolo, 'YYYY-MM')" if USE_POSTGRES else "strftime('%Y-%m', p.data_protocolo)"
+
+_STATS_FROM = '''
+    FROM protocolo p
+    LEFT JOIN usuario u ON p.usuario_id = u.id
+'''
+
+
+def protocol_status_counts(cursor, where=("p.ativo = TRUE",), params=()):
+    """Total, entregues e pendentes dos protocolos que atendem ao filtro (uma agregação)."""
+    cursor.execute(f'''
+        SELECT
+            COUNT(*) as total,
+            COUNT(p.data_entrega) as entregues
+        {_STATS_FROM}
+        WHERE {' AND '.join(where)}
+    ''', list(params))
+    row = cursor.fetchone()
+    return {"total": row['total'], "entregues": row['entregues'], "pendentes": row['total'] - row['entregues']}
+
+
+def protocol_lead_time(cursor, where, params):
+    """Prazo de entrega em dias (data_entrega - data_protocolo): quantidade, média e percentis.
+
+    O PostgreSQL calcula os percentis com percentile_cont; o SQLite não tem a função,
+    então cada percentil busca as duas linhas vizinhas com ORDER BY/OFFSET e interpola
+    da mesma forma (linear).
+    """
+    cond = ' AND '.join(list(where) + ["p.data_entrega IS NOT NULL", "p.data_protocolo IS NOT NULL"])
+    chaves = [f"p{round(pct * 100)}" for pct in LEAD_TIME_PERCENTILES]
+
+    if USE_POSTGRES:
+        percentis = ''.join(
+            f", percentile_cont({pct}) WITHIN GROUP (ORDER BY p.data_entrega - p.data_protocolo) as {chave}"
+            for pct, chave in zip(LEAD_TIME_PERCENTILES, chaves)
+        )
+        cursor.execute(f'''
+            SELECT COUNT(*) as entregas, AVG(p.data_entrega - p.data_protocolo) as media{percentis}
+            {_STATS_FROM}
+            WHERE {cond}
+        ''', list(params))
+        row = cursor.fetchone()
+        result = {"entregas": row['entregas'], "media": row['media']}
+        result.update({chave: row[chave] for chave in chaves})
+    else:
+        dias = f'''
+            SELECT julianday(p.data_entrega) - julianday(p.data_protocolo) as dias
+            {_STATS_FROM}
+            WHERE {cond}
+        '''
+        cursor.execute(f"SELECT COUNT(*) as entregas, AVG(dias) as media FROM ({dias})", list(params))
+        row = cursor.fetchone()
+        result = {"entregas": row['entregas'], "media": row['media']}
+        for pct, chave in zip(LEAD_TIME_PERCENTILES, chaves):
+            result[chave] = None
+            if not result["entregas"]:
+                continue
+            posicao = (result["entregas"] - 1) * pct
+            base = int(posicao)
+            cursor.execute(
+                f"SELECT dias FROM ({dias}) ORDER BY dias LIMIT 2 OFFSET ?",
+                list(params) + [base]
+            )
+            vizinhos = [r['dias'] for r in cursor.fetchall()]
+            if len(vizinhos) == 2:
+                result[chave] = vizinhos[0] + (posicao - base) * (vizinhos[1] - vizinhos[0])
+            else:
+                result[chave] = vizinhos[0]
+
+    for chave in ["media"] + chaves:
+        if result[chave] is not None:
+            result[chave] = round(float(result[chave]), 1)
+    return result
+
+
+def protocol_stats(cursor, where, params, months=STATS_MONTHS):
+    """Estatísticas agregadas no banco: por situação, por mês, por recebedor e prazo de entrega."""
+    stats = {"status": protocol_status_counts(cursor, where, params)}
+
+    cursor.execute(f'''
+        SELECT
+            {MONTH_SQL} as mes,
+            COUNT(*) as total,
+            COUNT(p.data_entrega) as entregues
+        {_STATS_FROM}
+        WHERE {' AND '.join(where)} AND p.data_protocolo IS NOT NULL
+        GROUP BY mes
+        ORDER BY mes DESC
+        LIMIT ?
+    ''', list(params) + [months])
+    stats["por_mes"] = [
+        {"mes": row['mes'], "total": row['total'], "entregues": row['entregues'],
+         "pendentes": row['total'] - row['entregues']}
+        for row in reversed(cursor.fetchall())
+    ]
+
+    cursor.execute(f'''
+        SELECT r.nome as recebedor, COUNT(*) as total
+        {_STATS_FROM}
+        JOIN recebedor r ON p.recebedor_id = r.id
+        WHERE {' AND '.join(where)}
+        GROUP BY r.nome
+        ORDER BY total DESC, r.nome
+        LIMIT ?
+    ''', list(params) + [STATS_RECEBEDORES])
+    stats["por_recebedor"] = [{"recebedor": row['recebedor'], "total": row['total']} for row in cursor.fetchall()]
+
+    stats["prazo_entrega"] = protocol_lead_time(cursor, where, params)
+    return stats
+
+
+def protocol_summary(cursor):
+    """Totais gerais (entregues/pendentes) e anos com protocolos, para os cards e filtros."""
+    summary = protocol_status_counts(cursor)
+
+    if USE_POSTGRES:
+        ano_sql = "CAST(EXTRACT(YEAR FROM data_protocolo) AS INTEGER)"
+    else:
+        ano_sql = "CAST(strftime('%Y', data_protocolo) AS INTEGER)"
+    cursor.execute(f'''
+        SELECT DISTINCT {ano_sql} as ano
+        FROM protocolo
+        WHERE ativo = TRUE AND data_protocolo IS NOT NULL
+        ORDER BY ano DESC
+    ''')
+    summary["anos"] = [r['ano'] for r in cursor.fetchall() if r['ano']]
+    return summary
+
+
+def protocol_to_json(row):
+    """Linha de PROTOCOL_SELECT como objeto do dashboard (datas DD/MM/YYYY)."""
+    return dict(zip(PROTOCOL_FIELDS, row))
+
+
+def protocol_rows(rows):
+    """Linhas de PROTOCOL_SELECT no formato compacto: listas na ordem de PROTOCOL_FIELDS."""
+    n = len(PROTOCOL_FIELDS)
+    return [row[:n] for row in rows]
+
+
+def protocol_data_version(cursor):
+    """Versão dos dados de protocolo e token de sincronização (consultas por índice).
+
+    Retorna (versao, ultimo_id, sync_cursor). Com PROTOCOL_SYNC_LAG, sync_cursor é
+    MAX(updated_at) menos a margem, e a versão inclui quantas linhas caem nessa
+    janela: uma confirmação atrasada não muda o MAX, mas muda a contagem (e o ETag).
+    """
+    cursor.execute('SELECT MAX(updated_at) as versao, MAX(id) as ultimo_id FROM protocolo')
+    row = cursor.fetchone()
+    if row['versao'] is None:
+        return '', row['ultimo_id'] or 0, None
+    versao = str(row['versao'])
+    if not PROTOCOL_SYNC_LAG:
+        return versao, row['ultimo_id'], versao
+
+    recuado = datetime.fromisoformat(versao) - timedelta(seconds=PROTOCOL_SYNC_LAG)
+    sync_cursor = recuado.isoformat(' ', timespec='microseconds' if USE_POSTGRES else 'milliseconds')
+    cursor.execute('SELECT COUNT(*) as recentes FROM protocolo WHERE updated_at >= ?', (sync_cursor,))
+    return f"{versao}|{cursor.fetchone()['recentes']}", row['ultimo_id'], sync_cursor
+
+
+def protocol_etag(versao, ultimo_id, args):
+    """ETag de uma consulta: versão dos dados + filtros (sem cursor/since/limit)."""
+    filtros = '&'.join(f"{k}={args.get(k, '')}" for k in ('status', 'month', 'year', 'name', 'pmh', 'q', 'format'))
+    return hashlib.sha1(f"{versao}|{ultimo_id}|{filtros}".encode('utf-8')).hexdigest()
+
+
+def protocol_changes(cursor, where, params, since):
+    """Protocolos alterados desde `since` (inclusive) que atendem ao filtro.
+
+    Retorna (linhas, ids_removidos), onde ids_removidos são os alterados que não
+    atendem mais ao filtro (inclusive soft delete). Retorna None se houver mais de
+    PROTOCOL_SYNC_MAX mudanças: nesse caso o cliente deve recarregar a lista.
+    """
+    cursor.execute(
+        'SELECT id FROM protocolo WHERE updated_at >= ? LIMIT ?',
+        (since, PROTOCOL_SYNC_MAX + 1)
+    )
+    changed_ids = [row['id'] for row in cursor.fetchall()]
+    if len(changed_ids) > PROTOCOL_SYNC_MAX:
+        return None
+    if not changed_ids:
+        return [], []
+
+    cursor.execute(f'''
+        {PROTOCOL_SELECT}
+        WHERE {' AND '.join(where)} AND p.updated_at >= ?
+        ORDER BY p.data_protocolo DESC, p.id DESC
+    ''', params + [since])
+    rows = cursor.fetchall()
+    matched = {row['ID'] for row in rows}
+    return rows, [i for i in changed_ids if i not in matched]
+
+
+def search_protocols(cursor, term, limit=SEARCH_LIMIT):
+    """Busca ranqueada de protocolos ativos por nome do paciente, número do protocolo,
+    PMH ou recebedor. Retorna linhas de PROTOCOL_SELECT com a coluna "RELEVANCIA".
+    """
+    tokens = search_tokens(term)
+    if not tokens:
+        return []
+
+    joins = '''
+        LEFT JOIN usuario u ON p.usuario_id = u.id
+        LEFT JOIN recebedor r ON p.recebedor_id = r.id
+    '''
+    if SEARCH_INDEX and not USE_POSTGRES:
+        # bm25: menor é melhor; nome, protocolo e PMH pesam mais que recebedor
+        match = ' '.join(f'"{t}"*' for t in tokens)
+        cursor.execute(f'''
+            {PROTOCOL_COLUMNS}, -bm25(protocolo_busca, 4.0, 8.0, 8.0, 1.0) as "RELEVANCIA"
+            FROM protocolo_busca
+            JOIN protocolo p ON p.id = protocolo_busca.rowid
+            {joins}
+            WHERE protocolo_busca MATCH ? AND p.ativo = TRUE
+            ORDER BY "RELEVANCIA" DESC, p.data_protocolo DESC
+            LIMIT ?
+        ''', (match, limit))
+        rows = cursor.fetchall()
+
+        # Número do protocolo por trecho (fora do FTS5): depois dos achados no índice
+        padrao = prot_substring(tokens)
+        if padrao and len(rows) < limit:
+            achados = [row['ID'] for row in rows] or [None]
+            cursor.execute(f'''
+                {PROTOCOL_COLUMNS}, 0 as "RELEVANCIA"
+                FROM protocolo p
+                {joins}
+                WHERE p.prot LIKE ? AND p.ativo = TRUE AND p.id NOT IN ({', '.join('?' * len(achados))})
+                ORDER BY p.data_protocolo DESC, p.id DESC
+                LIMIT ?
+            ''', [padrao] + achados + [limit - len(rows)])
+            rows += cursor.fetchall()
+        return rows
+
+    padrao = '%' + '%'.join(tokens) + '%'
+    texto = ' '.join(tokens)
+    if SEARCH_INDEX:
+        # Cada ramo usa seu índice de trigramas; a relevância é a maior similaridade
+        cursor.execute(f'''
+            {PROTOCOL_COLUMNS}, h.relevancia as "RELEVANCIA"
+            FROM (
+                SELECT id, MAX(relevancia) as relevancia FROM (
+                    SELECT p.id, similarity(sisregip_fold(u.nome), ?) as relevancia
+                    FROM usuario u JOIN protocolo p ON p.usuario_id = u.id
+                    WHERE sisregip_fold(u.nome) LIKE ?
+                    UNION ALL
+                    SELECT p.id, similarity(sisregip_fold(r.nome), ?) * 0.5
+                    FROM recebedor r JOIN protocolo p ON p.recebedor_id = r.id
+                    WHERE sisregip_fold(r.nome) LIKE ?
+                    UNION ALL
+                    SELECT id, CASE WHEN lower(prot) = ? THEN 1.0 ELSE similarity(lower(prot), ?) END
+                    FROM protocolo WHERE prot ILIKE ?
+                    UNION ALL
+                    SELECT id, CASE WHEN lower(pmh) = ? THEN 1.0 ELSE similarity(lower(pmh), ?) END
+                    FROM protocolo WHERE pmh ILIKE ?
+                ) hits
+                GROUP BY id
+            ) h
+            JOIN protocolo p ON p.id = h.id
+            {joins}
+            WHERE p.ativo = TRUE
+            ORDER BY h.relevancia DESC, p.data_protocolo DESC NULLS LAST
+            LIMIT ?
+        ''', (texto, padrao, texto, padrao, texto, texto, padrao, texto, texto, padrao, limit))
+        return cursor.fetchall()
+
+    # Sem índice: varredura com LIKE, mais recentes primeiro
+    cursor.execute(f'''
+        {PROTOCOL_COLUMNS}, 0 as "RELEVANCIA"
+        FROM protocolo p
+        {joins}
+        WHERE p.ativo = TRUE
+          AND ({fold_sql('u.nome')} LIKE ? OR LOWER(p.prot) LIKE ? OR LOWER(p.pmh) LIKE ? OR {fold_sql('r.nome')} LIKE ?)
+        ORDER BY p.data_protocolo DESC, p.id DESC
+        LIMIT ?
+    ''', (padrao, padrao, padrao, padrao, limit))
+    return cursor.fetchall()
+
+
+def publish_protocol_change(cursor, condition=None, params=(), removed=()):
+    """Publica no stream SSE os protocolos alterados (já commitados) e os ids removidos.
+
+    Envia as linhas prontas para o dashboard e os totais gerais atualizados, de modo
+    que cada cliente aplique a mudança sem consultar o banco. Falha silenciosa.
+    """
+    if not broadcaster.has_clients():
+        return
+    try:
+        changed = []
+        if condition:
+            cursor.execute(f"{PROTOCOL_SELECT} WHERE {condition}", list(params))
+            changed = [protocol_to_json(row) for row in cursor.fetchall()]
+        broadcaster.publish('protocolo', {
+            "changed": changed,
+            "removed": list(removed),
+            "summary": protocol_summary(cursor),
+        })
+    except Exception:
+        logging.error("Erro ao publicar mudança de protocolo", exc_info=True)
+
+
+# Rotas de API: Protocolos
+@app.route('/api/protocols', methods=['GET'])
+def get_protocols():
+    """Retorna uma página de protocolos ativos (paginação por cursor em data/id).
+
+    Query string: status (pendente|entregue), month (YYYY-MM), year (YYYY), name, pmh,
+    q (nome ou protocolo), limit, cursor e summary=1 para incluir os totais gerais.
+    A primeira página (sem cursor) traz também o total de linhas do filtro.
+
+    Com since=<sync_cursor> devolve só o que mudou desde aquele token (delta).
+    Responde 304 quando o If-None-Match coincide com a versão atual dos dados.
+    format=compact: protocolos como listas na ordem de "columns".
+    """
+    try:
+        args = request.args
+        since = args.get('since')
+        try:
+            limit = min(max(int(args.get('limit', PROTOCOLS_PAGE_SIZE)), 1), PROTOCOLS_PAGE_MAX)
+            where, params = build_protocol_filters(args)
+            fases = keyset_phases(args.get('cursor'))
+            if since:
+                datetime.fromisoformat(since)
+        except ValueError:
+            return jsonify({"success": False, "message": "Filtro ou cursor inválido."}), 400
+
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            # Versão lida antes dos dados: o que mudar durante a consulta volta no próximo since
+            versao, ultimo_id, sync_cursor = protocol_data_version(cursor)
+            etag = protocol_etag(versao, ultimo_id, args)
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            page = {"success": True, "sync_cursor": sync_cursor}
+            rows = []
+            if since:
+                changes = protocol_changes(cursor, where, params, since)
+                if changes is None:
+                    page["resync"] = True
+                else:
+                    rows, page["removed"] = changes
+            else:
+                # Busca limit + 1 linhas para saber se há próxima página
+                for cond, cond_params, order_by in fases:
+                    cursor.execute(f'''
+                        {PROTOCOL_SELECT}
+                        WHERE {' AND '.join(where + [cond])}
+                        ORDER BY {order_by}
+                        LIMIT ?
+                    ''', params + cond_params + [limit + 1 - len(rows)])
+                    rows += cursor.fetchall()
+                    if len(rows) > limit:
+                        break
+
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                page["next_cursor"] = encode_cursor(rows[-1]["data_protocolo"], rows[-1]["ID"]) if has_more else None
+
+            if since or not args.get('cursor'):
+                # Total do filtro só na primeira página e no delta; as seguintes não recontam
+                cursor.execute(f'''
+                    SELECT COUNT(*) as total
+                    FROM protocolo p
+                    LEFT JOIN usuario u ON p.usuario_id = u.id
+                    WHERE {' AND '.join(where)}
+                ''', params)
+                page["total"] = cursor.fetchone()["total"]
+            if args.get('summary') == '1':
+                page["summary"] = protocol_summary(cursor)
+
+        if wants_compact():
+            page["columns"] = PROTOCOL_FIELDS
+            page["protocols"] = protocol_rows(rows)
+        else:
+            page["protocols"] = [protocol_to_json(row) for row in rows]
+        response = json_response(page)
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception:
+        logging.error("Erro em get_protocols", exc_info=True)
+        return jsonify({"success": False, "message": "Erro ao buscar protocolos."}), 500
+
+
+@app.route('/api/protocols/add', methods=['POST'])
+def add_protocol():
+    """Adiciona novo protocolo."""
+    try:
+        data = request.json
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            data_protocolo = parse_date(data.get('DATA'))
+            data_entrega = parse_date(data.get('ENTREGA'))
+            pmh = get_or_none(data.get('PMH'))
+            usuario_id = resolve_usuario(cursor, data.get('NOME'), pmh)
+            recebedor_id = resolve_recebedor(cursor, data.get('RECEBIMENTO'))
+
+            cursor.execute(f'''
+                INSERT INTO protocolo
+                (prot, data_protocolo, usuario_id, pmh, data_entrega, recebedor_id, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, {NOW_SQL}, {NOW_SQL})
+            ''', (
+                data['PROT'],
+                data_protocolo,
+                usuario_id,
+                pmh,
+                data_entrega,
+                recebedor_id,
+            ))
+            conn.commit()
+            report_cache.invalidate([data_protocolo])
+            publish_protocol_change(cursor, "p.id = ?", (cursor.lastrowid,))
+        operador = data.get('OPERADOR', 'NÃO IDENTIFICADO')
+        registrar_acao(operador, 'ADICIONAR', f"Protocolo {data['PROT']} adicionado")
+        return jsonify({"success": True, "message": "Protocolo adicionado com sucesso."})
+    except Exception as e:
+        logging.error("Erro em add_protocol", exc_info=True)
+        return jsonify({"success": False, "message": f"Erro: {str(e)}"}), 500
+
+
+@app.route('/api/protocols/edit', methods=['POST'])
+def edit_protocol():
+    """Edita protocolo existente."""
+    try:
+        data = request.json
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            data_protocolo = parse_date(data.get('DATA'))
+            data_entrega = parse_date(data.get('ENTREGA'))
+            pmh = get_or_none(data.get('PMH'))
+            usuario_id = resolve_usuario(cursor, data.get('NOME'), pmh)
+            recebedor_id = resolve_recebedor(cursor, data.get('RECEBIMENTO'))
+
+            # Datas atuais, para invalidar os relatórios do período antigo e do novo
+            cursor.execute('SELECT data_protocolo FROM protocolo WHERE prot = ? AND ativo = TRUE', (data['PROT'],))
+            datas = [row['data_protocolo'] for row in cursor.fetchall()] + [data_protocolo]
+
+            cursor.execute(f'''
+                UPDATE protocolo
+                SET data_protocolo = ?,
+                    usuario_id = ?,
+                    pmh = ?,
+                    data_entrega = ?,
+                    recebedor_id = ?,
+                    updated_at = {NOW_SQL}
+                WHERE prot = ? AND ativo = TRUE
+            ''', (
+                data_protocolo,
+                usuario_id,
+                pmh,
+                data_entrega,
+                recebedor_id,
+                data['PROT'],
+            ))
+            conn.commit()
+            report_cache.invalidate(datas)
+            publish_protocol_change(cursor, "p.prot = ? AND p.ativo = TRUE", (data['PROT'],))
+        operador = data.get('OPERADOR', 'NÃO IDENTIFICADO')
+        registrar_acao(operador, 'EDITAR', f"Protocolo {data['PROT']} editado")
+        return jsonify({"success": True, "message": "Protocolo editado com sucesso."})
+    except Exception as e:
+        logging.error("Erro em edit_protocol", exc_info=True)
+        return jsonify({"success": False, "message": f"Erro: {str(e)}"}), 500
+
+
+@app.route('/api/protocols/delete', methods=['POST'])
+def delete_protocol():
+    """Deleta protocolo (soft delete)."""
+    try:
+        data = request.json
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT data_protocolo FROM protocolo WHERE id = ?', (data['ID'],))
+            datas = [row['data_protocolo'] for row in cursor.fetchall()]
+            cursor.execute(
+                f'UPDATE protocolo SET ativo = FALSE, updated_at = {NOW_SQL} WHERE id = ?',
+                (data['ID'],)
+            )
+            conn.commit()
+            report_cache.invalidate(datas)
+            publish_protocol_change(cursor, removed=(data['ID'],))
+        operador = data.get('OPERADOR', 'NÃO IDENTIFICADO')
+        registrar_acao(operador, 'EXCLUIR', f"Protocolo ID {data['ID']} excluído")
+        return jsonify({"success": True, "message": "Protocolo excluído com sucesso."})
+    except Exception as e:
+        logging.error("Erro em delete_protocol", exc_info=True)
+        return jsonify({"success": False, "message": f"Erro: {str(e)}"}), 500
+
+
+@app.route('/api/protocols/stream', methods=['GET'])
+def protocol_stream():
+    """Stream SSE com as mudanças de protocolos feitas por qualquer terminal."""
+    client = broadcaster.subscribe()
+    if client is None:
+        return jsonify({"success": False, "message": "Limite de conexões em tempo real atingido."}), 503
+
+    def events():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            while not client.closed:
+                # Comentário SSE como heartbeat: mantém a conexão viva e detecta cliente desconectado
+                yield client.next_event(SSE_HEARTBEAT) or ": ping\n\n"
+        finally:
+            broadcaster.unsubscribe(client)
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """Busca ranqueada de protocolos (q = nome, protocolo, PMH ou recebedor; limit)."""
+    try:
+        term = request.args.get('q', '').strip()
+        try:
+            limit = min(max(int(request.args.get('limit', SEARCH_LIMIT)), 1), SEARCH_LIMIT_MAX)
+        except ValueError:
+            return jsonify({"success": False, "message": "Limite inválido."}), 400
+        if len(term) < 2:
+            return jsonify({"success": True, "results": []})
+
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            rows = search_protocols(cursor, term, limit)
+
+        results = []
+        for row in rows:
+            item = protocol_to_json(row)
+            item["RELEVANCIA"] = round(float(row["RELEVANCIA"] or 0), 4)
+            results.append(item)
+        return jsonify({"success": True, "results": results})
+    except Exception:
+        logging.error("Erro em search", exc_info=True)
+        return jsonify({"success": False, "message": "Erro ao buscar protocolos."}), 500
+
+
+@app.route('/api/protocols/stats', methods=['GET'])
+def get_protocol_stats():
+    """Estatísticas agregadas no banco (mesmos filtros de /api/protocols; months = meses no gráfico)."""
+    try:
+        args = request.args
+        try:
+            where, params = build_protocol_filters(args)
+            months = min(max(int(args.get('months', STATS_MONTHS)), 1), 120)
+        except ValueError:
+            return jsonify({"success": False, "message": "Parâmetros inválidos."}), 400
+
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            stats = protocol_stats(cursor, where, params, months)
+        return jsonify({"success": True, **stats})
+    except Exception:
+        logging.error("Erro em get_protocol_stats", exc_info=True)
+        return jsonify({"success": False, "message": "Erro ao calcular estatísticas."}), 500
+
+
+# Rotas de API: Importação de planilhas
+# Planilhas antigas (.csv/.xlsx) lidas linha a linha e gravadas em lotes de
+# IMPORT_CHUNK_ROWS, cada lote na sua transação: nomes resolvidos em conjunto,
+# protocolos já cadastrados (ou repetidos na planilha) rejeitados pelo `prot`.
+IMPORT_CHUNK_ROWS = int(os.getenv('IMPORT_CHUNK_ROWS', '5000'))
+IMPORT_HEADER_SCAN = 10      # linhas de título que podem vir antes do cabeçalho
+IMPORT_CSV_DELIMITERS = ';,\t'
+IMPORT_REJECT_PREVIEW = 100  # rejeitados devolvidos na resposta; o relatório tem todos
+IMPORT_REPORT_DIR = None  # importacoes/ na pasta de dados (init_app)
+
+# Cabeçalho (sem acento, minúsculas, só letras e números) -> campo
+IMPORT_HEADERS = {
+    'prot': 'prot', 'protocolo': 'prot', 'nprotocolo': 'prot', 'noprotocolo': 'prot',
+    'numprotocolo': 'prot', 'numerodoprotocolo': 'prot',
+    'data': 'data_protocolo', 'dataprot': 'data_protocolo', 'dataprotocolo': 'data_protocolo',
+    'datadoprotocolo': 'data_protocolo',
+    'nome': 'nome', 'paciente': 'nome', 'usuario': 'nome', 'nomedopaciente': 'nome',
+    'nomecompleto': 'nome',
+    'pmh': 'pmh', 'prontuario': 'pmh',
+    'entrega': 'data_entrega', 'dataentrega': 'data_entrega', 'datadeentrega': 'data_entrega',
+    'dataentregue': 'data_entrega',
+    'recebimento': 'recebedor', 'recebedor': 'recebedor', 'recebidopor': 'recebedor',
+    'quemrecebeu': 'recebedor',
+    'obs': 'observacoes', 'observacao': 'observacoes', 'observacoes': 'observacoes',
+}
+# Tamanho das colunas no banco: no PostgreSQL um valor maior derrubaria o lote inteiro
+IMPORT_MAX_LEN = {'prot': 20, 'pmh': 10, 'nome': 200, 'recebedor': 200}
+
+
+class ImportacaoError(Exception):
+    """Planilha que não dá para importar (formato, cabeçalho, dependência)."""
+
+
+def iter_csv_rows(path):
+    """Linhas do CSV. Detecta UTF-8 (com ou sem BOM) ou Windows-1252 e o separador."""
+    with open(path, 'rb') as f:
+        sample = f.read(65536)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        encoding = 'cp1252'
+    with open(path, newline='', encoding=encoding) as f:
+        delimiter = csv_delimiter(f.read(8192))
+        f.seek(0)
+        yield from csv.reader(f, delimiter=delimiter)
+
+
+def csv_delimiter(sample):
+    """Separador que transforma uma das primeiras linhas no cabeçalho reconhecido.
+
+    Linhas de título antes do cabeçalho confundem o csv.Sniffer; sem cabeçalho
+    reconhecido vale o Sniffer e, por último, ';' (padrão do Excel em português).
+    """
+    for line in sample.splitlines()[:IMPORT_HEADER_SCAN]:
+        for delimiter in IMPORT_CSV_DELIMITERS:
+            if import_columns(next(csv.reader([line], delimiter=delimiter), [])):
+                return delimiter
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=IMPORT_CSV_DELIMITERS).delimiter
+    except csv.Error:
+        return ';'
+
+
+def iter_xlsx_rows(path):
+    """Linhas da primeira planilha do .xlsx, em modo somente leitura (sem carregar tudo)."""
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportacaoError("Importação de .xlsx requer o pacote openpyxl.")
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def import_text(value):
+    """Texto da célula sem espaços nas pontas, ou None."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # Excel guarda 123 como 123.0
+    text = str(value).strip()
+    if text[1:2] and text[0] == "'" and text[1:].startswith(EXPORT_FORMULA_PREFIXES):
+        text = text[1:]  # apóstrofo posto pela exportação (export_cell)
+    return text or None
+
+
+# Planilhas repetem as mesmas datas milhares de vezes: strptime só uma vez por texto
+_import_parse_date = functools.lru_cache(maxsize=8192)(parse_date)
+
+
+def import_date(value):
+    """(data ISO ou None, válida). Célula de data do Excel já vem como datetime;
+    texto segue as regras de parse_date."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()[:10], True
+    text = import_text(value)
+    if text is None:
+        return None, True
+    iso = _import_parse_date(text)
+    return iso, iso is not None
+
+
+def import_columns(row):
+    """{campo: índice da coluna} se `row` for o cabeçalho (tem a coluna do protocolo)."""
+    columns = {}
+    for i, cell in enumerate(row):
+        campo = IMPORT_HEADERS.get(re.sub(r'[^a-z0-9]', '', fold_text(cell or '')))
+        if campo and campo not in columns:
+            columns[campo] = i
+    return columns if 'prot' in columns else None
+
+
+def import_record(row, columns):
+    """(registro, motivo da rejeição). Linha vazia retorna (None, None)."""
+    def cell(campo):
+        i = columns.get(campo)
+        return row[i] if i is not None and i < len(row) else None
+
+    if all(import_text(value) is None for value in row):
+        return None, None
+    record = {campo: import_text(cell(campo)) for campo in ('prot', 'nome', 'pmh', 'recebedor', 'observacoes')}
+    if not record['prot']:
+        return record, "Protocolo vazio."
+    for campo, tamanho in IMPORT_MAX_LEN.items():
+        if record[campo] and len(record[campo]) > tamanho:
+            return record, f"Campo {campo} com mais de {tamanho} caracteres."
+    for campo, rotulo in (('data_protocolo', 'do protocolo'), ('data_entrega', 'de entrega')):
+        record[campo], valida = import_date(cell(campo))
+        if not valida:
+            return record, f"Data {rotulo} inválida: {import_text(cell(campo))}"
+    return record, None
+
+
+def import_chunk(chunk, rejeitados):
+    """Grava um lote [(linha, registro)] numa transação. Retorna quantos entraram."""
+    conn = get_connection()
+    existentes = set()
+    try:
+        cursor = conn.cursor()
+        prots = [record['prot'] for _, record in chunk]
+        for start in range(0, len(prots), SQL_MAX_PARAMS):
+            part = prots[start:start + SQL_MAX_PARAMS]
+            # Só `prot` no WHERE: com `ativo` junto o SQLite prefere o índice (ativo, data)
+            # e varre todos os protocolos ativos
+            cursor.execute(f"SELECT prot, ativo FROM protocolo WHERE prot IN ({', '.join('?' * len(part))})", part)
+            existentes.update(prot for prot, ativo in cursor.fetchall() if ativo)
+
+        novos = []
+        for linha, record in chunk:
+            if record['prot'] in existentes:
+                rejeitados.append((linha, record['prot'], "Protocolo já cadastrado."))
+            else:
+                novos.append(record)
+
+        usuarios = resolve_nomes(cursor, 'usuario', usuario_ids,
+                                 {r['nome']: (r['nome'], r['pmh']) for r in novos if r['nome']},
+                                 ('nome', 'prontuario'))
+        recebedores = resolve_nomes(cursor, 'recebedor', recebedor_ids,
+                                    {r['recebedor']: (r['recebedor'],) for r in novos if r['recebedor']},
+                                    ('nome',))
+        insert_many(
+            cursor, 'protocolo',
+            ('prot', 'data_protocolo', 'usuario_id', 'pmh', 'data_entrega', 'recebedor_id', 'observacoes'),
+            [(r['prot'], r['data_protocolo'], usuarios.get(r['nome']), r['pmh'], r['data_entrega'],
+              recebedores.get(r['recebedor']), r['observacoes']) for r in novos],
+            fixos={'created_at': NOW_SQL, 'updated_at': NOW_SQL},
+        )
+        conn.commit()
+        return len(novos)
+    except Exception:
+        conn.rollback()
+        logging.error("Erro ao gravar lote da importação", exc_info=True)
+        rejeitados.extend((linha, record['prot'], "Erro ao gravar o lote no banco.") for linha, record in chunk
+                          if record['prot'] not in existentes)
+        return 0
+    finally:
+        conn.close()
+
 
-    <table>
-        <thead>
-            <tr>
-                <th style="width: 10%">PROT</th>
-                <th style="width: 12%">DATA</th>
-                <th style="width: 35%">NOME</th>
-                <th style="width: 10%">PMH</th>
-                <th style="width: 12%">ENTREGA</th>
-                <th style="width: 21%">RECEBIMENTO</th>
-            </tr>
-        </thead>
-        <tbody>
-{rows_html}
-        </tbody>
-    </table>
-</body>
-</html>'''
+def write_import_report(nome_planilha, rejeitados):
+    """Grava os rejeitados em CSV (separador ';', abre direto no Excel). Retorna o nome do arquivo."""
+    os.makedirs(IMPORT_REPORT_DIR, exist_ok=True)
+    base = os.path.splitext(os.path.basename(nome_planilha))[0]
+    nome = f"rejeitados_{base}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    with open(os.path.join(IMPORT_REPORT_DIR, nome), 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['linha', 'protocolo', 'motivo'])
+        writer.writerows(sorted(rejeitados))
+    return nome
+
+
+def import_protocols(path, operador=None, nome_planilha=None):
+    """Importa protocolos de uma planilha .csv/.xlsx. Retorna o resumo da importação."""
+    nome_planilha = nome_planilha or os.path.basename(path)
+    extensao = os.path.splitext(nome_planilha)[1].lower()
+    if extensao == '.csv':
+        rows = iter_csv_rows(path)
+    elif extensao in ('.xlsx', '.xlsm'):
+        rows = iter_xlsx_rows(path)
+    else:
+        raise ImportacaoError("Formato não suportado: use .csv ou .xlsx.")
+
+    columns, linha = None, 0
+    for linha, row in enumerate(rows, 1):
+        columns = import_columns(row)
+        if columns or linha >= IMPORT_HEADER_SCAN:
+            break
+    if not columns:
+        raise ImportacaoError("Cabeçalho não encontrado: a planilha precisa de uma coluna de protocolo.")
+
+    total, importados = 0, 0
+    rejeitados, vistos, datas, chunk = [], set(), set(), []
+    for linha, row in enumerate(rows, linha + 1):
+        record, motivo = import_record(row, columns)
+        if record is None:
+            continue
+        total += 1
+        if motivo is None and record['prot'] in vistos:
+            motivo = "Protocolo repetido na planilha."
+        if motivo:
+            rejeitados.append((linha, record['prot'] or '', motivo))
+            continue
+        vistos.add(record['prot'])
+        datas.add(record['data_protocolo'])
+        chunk.append((linha, record))
+        if len(chunk) >= IMPORT_CHUNK_ROWS:
+            importados += import_chunk(chunk, rejeitados)
+            chunk = []
+    if chunk:
+        importados += import_chunk(chunk, rejeitados)
+
+    if importados:
+        report_cache.invalidate(datas)
+        broadcaster.resync_all()
+    registrar_acao(operador, 'IMPORTAR',
+                   f"Planilha {nome_planilha}: {importados} importados, {len(rejeitados)} rejeitados")
+    return {
+        "total": total,
+        "imported": importados,
+        "rejected": len(rejeitados),
+        "rejects": [{"linha": l, "prot": p, "motivo": m} for l, p, m in sorted(rejeitados)[:IMPORT_REJECT_PREVIEW]],
+        "report": write_import_report(nome_planilha, rejeitados) if rejeitados else None,
+    }
+
+
+@app.route('/api/import/protocols', methods=['POST'])
+def import_protocols_route():
+    """Importa planilha enviada (multipart: file, operador)."""
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({"success": False, "message": "Nenhuma planilha enviada."}), 400
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(upload.filename)[1].lower())
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            upload.save(f)
+        result = import_protocols(path, request.form.get('operador') or 'NÃO IDENTIFICADO', upload.filename)
+        return jsonify({"success": True, **result})
+    except ImportacaoError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception:
+        logging.error("Erro em import_protocols", exc_info=True)
+        return jsonify({
+            "success": False,
+            "message": "Erro ao importar planilha."
+        }), 500
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+@app.route('/api/import/reports/<path:filename>', methods=['GET'])
+def import_report(filename):
+    """Baixa o relatório de rejeitados de uma importação."""
+    return send_from_directory(IMPORT_REPORT_DIR, filename, as_attachment=True)
+
+
+# Rota de API: Relatório 
+
+def report_filter_args(data):
+    """Traduz o filtro do modal de impressão para os filtros de protocol_period.
+
+    filter_type: 'all', 'month' (filter_value 'YYYY-MM'), 'year' (filter_value 'YYYY')
+    ou 'range' (date_from/date_to, datas inclusivas, qualquer ponta opcional).
+    """
+    filter_type = data.get('filter_type', 'all')
+    filter_value = data.get('filter_value', '')
+    if filter_type == 'month' and filter_value:
+        return {'month': filter_value}
+    if filter_type == 'year' and filter_value:
+        return {'year': str(filter_value)}
+    if filter_type == 'range':
+        return {'from': data.get('date_from'), 'to': data.get('date_to')}
+    return {}
+
+
+REPORT_CACHE_BYTES = int(os.getenv('REPORT_CACHE_BYTES', str(64 * 1024 * 1024)))
+REPORT_CACHE_DISK_BYTES = int(os.getenv('REPORT_CACHE_DISK_BYTES', str(256 * 1024 * 1024)))
+REPORT_CACHE_DIR = os.getenv('REPORT_CACHE_DIR')  # vazio: cache_relatorios/ na pasta de dados
+
+
+class ReportCache:
+    """Cache do corpo (linhas <tr>) dos relatórios, com resumo e período.
+
+    A chave inclui a versão dos dados do período (ver report_cache_key), então uma
+    entrada nunca é servida depois de uma mudança, nem vinda de outro terminal.
+    Memória: LRU limitado em bytes. Disco: um arquivo por chave na pasta de rede,
+    compartilhado entre terminais, também limitado em bytes (remove os mais antigos).
+    O cabeçalho (data de emissão) é sempre gerado na hora.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0):
+        self._max_bytes = max_bytes
+        self._entries = collections.OrderedDict()  # chave -> (período, resumo, corpo)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk_dir = None
+        self._disk_max_bytes = disk_max_bytes
+        if disk_dir and disk_max_bytes > 0:
+            try:
+                os.makedirs(disk_dir, exist_ok=True)
+                self._disk_dir = disk_dir
+            except OSError:
+                logging.error("Cache de relatórios em disco indisponível", exc_info=True)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_path(self, key):
+        return os.path.join(self._disk_dir, f"{key}.html")
+
+    def _remember(self, key, entry):
+        """Guarda na memória (chamar com o lock). Corpos maiores que 1/4 do limite ficam só no disco."""
+        size = len(entry[2])
+        if size > self._max_bytes // 4:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old[2])
+        self._entries[key] = entry
+        self._bytes += size
+        while self._bytes > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted[2])
+
+    def get(self, key):
+        """Retorna (resumo, corpo) ou None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+
+        if self._disk_dir:
+            try:
+                with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                    meta = json.loads(f.readline())
+                    body = f.read()
+                entry = (tuple(meta['periodo']), meta['resumo'], body)
+                with self._lock:
+                    self._remember(key, entry)
+                    self.disk_hits += 1
+                return entry[1], entry[2]
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError):
+                logging.error("Erro ao ler cache de relatório em disco", exc_info=True)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, periodo, resumo, body):
+        entry = (tuple(periodo), resumo, body)
+        with self._lock:
+            self._remember(key, entry)
+        if self._disk_dir:
+            self._write_disk(key, entry)
+
+    def _write_disk(self, key, entry):
+        # Arquivo temporário + os.replace: outro terminal nunca lê um arquivo pela metade
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self._disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({"periodo": entry[0], "resumo": entry[1]}) + '\n')
+                f.write(entry[2])
+            os.replace(tmp, self._disk_path(key))
+            self._prune_disk()
+        except OSError:
+            logging.error("Erro ao gravar cache de relatório em disco", exc_info=True)
+
+    def _prune_disk(self):
+        files = []
+        for path in glob.glob(os.path.join(self._disk_dir, '*.html')):
+            try:
+                st = os.stat(path)
+                files.append((st.st_mtime, st.st_size, path))
+            except OSError:
+                pass
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self._disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def tee(self, key, periodo, resumo, body):
+        """Repassa os pedaços do corpo e, se o gerador for consumido até o fim,
+        guarda o corpo completo (desde que caiba no limite do disco ou da memória)."""
+        limite = max(self._max_bytes // 4, self._disk_max_bytes if self._disk_dir else 0)
+        partes, size = [], 0
+        for parte in body:
+            if partes is not None:
+                size += len(parte)
+                if size > limite:
+                    partes = None
+                else:
+                    partes.append(parte)
+            yield parte
+        if partes is not None:
+            self.put(key, periodo, resumo, ''.join(partes))
+
+    def invalidate(self, datas):
+        """Descarta entradas cujo período contém alguma das datas alteradas (ISO ou date).
+
+        Protocolos sem data só afetam relatórios sem início nem fim.
+        """
+        datas = [d.isoformat() if hasattr(d, 'isoformat') else d for d in datas]
+        removidas = []
+        with self._lock:
+            for key, (periodo, _, body) in list(self._entries.items()):
+                inicio, fim = periodo
+                for data in datas:
+                    if data is None:
+                        afeta = inicio is None and fim is None
+                    else:
+                        afeta = (inicio is None or data >= inicio) and (fim is None or data < fim)
+                    if afeta:
+                        del self._entries[key]
+                        self._bytes -= len(body)
+                        removidas.append(key)
+                        break
+        for key in removidas:
+            if self._disk_dir:
+                try:
+                    os.remove(self._disk_path(key))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "disk_dir": self._disk_dir,
+            }
+
+
+report_cache = ReportCache(REPORT_CACHE_BYTES)  # disco ligado em init_app
+
+
+def report_cache_key(cursor, inicio, fim):
+    """Chave do relatório: período + versão dos dados desse período.
+
+    Conta também protocolos excluídos (soft delete): excluir, editar ou incluir
+    muda MAX(updated_at) do período, e mover um protocolo para fora dele muda o
+    COUNT. Mudanças em outros meses não invalidam um mês já fechado. Nomes de
+    usuario/recebedor só são inseridos (nunca renomeados) e só entram no relatório
+    por um protocolo gravado, que já muda a versão.
+    """
+    conds, params = period_conditions(inicio, fim)
+    cursor.execute(f'''
+        SELECT MAX(p.updated_at) as versao, COUNT(*) as linhas
+        FROM protocolo p
+        WHERE {' AND '.join(conds) or 'TRUE'}
+    ''', params)
+    row = cursor.fetchone()
+    raw = json.dumps([inicio, fim, str(row['versao']), row['linhas']])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def iter_report_rows(where, params):
+    """Linhas do relatório já formatadas, lidas em lotes de REPORT_FETCH_SIZE.
+
+    No PostgreSQL usa cursor nomeado (do lado do servidor). A conexão só é pega do
+    pool quando o gerador começa a ser consumido e volta a ele ao terminar ou ser
+    descartado (cliente desconectou no meio do stream).
+    """
+    conn = get_connection()
+    cursor = conn.cursor(name='relatorio')
+    try:
+        cursor.execute(f'''
+            SELECT
+                COALESCE(p.prot, '') as prot,
+                p.data_protocolo,
+                COALESCE(u.nome, '') as nome,
+                COALESCE(p.pmh, '') as pmh,
+                p.data_entrega,
+                COALESCE(r.nome, '') as recebedor
+            FROM protocolo p
+            LEFT JOIN usuario u ON p.usuario_id = u.id
+            LEFT JOIN recebedor r ON p.recebedor_id = r.id
+            WHERE {' AND '.join(where)}
+            ORDER BY p.prot
+        ''', params)
+        while True:
+            lote = cursor.fetchmany(REPORT_FETCH_SIZE)
+            if not lote:
+                break
+            # Formatar datas para DD/MM/YYYY
+            for row in lote:
+                yield (
+                    row['prot'],
+                    format_date_br(row['data_protocolo']),
+                    row['nome'],
+                    row['pmh'],
+                    format_date_br(row['data_entrega']),
+                    row['recebedor'],
+                )
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def report_document(data):
+    """Valida o filtro e devolve o gerador do HTML do relatório, do cache se a
+    versão dos dados do período não mudou. Levanta ValueError se o período for inválido.
+    """
+    # Período como intervalo semiaberto sobre a coluna (usa idx_protocolo_data)
+    inicio, fim = protocol_period(report_filter_args(data))
+    conds, params = period_conditions(inicio, fim)
+    where = ["p.ativo = TRUE"] + conds
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        key = report_cache_key(cursor, inicio, fim)
+        cached = report_cache.get(key)
+        if cached is not None:
+            resumo, corpo = cached
+            return iter_report_html([corpo], resumo['total'], resumo['entregues'], resumo['pendentes'])
+
+        # Resumo agregado no banco em vez de percorrer as linhas
+        resumo = protocol_status_counts(cursor, where, params)
+
+    corpo = report_cache.tee(key, (inicio, fim), resumo, iter_report_body(iter_report_rows(where, params)))
+    return iter_report_html(corpo, resumo['total'], resumo['entregues'], resumo['pendentes'])
+
+
+def registrar_relatorio(operador, data):
+    """Registra na auditoria a emissão do relatório com o período escolhido."""
+    filter_type = data.get('filter_type', 'all')
+    filter_value = data.get('filter_value', '')
+    if filter_type == 'month':
+        registrar_acao(operador, 'RELATORIO', f"Relatório mês {filter_value}")
+    elif filter_type == 'year':
+        registrar_acao(operador, 'RELATORIO', f"Relatório ano {filter_value}")
+    elif filter_type == 'range':
+        registrar_acao(operador, 'RELATORIO', f"Relatório período {data.get('date_from') or '...'} a {data.get('date_to') or '...'}")
+    else:
+        registrar_acao(operador, 'RELATORIO', "Relatório completo")
+
+
+@app.route('/api/print/preview', methods=['POST'])
+def print_preview():
+    """Gera preview HTML do relatório e abre no navegador da máquina do servidor."""
+    try:
+        data = request.json
+        try:
+            partes = report_document(data)
+        except ValueError:
+            return jsonify({"success": False, "message": "Período inválido."}), 400
+
+        # Escreve à medida que as linhas chegam do banco
+        temp_html = os.path.join(tempfile.gettempdir(), 'relatorio_preview.html')
+        with open(temp_html, 'w', encoding='utf-8') as f:
+            for parte in partes:
+                f.write(parte)
+
+        webbrowser.open('file://' + temp_html)
+        registrar_relatorio(data.get('operador', 'NÃO IDENTIFICADO'), data)
+        return jsonify({"success": True, "message": "Preview aberto no navegador."})
+    except Exception as e:
+        logging.error("Erro em print_preview", exc_info=True)
+        return jsonify({"success": False, "message": f"Erro: {str(e)}"}), 500
+
+
+@app.route('/api/print/report', methods=['GET'])
+def print_report():
+    """Relatório HTML transmitido em partes (chunked), para abrir em qualquer navegador da rede.
+
+    Query string igual ao corpo de /api/print/preview: filter_type, filter_value,
+    date_from, date_to e OPERADOR.
+    """
+    try:
+        data = request.args
+        try:
+            partes = report_document(data)
+        except ValueError:
+            return jsonify({"success": False, "message": "Período inválido."}), 400
+
+        registrar_relatorio(data.get('OPERADOR', 'NÃO IDENTIFICADO'), data)
+        return Response(partes, mimetype='text/html')
+    except Exception:
+        logging.error("Erro em print_report", exc_info=True)
+        return jsonify({"success": False, "message": "Erro ao gerar relatório."}), 500
+
+
+# Rota de API: Secretaria SAME (somente leitura)
+SECRETARIA_PAGE_SIZE = 200
+SECRETARIA_PAGE_MAX = 1000
+SECRETARIA_CHECK_INTERVAL = float(os.getenv('SECRETARIA_CHECK_INTERVAL', '2'))
+SECRETARIA_COLUMNS = ('id', 'protocolo', 'prontuario', 'nome', 'data_prot', 'finalidade', 'alta', 'obs')
+SECRETARIA_SELECT = '''
+    SELECT
+        id,
+        COALESCE(protocolo, '') as protocolo,
+        COALESCE(prontuario, '') as prontuario,
+        COALESCE(nome, '') as nome,
+        COALESCE(data_prot, '') as data_prot,
+        COALESCE(finalidade, '') as finalidade,
+        COALESCE(alta, '') as alta,
+        COALESCE(obs, '') as obs
+    FROM protocolos
+    ORDER BY id DESC
+'''
+
+
+def secretaria_month_key(data_prot):
+    """Extrai 'YYYY-MM' de data DD/MM/YYYY ou YYYY-MM-DD. Retorna None se não reconhecer."""
+    if '/' in data_prot:
+        parts = data_prot.split('/')
+        if len(parts) == 3 and len(parts[2].strip()) == 4:
+            return f"{parts[2].strip()}-{parts[1].strip().zfill(2)}"
+    elif '-' in data_prot:
+        parts = data_prot.split('-')
+        if len(parts) >= 2:
+            return f"{parts[0].strip()}-{parts[1].strip().zfill(2)}"
+    return None
+
+
+class SecretariaCache:
+    """Cópia em memória da tabela `protocolos` da Secretaria, em colunas.
+
+    O arquivo fica num compartilhamento de rede lento: a tabela só é relida quando
+    mtime/tamanho do banco ou do arquivo -wal mudam. Cada coluna é uma lista
+    (ordem id DESC) e o texto de busca e as contagens por mês são pré-calculados
+    na carga, então busca, paginação e gráfico não tocam mais o arquivo.
+    """
+
+    def __init__(self, path, check_interval):
+        self._path = path
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None  # (assinatura, colunas, texto_busca, contagem_mês)
+        self._checked_at = 0.0
+        self.loads = 0
+
+    def _signature(self):
+        return sqlite_file_signature(self._path)
+
+    def _load(self, signature):
+        conn = get_secretaria_connection()
+        try:
+            rows = conn.execute(SECRETARIA_SELECT).fetchall()
+        finally:
+            conn.close()
+
+        columns = {name: [row[i] for row in rows] for i, name in enumerate(SECRETARIA_COLUMNS)}
+        search_text = [
+            fold_text(f"{nome}\x00{prontuario}\x00{protocolo}")
+            for nome, prontuario, protocolo in zip(columns['nome'], columns['prontuario'], columns['protocolo'])
+        ]
+        month_counts = collections.Counter(
+            key for key in map(secretaria_month_key, columns['data_prot']) if key
+        )
+        self.loads += 1
+        return signature, columns, search_text, dict(sorted(month_counts.items()))
+
+    def snapshot(self):
+        """Retorna o snapshot atual, recarregando se o arquivo mudou."""
+        now = time.monotonic()
+        snap = self._snapshot
+        if snap is not None and now - self._checked_at < self._check_interval:
+            return snap
+        with self._lock:
+            snap = self._snapshot
+            signature = self._signature()
+            if snap is None or snap[0] != signature:
+                snap = self._snapshot = self._load(signature)
+            self._checked_at = time.monotonic()
+            return snap
+
+    def query(self, term='', offset=0, limit=SECRETARIA_PAGE_SIZE, compact=False):
+        """Busca por nome/prontuário/protocolo. Retorna (total, filtrados, linhas da página).
+
+        compact=True: linhas como listas na ordem de SECRETARIA_COLUMNS.
+        """
+        _, columns, search_text, _ = self.snapshot()
+        total = len(search_text)
+        term = fold_text(term.strip())
+        if term:
+            indices = [i for i, text in enumerate(search_text) if term in text]
+        else:
+            indices = range(total)
+        page = indices[offset:offset + limit]
+        values = [columns[name] for name in SECRETARIA_COLUMNS]
+        if compact:
+            rows = [[column[i] for column in values] for i in page]
+        else:
+            rows = [dict(zip(SECRETARIA_COLUMNS, [column[i] for column in values])) for i in page]
+        return total, len(indices), rows
+
+    def month_counts(self, last=12):
+        """Contagem de registros por mês (YYYY-MM), últimos `last` meses com dados."""
+        counts = self.snapshot()[3]
+        return [{"month": key, "count": counts[key]} for key in list(counts)[-last:]]
+
+
+secretaria_cache = SecretariaCache(SECRETARIA_DB_PATH, SECRETARIA_CHECK_INTERVAL)
+
+
+@app.route('/api/secretaria/protocols', methods=['GET'])
+def get_secretaria_protocols():
+    """Retorna protocolos da Secretaria SAME (read-only) a partir do cache em memória.
+
+    Query string: q (nome, prontuário ou protocolo), offset, limit, summary=1 para
+    incluir a contagem por mês dos últimos 12 meses e format=compact para linhas
+    como listas na ordem de "columns".
+    """
+    try:
+        if not os.path.exists(SECRETARIA_DB_PATH):
+            return jsonify({
+                "success": False,
+                "message": "Banco da Secretaria não encontrado na rede."
+            }), 404
+
+        try:
+            offset = max(int(request.args.get('offset', 0)), 0)
+            limit = min(max(int(request.args.get('limit', SECRETARIA_PAGE_SIZE)), 1), SECRETARIA_PAGE_MAX)
+        except ValueError:
+            return jsonify({"success": False, "message": "Paginação inválida."}), 400
+
+        compact = wants_compact()
+        total, filtered, rows = secretaria_cache.query(request.args.get('q', ''), offset, limit, compact)
+        result = {"success": True, "total": total, "filtered": filtered, "rows": rows}
+        if compact:
+            result["columns"] = SECRETARIA_COLUMNS
+        if request.args.get('summary') == '1':
+            result["months"] = secretaria_cache.month_counts()
+        return json_response(result)
+    except Exception:
+        logging.error("Erro em get_secretaria_protocols", exc_info=True)
+        return jsonify({
+            "success": False,
+            "message": "Erro ao buscar dados da Secretaria."
+        }), 500
+
+
+# EXPORTAÇÃO (CSV / XLSX)
+# As linhas vêm do banco em lotes (cursor nomeado no PostgreSQL, o sqlite3 já lê sob
+# demanda) e nunca ficam todas em memória. CSV sai em stream, um pedaço por lote.
+# XLSX é um zip e só fica pronto no fim: o openpyxl em modo write-only grava as
+# linhas em arquivo temporário e o arquivo final é enviado em pedaços e apagado.
+# Cabeçalho do CSV/XLSX de protocolos = cabeçalho aceito pela importação.
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+EXPORT_PROTOCOL_HEADER = ('PROT', 'DATA', 'NOME', 'PMH', 'ENTREGA', 'RECEBIMENTO')
+EXPORT_SECRETARIA_HEADER = tuple(name.upper() for name in SECRETARIA_COLUMNS)
+EXPORT_CHUNK_BYTES = 64 * 1024
+XLSX_MAX_ROWS = 1_048_575  # limite de linhas do Excel, menos o cabeçalho
+# Texto que começa assim vira fórmula no Excel/LibreOffice (injeção de fórmula):
+# sai com apóstrofo na frente, que a planilha mostra como texto puro
+EXPORT_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class ExportacaoError(Exception):
+    """Exportação que não dá para gerar (formato, dependência)."""
+
+
+def iter_secretaria_rows():
+    """Linhas da tabela `protocolos` da Secretaria (somente leitura), em lotes."""
+    conn = get_secretaria_connection()
+    try:
+        cursor = conn.execute(SECRETARIA_SELECT)
+        while True:
+            lote = cursor.fetchmany(REPORT_FETCH_SIZE)
+            if not lote:
+                break
+            yield from (tuple(row) for row in lote)
+    finally:
+        conn.close()
+
+
+def export_cell(value):
+    """Valor da célula exportada, com texto que seria fórmula escapado por apóstrofo."""
+    if isinstance(value, str) and value.startswith(EXPORT_FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+def export_row(row):
+    return tuple(export_cell(value) for value in row)
+
+
+def iter_export_csv(header, rows):
+    """CSV em pedaços de REPORT_FETCH_SIZE linhas (separador ';' e BOM: abre direto no Excel)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    rows = iter(rows)
+    while True:
+        lote = list(itertools.islice(rows, REPORT_FETCH_SIZE))
+        writer.writerows(map(export_row, lote))
+        if buffer.tell():
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if len(lote) < REPORT_FETCH_SIZE:
+            break
+
+
+def write_export_xlsx(header, rows, sheet_title):
+    """Grava XLSX em arquivo temporário com workbook write-only. Retorna o caminho.
+
+    Levanta ExportacaoError se passar de XLSX_MAX_ROWS linhas (o Excel cortaria o resto).
+    """
+    try:
+        import openpyxl
+    except ImportError:
+        raise ExportacaoError("Exportação em .xlsx requer o pacote openpyxl.")
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_title)
+    sheet.append(header)
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        try:
+            for linhas, row in enumerate(rows, 1):
+                if linhas > XLSX_MAX_ROWS:
+                    raise ExportacaoError(f"Mais de {XLSX_MAX_ROWS} linhas não cabem em uma planilha "
+                                          f"do Excel: exporte em CSV.")
+                sheet.append(export_row(row))
+        finally:
+            # Também quando a exportação é recusada: o save apaga os temporários do openpyxl
+            workbook.save(path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def iter_file_and_remove(path):
+    """Conteúdo do arquivo em pedaços de EXPORT_CHUNK_BYTES; apaga o arquivo no fim."""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(EXPORT_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def export_response(formato, nome, header, rows, sheet_title):
+    """Resposta para download de `rows` em CSV (stream) ou XLSX. Levanta ExportacaoError."""
+    if formato not in EXPORT_FORMATS:
+        raise ExportacaoError("Formato não suportado: use csv ou xlsx.")
+    mimetype, extensao = EXPORT_FORMATS[formato]
+    if formato == 'csv':
+        body = iter_export_csv(header, rows)
+        headers = {}
+    else:
+        path = write_export_xlsx(header, rows, sheet_title)
+        body = iter_file_and_remove(path)
+        headers = {'Content-Length': str(os.path.getsize(path))}
+    arquivo = f"{nome}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extensao}"
+    headers['Content-Disposition'] = f'attachment; filename="{arquivo}"'
+    return Response(body, mimetype=mimetype, headers=headers)
+
+
+@app.route('/api/export/protocols', methods=['GET'])
+def export_protocols():
+    """Exporta protocolos ativos em CSV ou XLSX (format=csv|xlsx).
+
+    Filtro igual ao de /api/print/report: filter_type, filter_value, date_from,
+    date_to e OPERADOR.
+    """
+    try:
+        data = request.args
+        try:
+            inicio, fim = protocol_period(report_filter_args(data))
+        except ValueError:
+            return jsonify({"success": False, "message": "Período inválido."}), 400
+        conds, params = period_conditions(inicio, fim)
+        rows = iter_report_rows(["p.ativo = TRUE"] + conds, params)
+
+        formato = data.get('format', 'csv')
+        response = export_response(formato, 'protocolos', EXPORT_PROTOCOL_HEADER, rows, 'Protocolos')
+        registrar_acao(data.get('OPERADOR', 'NÃO IDENTIFICADO'), 'EXPORTAR',
+                       f"Exportação de protocolos em {formato} (filtro {data.get('filter_type', 'all')})")
+        return response
+    except ExportacaoError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception:
+        logging.error("Erro em export_protocols", exc_info=True)
+        return jsonify({"success": False, "message": "Erro ao exportar protocolos."}), 500
+
+
+@app.route('/api/export/secretaria', methods=['GET'])
+def export_secretaria():
+    """Exporta a tabela da Secretaria SAME em CSV ou XLSX (format=csv|xlsx), lida do banco."""
+    try:
+        if not os.path.exists(SECRETARIA_DB_PATH):
+            return jsonify({
+                "success": False,
+                "message": "Banco da Secretaria não encontrado na rede."
+            }), 404
+        formato = request.args.get('format', 'csv')
+        return export_response(formato, 'secretaria', EXPORT_SECRETARIA_HEADER, iter_secretaria_rows(), 'Secretaria')
+    except ExportacaoError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception:
+        logging.error("Erro em export_secretaria", exc_info=True)
+        return jsonify({"success": False, "message": "Erro ao exportar dados da Secretaria."}), 500
+
+
+# Rotas de API: PDF 
+# Mesclagem roda em segundo plano: a rota devolve um job_id e o navegador consulta o
+# progresso. Workers limitados; jobs terminados ficam consultáveis por MERGE_JOB_TTL segundos.
+MERGE_WORKERS = int(os.getenv('MERGE_WORKERS', '2'))
+MERGE_QUEUE_MAX = int(os.getenv('MERGE_QUEUE_MAX', '20'))
+MERGE_JOB_TTL = int(os.getenv('MERGE_JOB_TTL', '3600'))
+MERGE_OUTPUT_NAME = "_ARQUIVO_FINAL_MESCLADO.pdf"
+
+
+class JobCancelled(Exception):
+    """Job cancelado pelo usuário durante a execução."""
+
+
+class MergeJob:
+    """Estado de uma mesclagem: progresso, erros por arquivo e resultado."""
+
+    def __init__(self, folder_path, files, remove_blank):
+        self.id = uuid.uuid4().hex
+        self.folder_path = folder_path
+        self.files = list(files)
+        self.remove_blank = remove_blank
+        self.status = 'queued'  # queued, running, done, error, cancelled
+        self.message = ''
+        self.files_done = 0
+        self.pages_total = 0
+        self.pages_analyzed = 0
+        self.pages_processed = 0
+        self.pages_added = 0
+        self.pages_skipped = 0
+        self.errors = []
+        self.output = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def finished(self):
+        return self.status in ('done', 'error', 'cancelled')
+
+    def finish(self, status, message):
+        self.status = status
+        self.message = message
+        self.finished_at = time.time()
+
+    def check_cancel(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "message": self.message,
+            "files_total": len(self.files),
+            "files_done": self.files_done,
+            "remove_blank": self.remove_blank,
+            "pages_total": self.pages_total,
+            "pages_analyzed": self.pages_analyzed,
+            "pages_processed": self.pages_processed,
+            "pages_added": self.pages_added,
+            "pages_skipped": self.pages_skipped,
+            "errors": list(self.errors),
+            "output": self.output,
+        }
+
+
+def write_pdf_atomic(writer, output_path):
+    """Grava o PDF num temporário na mesma pasta e troca com os.replace: quem abre o
+    arquivo final na rede nunca vê um PDF pela metade."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(output_path), prefix='.~', suffix='.pdf.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            writer.write(f)
+        os.replace(tmp, output_path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def run_merge_job(job):
+    """Executa a mesclagem de um job (em thread do pool)."""
+    from pypdf import PdfReader, PdfWriter
+
+    try:
+        job.check_cancel()
+        job.status = 'running'
+
+        # Abre os arquivos primeiro para saber o total de páginas (progresso)
+        readers = []
+        for filename in job.files:
+            job.check_cancel()
+            full_path = os.path.join(job.folder_path, filename)
+            if not os.path.exists(full_path):
+                job.errors.append(f"{filename}: arquivo não encontrado")
+                continue
+            try:
+                reader = PdfReader(full_path)
+                job.pages_total += len(reader.pages)
+                readers.append((filename, reader))
+            except Exception as e:
+                logging.warning(f"Erro ao ler {filename}: {e}")
+                job.errors.append(f"{filename}: {e}")
+
+        blank = {}
+        if job.remove_blank:
+            blank = blank_detector.analyze(
+                [(os.path.join(job.folder_path, filename), len(reader.pages)) for filename, reader in readers],
+                job,
+            )
+            try:
+                pdf_index.set_blank_pages(job.folder_path, {
+                    filename: sum(blank[os.path.join(job.folder_path, filename)]) for filename, _ in readers
+                })
+            except Exception:
+                logging.error("Erro ao atualizar índice de PDFs", exc_info=True)
+
+        writer = PdfWriter()
+        for filename, reader in readers:
+            verdicts = blank.get(os.path.join(job.folder_path, filename))
+            try:
+                for i, page in enumerate(reader.pages):
+                    job.check_cancel()
+                    if verdicts and verdicts[i]:
+                        job.pages_skipped += 1
+                    else:
+                        writer.add_page(page)
+                        job.pages_added += 1
+                    job.pages_processed += 1
+            except JobCancelled:
+                raise
+            except Exception as e:
+                logging.warning(f"Erro ao ler {filename}: {e}")
+                job.errors.append(f"{filename}: {e}")
+            job.files_done += 1
+
+        if job.pages_added == 0:
+            job.finish('error', "Nenhuma página válida encontrada.")
+            return
+
+        job.check_cancel()
+        output_path = os.path.join(job.folder_path, MERGE_OUTPUT_NAME)
+        write_pdf_atomic(writer, output_path)
+        job.output = output_path
+        job.finish('done', "Arquivos mesclados!")
+        open_file(output_path)
+    except JobCancelled:
+        job.finish('cancelled', "Mesclagem cancelada.")
+    except Exception as e:
+        logging.error("Erro em run_merge_job", exc_info=True)
+        job.finish('error', f"Erro: {e}")
 
-# APLICAÇÃO FLASK
-app = Flask(__name__)
-CORS(app)
 
-# Rotas de API: Protocolos 
-@app.route('/api/protocols', methods=['GET'])
-def get_protocols():
-    """Retorna todos os protocolos ativos."""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT
-                p.id as "ID",
-                p.prot as "PROT",
-                p.data_protocolo,
-                u.nome as "NOME",
-                p.pmh as "PMH",
-                p.data_entrega,
-                r.nome as "RECEBIMENTO"
-            FROM protocolo p
-            LEFT JOIN usuario u ON p.usuario_id = u.id
-            LEFT JOIN recebedor r ON p.recebedor_id = r.id
-            WHERE p.ativo = TRUE
-            ORDER BY p.data_protocolo DESC
-        ''')
-        rows = cursor.fetchall()
-        conn.close()
+class MergeJobManager:
+    """Fila de jobs de mesclagem sobre um pool de threads limitado."""
 
-        # Formatar datas para DD/MM/YYYY no Python
-        result = []
-        for row in rows:
-            result.append({
-                "ID": row["ID"],
-                "PROT": row["PROT"],
-                "DATA": format_date_br(row["data_protocolo"]),
-                "NOME": row["NOME"],
-                "PMH": row["PMH"],
-                "ENTREGA": format_date_br(row["data_entrega"]),
-                "RECEBIMENTO": row["RECEBIMENTO"],
-            })
-        return jsonify(result)
-    except Exception:
-        logging.error("Erro em get_protocols", exc_info=True)
-        return jsonify({"success": False, "message": "Erro ao buscar protocolos."}), 500
+    def __init__(self, workers, queue_max, ttl):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='merge')
+        self._queue_max = queue_max
+        self._ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
 
+    def _prune(self):
+        """Remove jobs terminados há mais de ttl segundos (chamar com o lock)."""
+        limite = time.time() - self._ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished() and j.finished_at < limite]:
+            del self._jobs[job_id]
 
-@app.route('/api/protocols/add', methods=['POST'])
-def add_protocol():
-    """Adiciona novo protocolo."""
-    try:
-        data = request.json
-        conn = get_connection()
-        cursor = conn.cursor()
+    def submit(self, job):
+        """Enfileira o job. Retorna False se a fila estiver cheia."""
+        with self._lock:
+            self._prune()
+            ativos = sum(1 for j in self._jobs.values() if not j.finished())
+            if ativos >= self._queue_max:
+                return False
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(run_merge_job, job)
+        return True
 
-        data_protocolo = parse_date(data.get('DATA'))
-        data_entrega = parse_date(data.get('ENTREGA'))
-        pmh = get_or_none(data.get('PMH'))
-        usuario_id = resolve_usuario(cursor, data.get('NOME'), pmh)
-        recebedor_id = resolve_recebedor(cursor, data.get('RECEBIMENTO'))
-
-        cursor.execute('''
-            INSERT INTO protocolo
-            (prot, data_protocolo, usuario_id, pmh, data_entrega, recebedor_id)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            data['PROT'],
-            data_protocolo,
-            usuario_id,
-            pmh,
-            data_entrega,
-            recebedor_id,
-        ))
-        conn.commit()
-        conn.close()
-        operador = data.get('OPERADOR', 'NÃO IDENTIFICADO')
-        registrar_acao(operador, 'ADICIONAR', f"Protocolo {data['PROT']} adicionado")
-        return jsonify({"success": True, "message": "Protocolo adicionado com sucesso."})
-    except Exception as e:
-        logging.error("Erro em add_protocol", exc_info=True)
-        return jsonify({"success": False, "message": f"Erro: {str(e)}"}), 500
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
 
+    def stats(self):
+        """Quantidade de jobs por status (inclui os terminados ainda não expirados)."""
+        with self._lock:
+            counts = dict.fromkeys(('queued', 'running', 'done', 'error', 'cancelled'), 0)
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
 
-@app.route('/api/protocols/edit', methods=['POST'])
-def edit_protocol():
-    """Edita protocolo existente."""
-    try:
-        data = request.json
-        conn = get_connection()
-        cursor = conn.cursor()
+    def cancel(self, job_id):
+        """Cancela o job: se ainda está na fila sai dela; se está rodando para na próxima página."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.finish('cancelled', "Mesclagem cancelada.")
+        return job
 
-        data_protocolo = parse_date(data.get('DATA'))
-        data_entrega = parse_date(data.get('ENTREGA'))
-        pmh = get_or_none(data.get('PMH'))
-        usuario_id = resolve_usuario(cursor, data.get('NOME'), pmh)
-        recebedor_id = resolve_recebedor(cursor, data.get('RECEBIMENTO'))
-
-        cursor.execute('''
-            UPDATE protocolo
-            SET data_protocolo = ?,
-                usuario_id = ?,
-                pmh = ?,
-                data_entrega = ?,
-                recebedor_id = ?
-            WHERE prot = ? AND ativo = TRUE
-        ''', (
-            data_protocolo,
-            usuario_id,
-            pmh,
-            data_entrega,
-            recebedor_id,
-            data['PROT'],
-        ))
-        conn.commit()
-        conn.close()
-        operador = data.get('OPERADOR', 'NÃO IDENTIFICADO')
-        registrar_acao(operador, 'EDITAR', f"Protocolo {data['PROT']} editado")
-        return jsonify({"success": True, "message": "Protocolo editado com sucesso."})
-    except Exception as e:
-        logging.error("Erro em edit_protocol", exc_info=True)
-        return jsonify({"success": False, "message": f"Erro: {str(e)}"}), 500
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
 
-@app.route('/api/protocols/delete', methods=['POST'])
-def delete_protocol():
-    """Deleta protocolo (soft delete)."""
-    try:
-        data = request.json
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'UPDATE protocolo SET ativo = FALSE WHERE id = ?',
-            (data['ID'],)
-        )
-        conn.commit()
-        conn.close()
-        operador = data.get('OPERADOR', 'NÃO IDENTIFICADO')
-        registrar_acao(operador, 'EXCLUIR', f"Protocolo ID {data['ID']} excluído")
-        return jsonify({"success": True, "message": "Protocolo excluído com sucesso."})
-    except Exception as e:
-        logging.error("Erro em delete_protocol", exc_info=True)
-        return jsonify({"success": False, "message": f"Erro: {str(e)}"}), 500
+merge_jobs = MergeJobManager(MERGE_WORKERS, MERGE_QUEUE_MAX, MERGE_JOB_TTL)
+atexit.register(merge_jobs.shutdown)
 
 
-# Rota de API: Relatório 
+# Índice de pastas de PDF: arquivo SQLite próprio (é um cache de metadados dos
+# arquivos, não dado do sistema). Só arquivos novos ou alterados (tamanho/mtime)
+# são relidos; a listagem sai do índice, paginada.
+PDF_INDEX_PATH = os.getenv('PDF_INDEX_PATH')  # vazio: indice_pdfs.db na pasta de dados
+PDF_LIST_PAGE_SIZE = 200
+PDF_LIST_PAGE_MAX = 1000
 
-@app.route('/api/print/preview', methods=['POST'])
-def print_preview():
-    """Gera preview HTML do relatório."""
-    try:
-        data = request.json
-        filter_type = data.get('filter_type', 'all')
-        filter_value = data.get('filter_value', '')
 
-        conn = get_connection()
-        cursor = conn.cursor()
+class PdfFolderIndex:
+    """Índice persistente dos PDFs de cada pasta: tamanho, mtime, páginas,
+    páginas em branco (preenchido pelas mesclagens) e hash do conteúdo."""
 
-        query = '''
-            SELECT
-                COALESCE(p.prot, '') as prot,
-                p.data_protocolo,
-                COALESCE(u.nome, '') as nome,
-                COALESCE(p.pmh, '') as pmh,
-                p.data_entrega,
-                COALESCE(r.nome, '') as recebedor
-            FROM protocolo p
-            LEFT JOIN usuario u ON p.usuario_id = u.id
-            LEFT JOIN recebedor r ON p.recebedor_id = r.id
-            WHERE p.ativo = TRUE
-        '''
-        params = []
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._ready = False
 
-        if filter_type == 'month' and filter_value:
-            if USE_POSTGRES:
-                query += " AND to_char(p.data_protocolo, 'YYYY-MM') = ?"
-            else:
-                query += " AND strftime('%Y-%m', p.data_protocolo) = ?"
-            params.append(filter_value)
-        elif filter_type == 'year' and filter_value:
-            if USE_POSTGRES:
-                query += " AND to_char(p.data_protocolo, 'YYYY') = ?"
-            else:
-                query += " AND strftime('%Y', p.data_protocolo) = ?"
-            params.append(str(filter_value))
+    def _connect(self):
+        conn = sqlite3.connect(self._path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._ready:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS pdf_arquivo (
+                    pasta TEXT NOT NULL,
+                    nome TEXT NOT NULL,
+                    tamanho INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    paginas INTEGER,
+                    paginas_em_branco INTEGER,
+                    sha1 TEXT,
+                    erro TEXT,
+                    indexado_em TEXT,
+                    PRIMARY KEY (pasta, nome)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_pdf_arquivo_ordem ON pdf_arquivo (pasta, mtime_ns, nome)')
+            conn.commit()
+            self._ready = True
+        return conn
 
-        query += " ORDER BY p.prot"
-        cursor.execute(query, params)
-        raw_rows = cursor.fetchall()
-        conn.close()
+    @staticmethod
+    def folder_key(folder):
+        return os.path.normcase(os.path.abspath(folder))
 
-        # Formatar datas para DD/MM/YYYY
-        rows = []
-        for row in raw_rows:
-            rows.append((
-                row['prot'],
-                format_date_br(row['data_protocolo']),
-                row['nome'],
-                row['pmh'],
-                format_date_br(row['data_entrega']),
-                row['recebedor'],
-            ))
+    @staticmethod
+    def _read(full_path):
+        """Lê páginas e hash de um PDF. Retorna (páginas, sha1, erro)."""
+        from pypdf import PdfReader
 
-        total = len(rows)
-        entregues = sum(1 for row in rows if row[4] and row[4].strip())
-        pendentes = total - entregues
+        try:
+            sha1 = file_sha1(full_path)
+            return len(PdfReader(full_path).pages), sha1, None
+        except Exception as e:
+            logging.warning(f"Erro ao indexar {full_path}: {e}")
+            return None, None, str(e)
 
-        html = build_report_html(rows, total, entregues, pendentes)
+    def refresh(self, folder):
+        """Sincroniza o índice com a pasta. Retorna (relidos, removidos)."""
+        # scandir já traz tamanho e mtime da listagem (no Windows sem stat extra por arquivo)
+        atuais = {}
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.name.lower().endswith('.pdf') and entry.is_file():
+                    st = entry.stat()
+                    atuais[entry.name] = (st.st_size, st.st_mtime_ns)
 
-        temp_html = os.path.join(tempfile.gettempdir(), 'relatorio_preview.html')
-        with open(temp_html, 'w', encoding='utf-8') as f:
-            f.write(html)
+        pasta = self.folder_key(folder)
+        with self._lock:
+            conn = self._connect()
+            try:
+                indexados = {
+                    row['nome']: (row['tamanho'], row['mtime_ns'])
+                    for row in conn.execute('SELECT nome, tamanho, mtime_ns FROM pdf_arquivo WHERE pasta = ?', (pasta,))
+                }
+                alterados = [nome for nome, sig in atuais.items() if indexados.get(nome) != sig]
+                removidos = [nome for nome in indexados if nome not in atuais]
 
-        webbrowser.open('file://' + temp_html)
-        operador = data.get('operador', 'NÃO IDENTIFICADO')
-        if filter_type == 'month':
-            registrar_acao(operador, 'RELATORIO', f"Relatório mês {filter_value}")
-        elif filter_type == 'year':
-            registrar_acao(operador, 'RELATORIO', f"Relatório ano {filter_value}")
-        else:
-            registrar_acao(operador, 'RELATORIO', "Relatório completo")
-        return jsonify({"success": True, "message": "Preview aberto no navegador."})
-    except Exception as e:
-        logging.error("Erro em print_preview", exc_info=True)
-        return jsonify({"success": False, "message": f"Erro: {str(e)}"}), 500
+                agora = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+                for nome in alterados:
+                    tamanho, mtime_ns = atuais[nome]
+                    paginas, sha1, erro = self._read(os.path.join(folder, nome))
+                    conn.execute('''
+                        INSERT INTO pdf_arquivo (pasta, nome, tamanho, mtime_ns, paginas, paginas_em_branco, sha1, erro, indexado_em)
+                        VALUES (?, ?, ?, ?, ?, NULL, ?, ?, ?)
+                        ON CONFLICT (pasta, nome) DO UPDATE SET
+                            tamanho = excluded.tamanho,
+                            mtime_ns = excluded.mtime_ns,
+                            paginas = excluded.paginas,
+                            paginas_em_branco = NULL,
+                            sha1 = excluded.sha1,
+                            erro = excluded.erro,
+                            indexado_em = excluded.indexado_em
+                    ''', (pasta, nome, tamanho, mtime_ns, paginas, sha1, erro, agora))
+                conn.executemany('DELETE FROM pdf_arquivo WHERE pasta = ? AND nome = ?', [(pasta, n) for n in removidos])
+                conn.commit()
+            finally:
+                conn.close()
+        return len(alterados), len(removidos)
 
+    def list(self, folder, offset=0, limit=PDF_LIST_PAGE_SIZE):
+        """Página da listagem (ordem de modificação, como antes). Retorna (total, linhas)."""
+        pasta = self.folder_key(folder)
+        conn = self._connect()
+        try:
+            total = conn.execute('SELECT COUNT(*) FROM pdf_arquivo WHERE pasta = ?', (pasta,)).fetchone()[0]
+            rows = conn.execute('''
+                SELECT nome, tamanho, mtime_ns, paginas, paginas_em_branco, erro
+                FROM pdf_arquivo
+                WHERE pasta = ?
+                ORDER BY mtime_ns, nome
+                LIMIT ? OFFSET ?
+            ''', (pasta, limit, offset)).fetchall()
+        finally:
+            conn.close()
+        return total, rows
 
-# Rota de API: Secretaria SAME (somente leitura)
-@app.route('/api/secretaria/protocols', methods=['GET'])
-def get_secretaria_protocols():
-    """Retorna todos os protocolos da Secretaria SAME (read-only)."""
-    try:
-        if not os.path.exists(SECRETARIA_DB_PATH):
-            return jsonify({
-                "success": False,
-                "message": "Banco da Secretaria não encontrado na rede."
-            }), 404
+    def names(self, folder):
+        """Todos os nomes indexados da pasta, na ordem da listagem."""
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT nome FROM pdf_arquivo WHERE pasta = ? ORDER BY mtime_ns, nome',
+                                (self.folder_key(folder),)).fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
 
-        conn = get_secretaria_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT
-                id,
-                COALESCE(protocolo, '') as protocolo,
-                COALESCE(prontuario, '') as prontuario,
-                COALESCE(nome, '') as nome,
-                COALESCE(data_prot, '') as data_prot,
-                COALESCE(finalidade, '') as finalidade,
-                COALESCE(alta, '') as alta,
-                COALESCE(obs, '') as obs
-            FROM protocolos
-            ORDER BY id DESC
-        ''')
-        rows = cursor.fetchall()
-        conn.close()
+    def set_blank_pages(self, folder, counts):
+        """Grava a contagem de páginas em branco apurada por uma mesclagem ({nome: n})."""
+        pasta = self.folder_key(folder)
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.executemany(
+                    'UPDATE pdf_arquivo SET paginas_em_branco = ? WHERE pasta = ? AND nome = ?',
+                    [(n, pasta, nome) for nome, n in counts.items()]
+                )
+                conn.commit()
+            finally:
+                conn.close()
 
-        result = []
-        for row in rows:
-            result.append({
-                "id": row["id"],
-                "protocolo": row["protocolo"],
-                "prontuario": row["prontuario"],
-                "nome": row["nome"],
-                "data_prot": row["data_prot"],
-                "finalidade": row["finalidade"],
-                "alta": row["alta"],
-                "obs": row["obs"],
-            })
-        return jsonify(result)
-    except Exception:
-        logging.error("Erro em get_secretaria_protocols", exc_info=True)
-        return jsonify({
-            "success": False,
-            "message": "Erro ao buscar dados da Secretaria."
-        }), 500
+
+pdf_index = None  # PdfFolderIndex criado em init_app
 
 
-# Rotas de API: PDF 
 @app.route('/api/list_pdfs', methods=['POST'])
 def list_pdfs():
-    """Lista PDFs em uma pasta."""
+    """Lista PDFs de uma pasta a partir do índice, paginado (offset, limit).
+
+    A primeira página (offset 0) sincroniza o índice com a pasta antes de listar.
+    """
     try:
         data = request.json
         folder_path = data.get('folder_path')
         if not folder_path or not os.path.isdir(folder_path):
             return jsonify({"success": False, "message": "Pasta inválida."}), 400
+        try:
+            offset = max(int(data.get('offset', 0)), 0)
+            limit = min(max(int(data.get('limit', PDF_LIST_PAGE_SIZE)), 1), PDF_LIST_PAGE_MAX)
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "Paginação inválida."}), 400
 
-        pdf_files = glob.glob(os.path.join(folder_path, '*.pdf'))
-        pdf_files.sort(key=os.path.getmtime)
-        file_names = [os.path.basename(f) for f in pdf_files]
-        return jsonify({"success": True, "files": file_names})
+        if offset == 0:
+            pdf_index.refresh(folder_path)
+        total, rows = pdf_index.list(folder_path, offset, limit)
+        files = [{
+            "name": row['nome'],
+            "size": row['tamanho'],
+            "modified": datetime.fromtimestamp(row['mtime_ns'] / 1e9).strftime('%d/%m/%Y %H:%M'),
+            "pages": row['paginas'],
+            "blank_pages": row['paginas_em_branco'],
+            "error": row['erro'],
+        } for row in rows]
+        next_offset = offset + len(files) if offset + len(files) < total else None
+        return jsonify({"success": True, "files": files, "total": total, "next_offset": next_offset})
     except Exception:
         logging.error("Erro em list_pdfs", exc_info=True)
         return jsonify({"success": False, "message": "Erro ao listar arquivos."}), 500
@@ -690,7 +4255,11 @@ def list_pdfs():
 
 @app.route('/api/merge_pdfs', methods=['POST'])
 def merge_pdfs():
-    """Mescla PDFs selecionados."""
+    """Inicia a mesclagem dos PDFs selecionados em segundo plano. Retorna o job_id.
+
+    select_all=true: a pasta inteira (do índice, na ordem da listagem) menos os nomes
+    em exclude. A tela carrega a lista aos poucos e não conhece todos os arquivos.
+    """
     try:
         data = request.json
         folder_path = data.get('folder_path')
@@ -699,40 +4268,40 @@ def merge_pdfs():
 
         if not folder_path or not os.path.isdir(folder_path):
             return jsonify({"success": False, "message": "Pasta inválida."}), 400
+        if data.get('select_all'):
+            exclude = set(data.get('exclude', []))
+            files_to_merge = [nome for nome in pdf_index.names(folder_path) if nome not in exclude]
         if not files_to_merge:
             return jsonify({"success": False, "message": "Nenhum arquivo selecionado."}), 400
 
-        writer = PdfWriter()
-        for filename in files_to_merge:
-            full_path = os.path.join(folder_path, filename)
-            if not os.path.exists(full_path):
-                continue
-            try:
-                reader = PdfReader(full_path)
-                for page in reader.pages:
-                    if remove_blank and is_page_blank(page):
-                        continue
-                    writer.add_page(page)
-            except Exception as e:
-                logging.warning(f"Erro ao ler {filename}: {e}")
-                continue
-
-        if len(writer.pages) == 0:
-            return jsonify({"success": False, "message": "Nenhuma página válida encontrada."}), 400
-
-        output_filename = os.path.join(folder_path, "_ARQUIVO_FINAL_MESCLADO.pdf")
-        with open(output_filename, "wb") as f:
-            writer.write(f)
-
-        open_file(output_filename)
-        return jsonify({"success": True, "message": "Arquivos mesclados!"})
+        job = MergeJob(folder_path, files_to_merge, remove_blank)
+        if not merge_jobs.submit(job):
+            return jsonify({"success": False, "message": "Muitas mesclagens em andamento. Tente novamente."}), 503
+        return jsonify({"success": True, "message": "Mesclagem iniciada.", **job.to_dict()}), 202
     except Exception as e:
         logging.error("Erro em merge_pdfs", exc_info=True)
         return jsonify({"success": False, "message": f"Erro: {e}"}), 500
 
 
-# Eel (ponte com desktop)
-@eel.expose
+@app.route('/api/merge_pdfs/<job_id>', methods=['GET'])
+def merge_pdfs_status(job_id):
+    """Progresso de uma mesclagem (páginas processadas/puladas, erros por arquivo)."""
+    job = merge_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Mesclagem não encontrada."}), 404
+    return jsonify({"success": True, **job.to_dict()})
+
+
+@app.route('/api/merge_pdfs/<job_id>/cancel', methods=['POST'])
+def merge_pdfs_cancel(job_id):
+    """Cancela uma mesclagem na fila ou em andamento."""
+    job = merge_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Mesclagem não encontrada."}), 404
+    return jsonify({"success": True, **job.to_dict()})
+
+
+# Eel (ponte com desktop): exposta com eel.expose no modo desktop, ver __main__
 def select_folder():
     """Abre janela para selecionar pasta - DESABILITADO EM EXECUTÁVEL."""
     print("Função de seleção de pasta não disponível no executável")
@@ -740,49 +4309,231 @@ def select_folder():
 
 
 # Rotas para PWA / arquivos estáticos
+# Na inicialização cada arquivo de static/, login/ e templates/ é lido para a memória
+# com um hash do conteúdo e já comprimido (gzip; brotli se o pacote estiver instalado).
+# O HTML sai com as URLs dos assets versionadas (?v=hash): com a versão certa o asset
+# é `immutable` por um ano; HTML e URLs sem versão revalidam pelo ETag.
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_LEVEL = 6            # gzip das respostas dinâmicas (JSON)
+ASSET_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript',
+                      'application/manifest+json', 'image/svg+xml', 'image/x-icon')
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# No Windows o registro pode mapear .js para text/plain
+mimetypes.add_type('application/javascript', '.js')
+mimetypes.add_type('text/css', '.css')
+
+
+def compress_bytes(data, encoding, static=False):
+    """Comprime `data`. Assets (static=True) usam o nível máximo: é feito uma vez só."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if static else 5)
+    return gzip.compress(data, 9 if static else COMPRESS_LEVEL, mtime=0)
+
+
+def accepted_encoding(available):
+    """Primeira codificação de `available` aceita pelo Accept-Encoding da requisição."""
+    for encoding in available:
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def is_compressible(mimetype):
+    return mimetype is not None and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+class StaticAssets:
+    """Arquivos estáticos em memória: conteúdo, hash e variantes comprimidas."""
+
+    ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+    _URL_ATTR = re.compile(r'((?:href|src)=")(/[^"?#]+)(")')
+
+    def __init__(self):
+        self._files = {}  # url -> (hash, mimetype, {codificação ou None: bytes})
+
+    def add(self, url, data, mimetype=None):
+        mimetype = mimetype or mimetypes.guess_type(url)[0] or 'application/octet-stream'
+        variants = {None: data}
+        if is_compressible(mimetype) and len(data) >= COMPRESS_MIN_SIZE:
+            for encoding in self.ENCODINGS:
+                compressed = compress_bytes(data, encoding, static=True)
+                if len(compressed) < len(data):
+                    variants[encoding] = compressed
+        self._files[url] = (hashlib.sha1(data).hexdigest()[:12], mimetype, variants)
+
+    def alias(self, url, target):
+        """Mesmo arquivo servido em outra URL."""
+        self._files[url] = self._files[target]
+
+    def load_dir(self, url_prefix, folder, skip=()):
+        """Carrega a pasta (sem subpastas). HTML fica por último: as URLs dele
+        são reescritas com o hash dos demais arquivos."""
+        html = []
+        for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+            if not entry.is_file() or entry.name in skip:
+                continue
+            with open(entry.path, 'rb') as f:
+                data = f.read()
+            if entry.name.endswith('.html'):
+                html.append((f"{url_prefix}/{entry.name}", data))
+            else:
+                self.add(f"{url_prefix}/{entry.name}", data)
+        return html
+
+    def versioned(self, url):
+        entry = self._files.get(url)
+        return f"{url}?v={entry[0]}" if entry else url
+
+    def rewrite_html(self, data):
+        """Troca href/src de assets conhecidos pela URL versionada."""
+        text = data.decode('utf-8')
+        text = self._URL_ATTR.sub(lambda m: m.group(1) + self.versioned(m.group(2)) + m.group(3), text)
+        return text.encode('utf-8')
+
+    def precache_urls(self):
+        """URLs versionadas dos assets (não HTML), para o service worker."""
+        return sorted({self.versioned(url) for url, (_, mimetype, _) in self._files.items()
+                       if mimetype != 'text/html' and url != '/sw.js'})
+
+    def version(self):
+        """Hash do conjunto: muda quando qualquer arquivo muda."""
+        return hashlib.sha1(''.join(h for h, _, _ in self._files.values()).encode()).hexdigest()[:12]
+
+    def response(self, url):
+        """Resposta do asset (com 304, compressão e Cache-Control), ou 404."""
+        entry = self._files.get(url)
+        if entry is None:
+            return jsonify({"success": False, "message": "Arquivo não encontrado."}), 404
+        digest, mimetype, variants = entry
+        encoding = accepted_encoding([e for e in self.ENCODINGS if e in variants])
+        etag = f"{digest}-{encoding}" if encoding else digest
+
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(variants[encoding], mimetype=mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        if len(variants) > 1:
+            response.vary.add('Accept-Encoding')
+        if request.args.get('v') == digest:
+            response.cache_control.public = True
+            response.cache_control.max_age = ASSET_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+
+def build_static_assets():
+    """Monta a tabela de assets: arquivos, HTML reescrito e o service worker."""
+    assets = StaticAssets()
+    html = assets.load_dir('/static', os.path.join(application_path, 'static'), skip=('sw.js',))
+    html += assets.load_dir('/static/login', os.path.join(application_path, 'login'))
+    html += assets.load_dir('/templates', os.path.join(application_path, 'templates'))
+    assets.alias('/manifest.json', '/static/manifest.json')
+    for name in ('intendencia.png', 'icone.ico'):
+        path = os.path.join(application_path, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                assets.add(f"/{name}", f.read())
+    for url, data in html:
+        assets.add(url, assets.rewrite_html(data))
+
+    # Service worker: lista de pré-cache e nome do cache gerados a cada inicialização
+    with open(os.path.join(application_path, 'static', 'sw.js'), 'rb') as f:
+        sw = f.read()
+    header = (f"const CACHE_NAME = 'sisregip-{assets.version()}';\n"
+              f"const PRECACHE_URLS = {json.dumps(assets.precache_urls())};\n")
+    assets.add('/sw.js', header.encode('utf-8') + sw, 'application/javascript')
+    return assets
+
+
+static_assets = None  # StaticAssets montado em init_app
+
+
+@app.after_request
+def compress_response(response):
+    """Comprime respostas (JSON, texto) acima de COMPRESS_MIN_SIZE.
+
+    Streams (SSE, relatório) e arquivos passam direto: comprimir exigiria juntar
+    o corpo inteiro antes de enviar.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or not is_compressible(response.mimetype)):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding(StaticAssets.ENCODINGS)
+    if encoding:
+        response.set_data(compress_bytes(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
 @app.route('/login')
 def login_page():
     """Serve a página de identificação do operador."""
-    return send_from_directory('login', 'login.html')
+    return static_assets.response('/static/login/login.html')
 
 @app.route('/static/login/<path:filename>')
 def serve_login_static(filename):
     """Serve arquivos estáticos da pasta login (CSS, JS, imagens)."""
-    return send_from_directory('login', filename)
+    return static_assets.response(f'/static/login/{filename}')
 
 @app.route('/')
 def index():
     """Redireciona para login se pasta login existir, senão serve dashboard."""
     login_path = os.path.join(application_path, 'login', 'login.html')
     if os.path.exists(login_path):
-        return send_from_directory('login', 'login.html')
-    return send_from_directory('templates', 'index.html')
+        return static_assets.response('/static/login/login.html')
+    return static_assets.response('/templates/index.html')
 
 @app.route('/dashboard')
 def dashboard():
     """Serve o dashboard principal (após identificação)."""
-    return send_from_directory('templates', 'index.html')
+    return static_assets.response('/templates/index.html')
 
 @app.route('/templates/<path:filename>')
 def serve_template(filename):
     """Serve arquivos HTML dos templates."""
-    return send_from_directory('templates', filename)
+    return static_assets.response(f'/templates/{filename}')
 
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     """Serve arquivos CSS/JS estáticos."""
-    return send_from_directory('static', filename)
+    return static_assets.response(f'/static/{filename}')
 
 @app.route('/manifest.json')
 def serve_manifest():
     """Serve o manifest.json."""
-    return send_from_directory('static', 'manifest.json')
+    return static_assets.response('/manifest.json')
 
 @app.route('/intendencia.png')
 def serve_logo():
     """Serve logo da intendência."""
-    return send_from_directory('.', 'intendencia.png')
+    return static_assets.response('/intendencia.png')
+
+@app.route('/icone.ico')
+def serve_icon():
+    """Serve o ícone (favicon) referenciado pelas páginas."""
+    return static_assets.response('/icone.ico')
+
+@app.route('/sw.js')
+def serve_service_worker():
+    """Serve o service worker na raiz (escopo '/')."""
+    return static_assets.response('/sw.js')
 
 @app.route('/api/auditoria/registrar', methods=['POST'])
 def registrar_auditoria():
@@ -792,7 +4543,6 @@ def registrar_auditoria():
         if request.content_type and 'json' in request.content_type:
             data = request.json
         else:
-            import json
             data = json.loads(request.data.decode('utf-8'))
 
         operador = data.get('operador', 'NÃO IDENTIFICADO')
@@ -802,24 +4552,300 @@ def registrar_auditoria():
         if not acao:
             return jsonify({"success": False, "message": "Ação não informada."}), 400
 
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO registro_operacional (operador, acao, detalhes, data_hora)
-            VALUES (?, ?, ?, ?)
-        ''', (operador, acao, detalhes, datetime.now().strftime('%d/%m/%Y %H:%M:%S')))
-        conn.commit()
-        conn.close()
+        audit_writer.record(operador, acao, detalhes)
 
         return jsonify({"success": True, "message": "Registrado."})
     except Exception as e:
         logging.error("Erro em registrar_auditoria", exc_info=True)
         return jsonify({"success": False, "message": f"Erro: {str(e)}"})
 
+@app.route('/api/pool/stats', methods=['GET'])
+def pool_stats():
+    """Retorna estatísticas do pool de conexões do banco."""
+    stats = _pool.stats()
+    stats["backend"] = "postgresql" if USE_POSTGRES else "sqlite"
+    return jsonify(stats)
+
+
+@app.route('/api/protocols/stream/stats', methods=['GET'])
+def stream_stats():
+    """Retorna estatísticas do stream SSE (clientes conectados, eventos publicados)."""
+    return jsonify(broadcaster.stats())
+
+
+@app.route('/api/print/cache/stats', methods=['GET'])
+def report_cache_stats():
+    """Retorna estatísticas do cache de relatórios (memória e disco)."""
+    return jsonify(report_cache.stats())
+
+
+@app.route('/api/names/cache/stats', methods=['GET'])
+def name_cache_stats():
+    """Retorna estatísticas dos caches de nome -> id (usuario e recebedor)."""
+    return jsonify({"usuario": usuario_ids.stats(), "recebedor": recebedor_ids.stats()})
+
+
+@app.route('/api/auditoria/stats', methods=['GET'])
+def audit_stats():
+    """Retorna estatísticas do gravador de auditoria (fila, lotes, diário local)."""
+    return jsonify(audit_writer.stats())
+
+
+def _pool_metrics():
+    stats = _pool.stats()
+    return [((('estado', estado),), stats[chave])
+            for estado, chave in (('em_uso', 'checked_out'), ('ociosa', 'idle'), ('aguardando', 'waiting'))]
+
+
+def _cache_metrics(field):
+    caches = {"usuario": usuario_ids.stats(), "recebedor": recebedor_ids.stats(), "relatorio": report_cache.stats()}
+    return [((('cache', nome),), stats[field]) for nome, stats in caches.items()]
+
+
+metrics.collector('sisregip_db_pool_connections', 'gauge', "Conexões do pool por estado.", _pool_metrics)
+metrics.collector('sisregip_db_pool_timeouts_total', 'counter', "Esperas por conexão que estouraram DB_POOL_TIMEOUT.",
+                  lambda: _pool.stats()["timeouts"])
+metrics.collector('sisregip_audit_queue_size', 'gauge', "Registros de auditoria na fila.",
+                  lambda: audit_writer.stats()["queued"])
+metrics.collector('sisregip_audit_journal_pending', 'gauge', "1 se há auditoria no diário local esperando o banco.",
+                  lambda: int(audit_writer.stats()["journal_pending"]))
+metrics.collector('sisregip_audit_spilled_total', 'counter', "Registros de auditoria desviados para o diário local.",
+                  lambda: audit_writer.stats()["spilled"])
+metrics.collector('sisregip_audit_written_total', 'counter', "Registros de auditoria gravados no banco.",
+                  lambda: audit_writer.stats()["written"])
+metrics.collector('sisregip_pdf_jobs', 'gauge', "Jobs de mesclagem de PDF por status.",
+                  lambda: [((('status', status),), n) for status, n in merge_jobs.stats().items()])
+metrics.collector('sisregip_pdf_pages_analyzed_total', 'counter', "Páginas analisadas na detecção de brancos.",
+                  lambda: [((('origem', 'analise'),), blank_detector.pages_analyzed),
+                           ((('origem', 'cache'),), blank_detector.pages_cached)])
+metrics.collector('sisregip_sse_clients', 'gauge', "Clientes conectados ao stream de protocolos.",
+                  lambda: broadcaster.stats()["clients"])
+metrics.collector('sisregip_cache_hits_total', 'counter', "Acertos dos caches em memória.",
+                  lambda: _cache_metrics("hits"))
+metrics.collector('sisregip_cache_misses_total', 'counter', "Faltas dos caches em memória.",
+                  lambda: _cache_metrics("misses"))
+metrics.collector('sisregip_process_start_time_seconds', 'gauge', "Início do processo (epoch).",
+                  lambda: metrics.started_at)
+metrics.collector('sisregip_startup_seconds', 'gauge', "Duração de cada etapa da inicialização.",
+                  lambda: [((('etapa', etapa),), segundos) for etapa, segundos in startup_times.items()])
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Métricas do processo no formato texto do Prometheus."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# SERVIDOR
+# waitress: servidor WSGI de produção em Python puro (roda no Windows), com pool de
+# threads. Um processo só, de propósito: stream SSE, jobs de mesclagem, caches e a
+# fila de auditoria vivem na memória do processo. Sem waitress instalado, cai para
+# o servidor do Flask com threads.
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = 8001  # fixo: o frontend monta a URL da API com esta porta
+# Threads: SERVER_THREADS (junto do pool de conexões, que tem o mesmo tamanho)
+SERVER_CONNECTION_LIMIT = int(os.getenv('SERVER_CONNECTION_LIMIT', '250'))
+# Conexão sem atividade por mais que isso é fechada (cliente travado ou lento demais)
+SERVER_CHANNEL_TIMEOUT = int(os.getenv('SERVER_CHANNEL_TIMEOUT', '120'))
+# Tempo máximo esperando requisições em andamento terminarem no desligamento
+SERVER_SHUTDOWN_TIMEOUT = float(os.getenv('SERVER_SHUTDOWN_TIMEOUT', '30'))
+
+
+class RequestTracker:
+    """Middleware WSGI: conta requisições em andamento e recusa novas no desligamento."""
+
+    def __init__(self, wsgi_app):
+        self._app = wsgi_app
+        self._active = 0
+        self._cond = threading.Condition()
+        self.draining = False
+
+    def _done(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def __call__(self, environ, start_response):
+        if self.draining:
+            start_response('503 Service Unavailable', [
+                ('Content-Type', 'application/json'),
+                ('Retry-After', '5'),
+            ])
+            return [b'{"success": false, "message": "Servidor reiniciando."}']
+        with self._cond:
+            self._active += 1
+        try:
+            result = self._app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        return _TrackedResponse(result, self._done)
+
+    def active(self):
+        with self._cond:
+            return self._active
+
+    def wait_idle(self, timeout):
+        """Espera as requisições em andamento terminarem. Retorna False se o tempo acabar."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._active == 0, timeout)
+
+
+class _TrackedResponse:
+    """Corpo da resposta: a requisição só conta como terminada no close() (fim do envio)."""
+
+    def __init__(self, result, done):
+        self._result = result
+        self._done = done
+
+    def __iter__(self):
+        return iter(self._result)
+
+    def close(self):
+        try:
+            close = getattr(self._result, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._done()
+
+
+app.wsgi_app = request_tracker = RequestTracker(app.wsgi_app)
+
+
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    """Prontidão para receber tráfego: banco respondendo e servidor fora do desligamento."""
+    if request_tracker.draining:
+        return jsonify({"ready": False, "reason": "desligando"}), 503
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    except Exception:
+        logging.error("Banco indisponível na verificação de prontidão", exc_info=True)
+        return jsonify({"ready": False, "reason": "banco indisponível"}), 503
+    return jsonify({"ready": True, "in_flight": request_tracker.active() - 1})
+
+
+def graceful_shutdown(server):
+    """Para de aceitar requisições, espera as em andamento e fecha o servidor.
+
+    Streams SSE não terminam sozinhos: são encerrados antes da espera (o navegador
+    reconecta sozinho quando o serviço voltar).
+    """
+    request_tracker.draining = True
+    broadcaster.close()
+    if not request_tracker.wait_idle(SERVER_SHUTDOWN_TIMEOUT):
+        logging.error(f"Desligamento: {request_tracker.active()} requisições não terminaram "
+                      f"em {SERVER_SHUTDOWN_TIMEOUT}s")
+
+    # Mesmo caminho de um Ctrl+C: o handler (já em desligamento) levanta
+    # KeyboardInterrupt na thread principal, e server.run() para o despachante e
+    # retorna; run_flask fecha o servidor em seguida.
+    signal.raise_signal(signal.SIGINT)
+
+
+def install_shutdown_handlers(server):
+    """SIGTERM/SIGINT (e CTRL_BREAK no Windows) iniciam o desligamento gracioso.
+
+    Um segundo sinal durante a espera encerra na hora.
+    """
+    def handler(signum, frame):
+        if request_tracker.draining:
+            raise KeyboardInterrupt
+        print("Desligando: aguardando requisições em andamento...")
+        threading.Thread(target=graceful_shutdown, args=(server,), name='desligamento', daemon=True).start()
+
+    for name in ('SIGTERM', 'SIGINT', 'SIGBREAK'):
+        signum = getattr(signal, name, None)
+        if signum is not None:
+            signal.signal(signum, handler)
+
+
 # INICIALIZAÇÃO
-def run_flask():
-    """Inicia servidor Flask."""
-    app.run(host='0.0.0.0', port=8001, debug=False, use_reloader=False)
+startup_step('rotas e serviços')
+server_ready = threading.Event()  # porta aberta: o modo desktop já pode abrir a janela
+
+
+def init_app():
+    """Inicialização com efeitos colaterais, na ordem: DriftBrake, pasta de rede e
+    logs, banco (índices, perfil SQLite), índice de busca, auditoria, cache de nomes
+    e arquivos estáticos. Chamar uma vez, antes de servir ou usar o banco."""
+    global network_data_path, IMPORT_REPORT_DIR, report_cache, pdf_index, static_assets
+    if network_data_path is not None:
+        return
+
+    DriftBrake.run_from_env()
+    # Se drift foi detectado e corresponde a fail_on, o processo encerra aqui com o código certo.
+    # Se não há drift, a execução continua.
+    startup_step('driftbrake')
+
+    network_data_path = get_network_data_path()
+    setup_logging()
+    IMPORT_REPORT_DIR = os.path.join(network_data_path, 'importacoes')
+    startup_step('pasta de rede')
+
+    check_database()
+    ensure_schema()
+    if not USE_POSTGRES:
+        ensure_sqlite_profile()
+        sqlite_optimizer.start()
+        atexit.register(sqlite_optimizer.close)
+    startup_step('banco')
+
+    ensure_search_index()
+    startup_step('índice de busca')
+
+    audit_writer.start()
+    atexit.register(audit_writer.close)
+    ensure_name_cache()
+    startup_step('cache de nomes')
+
+    report_cache = ReportCache(REPORT_CACHE_BYTES, REPORT_CACHE_DIR or os.path.join(network_data_path, 'cache_relatorios'),
+                               REPORT_CACHE_DISK_BYTES)
+    pdf_index = PdfFolderIndex(PDF_INDEX_PATH or os.path.join(network_data_path, 'indice_pdfs.db'))
+    static_assets = build_static_assets()
+    startup_step('arquivos estáticos')
+
+
+def startup_report():
+    """Linha com o tempo total da inicialização e de cada etapa."""
+    total = sum(startup_times.values())
+    etapas = ', '.join(f"{etapa} {segundos * 1000:.0f} ms" for etapa, segundos in startup_times.items())
+    return f"Inicialização: {total * 1000:.0f} ms ({etapas})"
+
+
+def run_flask(service=False):
+    """Inicia servidor HTTP (waitress). No modo serviço, com desligamento gracioso por sinal."""
+    try:
+        from waitress import create_server
+    except ImportError:
+        print("AVISO: waitress não instalado; usando servidor de desenvolvimento do Flask.")
+        print(startup_report())
+        server_ready.set()
+        app.run(host=SERVER_HOST, port=SERVER_PORT, debug=False, use_reloader=False, threaded=True)
+        return
+
+    server = create_server(
+        app,
+        host=SERVER_HOST,
+        port=SERVER_PORT,
+        threads=SERVER_THREADS,
+        connection_limit=SERVER_CONNECTION_LIMIT,
+        channel_timeout=SERVER_CHANNEL_TIMEOUT,
+        ident='SISREGIP',
+    )
+    startup_step('servidor')
+    print(startup_report())
+    server_ready.set()
+    if service:
+        install_shutdown_handlers(server)
+    try:
+        server.run()
+    finally:
+        server.task_dispatcher.shutdown(cancel_pending=True, timeout=5)
+        server.close()
 
 
 def is_running_as_service():
@@ -831,6 +4857,7 @@ def is_running_as_service():
 
 
 if __name__ == '__main__':
+    init_app()
     is_service = is_running_as_service()
 
     _db_label = f"PostgreSQL ({_PG_HOST}/{_PG_NAME})" if USE_POSTGRES else f"SQLite ({SQLITE_DB_PATH})"
@@ -842,9 +4869,9 @@ if __name__ == '__main__':
         print("=" * 60)
         print(f"Pasta de dados: {network_data_path}")
         print(f"Banco: {_db_label}")
-        print("Acesse: http://localhost:8001")
+        print(f"Acesse: http://localhost:{SERVER_PORT}")
         print("=" * 60)
-        run_flask()
+        run_flask(service=True)
     else:
         # MODO DESKTOP: Eel + Flask
         print("=" * 60)
@@ -855,14 +4882,18 @@ if __name__ == '__main__':
         print("Iniciando interface...")
         print("=" * 60)
 
+        import eel
+
+        eel.expose(select_folder)
         eel.init(application_path)
         flask_thread = threading.Thread(target=run_flask, daemon=True)
         flask_thread.start()
-        eel.sleep(2.0)
+        # Abre a janela assim que a porta estiver aberta (antes: espera fixa de 2s)
+        server_ready.wait(10)
 
         try:
             eel.start(
-                {'port': 8001},
+                {'port': SERVER_PORT},
                 mode='chrome',
                 size=(1280, 760),
                 position=(100, 100),
@@ -870,5 +4901,5 @@ if __name__ == '__main__':
             )
         except (IOError, SystemError) as e:
             print(f"\nErro ao iniciar interface Eel: {e}")
-            print("\nTente acessar via navegador: http://localhost:8001")
+            print(f"\nTente acessar via navegador: http://localhost:{SERVER_PORT}")
             input("\nPressione ENTER para sair...")
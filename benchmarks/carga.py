@@ -0,0 +1,248 @@
+# Teste de carga HTTP: N clientes concorrentes por um tempo fixo, misturando os
+# cenários listar (/api/protocols), adicionar/editar, print_preview e merge_pdfs.
+# Mede latência (p50/p95/p99) e vazão por cenário e grava em JSON.
+#
+# Uso: python benchmarks/carga.py --dados benchmarks/dados/100k --subir-servidor
+#      python benchmarks/carga.py --url http://servidor:8001 --cenarios listar,editar
+
+import argparse
+import gzip
+import http.client
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+from comum import RAIZ, resumo, salvar_resultado
+
+# Peso de cada cenário na mistura (proporção aproximada das requisições)
+PESOS = {'listar': 70, 'adicionar': 10, 'editar': 10, 'preview': 7, 'mesclar': 3}
+MESCLA_TIMEOUT = 300
+
+
+class Cliente:
+    """Conexão HTTP persistente (keep-alive) de um cliente da carga."""
+
+    def __init__(self, url):
+        partes = urllib.parse.urlsplit(url)
+        self._host, self._port = partes.hostname, partes.port or 80
+        self._conn = None
+
+    def requisitar(self, metodo, caminho, corpo=None):
+        """Retorna (status, JSON ou None). Reconecta uma vez se a conexão caiu."""
+        dados = json.dumps(corpo).encode('utf-8') if corpo is not None else None
+        cabecalhos = {'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'} if dados else {'Accept-Encoding': 'gzip'}
+        for tentativa in (1, 2):
+            try:
+                if self._conn is None:
+                    self._conn = http.client.HTTPConnection(self._host, self._port, timeout=120)
+                self._conn.request(metodo, caminho, body=dados, headers=cabecalhos)
+                resposta = self._conn.getresponse()
+                conteudo = resposta.read()
+                if resposta.getheader('Content-Encoding') == 'gzip':
+                    conteudo = gzip.decompress(conteudo)
+                try:
+                    return resposta.status, json.loads(conteudo) if conteudo else None
+                except ValueError:
+                    return resposta.status, None
+            except (http.client.HTTPException, OSError):
+                self._conn = None
+                if tentativa == 2:
+                    raise
+
+
+class Carga:
+    """Executa os cenários em threads e junta as latências por cenário."""
+
+    def __init__(self, url, cenarios, pasta_pdfs, semente):
+        self.url = url
+        self.cenarios = cenarios
+        self.pasta_pdfs = pasta_pdfs
+        self.semente = semente
+        self.latencias = {nome: [] for nome in cenarios}
+        self.erros = {nome: 0 for nome in cenarios}
+        self._lock = threading.Lock()
+        self._arquivos_pdf = []
+        self._meses = []
+        self._nomes = []
+
+    def preparar(self):
+        """Lê da própria API os meses, nomes e PDFs usados nos cenários."""
+        cliente = Cliente(self.url)
+        _, stats = cliente.requisitar('GET', '/api/protocols/stats?months=24')
+        self._meses = [m['mes'] for m in (stats or {}).get('por_mes', [])] or ['2025-06']
+        _, pagina = cliente.requisitar('GET', '/api/protocols?limit=200')
+        self._nomes = sorted({p['NOME'] for p in (pagina or {}).get('protocols', []) if p.get('NOME')}) or ['BENCHMARK']
+        if 'mesclar' in self.cenarios:
+            _, lista = cliente.requisitar('POST', '/api/list_pdfs', {'folder_path': self.pasta_pdfs, 'limit': 500})
+            self._arquivos_pdf = [f['name'] for f in (lista or {}).get('files', [])
+                                  if not f['name'].startswith('_ARQUIVO_FINAL')]
+            if not self._arquivos_pdf:
+                sys.exit(f"Sem PDFs em {self.pasta_pdfs} para o cenário mesclar.")
+
+    def _registrar(self, cenario, inicio, ok):
+        with self._lock:
+            if ok:
+                self.latencias[cenario].append(time.perf_counter() - inicio)
+            else:
+                self.erros[cenario] += 1
+
+    def _executar(self, cliente, rng, cenario, meus_prots, id_cliente):
+        if cenario == 'listar':
+            filtro = rng.choice([
+                {}, {'q': rng.choice(self._nomes).split()[0]}, {'month': rng.choice(self._meses)},
+                {'status': 'pendente'},
+            ])
+            status, _ = cliente.requisitar('GET', '/api/protocols?' + urllib.parse.urlencode({'limit': 100, **filtro}))
+            return status == 200
+        if cenario in ('adicionar', 'editar'):
+            if cenario == 'editar' and meus_prots:
+                prot = rng.choice(meus_prots)
+                caminho = '/api/protocols/edit'
+            else:
+                prot = f"B{id_cliente:02d}{len(meus_prots):06d}{rng.randrange(100):02d}"
+                caminho = '/api/protocols/add'
+            status, corpo = cliente.requisitar('POST', caminho, {
+                'PROT': prot, 'DATA': time.strftime('%d/%m/%Y'), 'NOME': rng.choice(self._nomes),
+                'PMH': str(rng.randint(1000, 9999)), 'RECEBIMENTO': '', 'ENTREGA': '', 'OPERADOR': 'BENCHMARK',
+            })
+            ok = status == 200 and bool(corpo and corpo.get('success'))
+            if ok and caminho.endswith('add'):
+                meus_prots.append(prot)
+            return ok
+        if cenario == 'preview':
+            status, corpo = cliente.requisitar('POST', '/api/print/preview', {
+                'filter_type': 'month', 'filter_value': rng.choice(self._meses), 'operador': 'BENCHMARK',
+            })
+            return status == 200 and bool(corpo and corpo.get('success'))
+        if cenario == 'mesclar':
+            # Latência de ponta a ponta: envio do job até o fim da mesclagem
+            arquivos = rng.sample(self._arquivos_pdf, min(len(self._arquivos_pdf), rng.randint(2, 5)))
+            status, job = cliente.requisitar('POST', '/api/merge_pdfs', {
+                'folder_path': self.pasta_pdfs, 'files_to_merge': arquivos, 'remove_blank': True,
+            })
+            if status != 202:
+                return False
+            limite = time.monotonic() + MESCLA_TIMEOUT
+            while time.monotonic() < limite:
+                time.sleep(0.1)
+                _, job = cliente.requisitar('GET', f"/api/merge_pdfs/{job['job_id']}")
+                if job and job.get('status') not in ('queued', 'running'):
+                    return job.get('status') == 'done'
+            return False
+        raise ValueError(cenario)
+
+    def _trabalhador(self, id_cliente, fim):
+        rng = random.Random(self.semente * 1000 + id_cliente)
+        cliente = Cliente(self.url)
+        nomes, pesos = zip(*[(c, PESOS[c]) for c in self.cenarios])
+        meus_prots = []
+        while time.monotonic() < fim:
+            cenario = rng.choices(nomes, pesos)[0]
+            inicio = time.perf_counter()
+            try:
+                ok = self._executar(cliente, rng, cenario, meus_prots, id_cliente)
+            except Exception:
+                ok = False
+            self._registrar(cenario, inicio, ok)
+
+    def rodar(self, clientes, duracao):
+        fim = time.monotonic() + duracao
+        threads = [threading.Thread(target=self._trabalhador, args=(i, fim), daemon=True) for i in range(clientes)]
+        inicio = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - inicio
+
+
+def subir_servidor(args):
+    """Inicia benchmarks/servidor.py e espera /api/ready. Retorna o processo."""
+    comando = [sys.executable, os.path.join(RAIZ, 'benchmarks', 'servidor.py'), '--dados', args.dados]
+    if args.postgres:
+        comando.append('--postgres')
+    # stdin fechado: app.py entra no modo serviço. No Windows, CTRL_BREAK só chega a
+    # um processo que lidera o próprio grupo (ver parar_servidor)
+    flags = subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0
+    processo = subprocess.Popen(comando, cwd=RAIZ, stdin=subprocess.DEVNULL, creationflags=flags)
+    limite = time.monotonic() + 120
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            sys.exit("Servidor terminou antes de ficar pronto.")
+        try:
+            status, _ = Cliente(args.url).requisitar('GET', '/api/ready')
+            if status == 200:
+                return processo
+        except OSError:
+            pass
+        time.sleep(0.5)
+    processo.kill()
+    sys.exit("Servidor não ficou pronto em 120s.")
+
+
+def parar_servidor(processo):
+    """Desligamento gracioso (SIGTERM; CTRL_BREAK no Windows), como no serviço."""
+    if os.name == 'nt':
+        processo.send_signal(signal.CTRL_BREAK_EVENT)
+    else:
+        processo.terminate()
+    try:
+        processo.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        processo.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga HTTP do SISREGIP.")
+    parser.add_argument('--url', default='http://localhost:8001')
+    parser.add_argument('--dados', help="pasta gerada por gerar_dados.py (PDFs e --subir-servidor)")
+    parser.add_argument('--subir-servidor', action='store_true', help="inicia benchmarks/servidor.py com --dados")
+    parser.add_argument('--postgres', action='store_true', help="servidor usa o PostgreSQL de BENCH_DATABASE_URL")
+    parser.add_argument('--clientes', type=int, default=8)
+    parser.add_argument('--duracao', type=float, default=30, help="segundos de carga")
+    parser.add_argument('--cenarios', default=','.join(PESOS), help=f"subconjunto de {','.join(PESOS)}")
+    parser.add_argument('--pasta-pdfs', help="pasta de PDFs para mesclar (padrão: <dados>/pdfs)")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', default=os.path.join('benchmarks', 'resultados', 'carga.json'))
+    args = parser.parse_args()
+
+    cenarios = [c.strip() for c in args.cenarios.split(',') if c.strip()]
+    desconhecidos = set(cenarios) - set(PESOS)
+    if desconhecidos:
+        parser.error(f"cenários desconhecidos: {', '.join(sorted(desconhecidos))}")
+    if args.subir_servidor and not args.dados:
+        parser.error("--subir-servidor requer --dados")
+    pasta_pdfs = args.pasta_pdfs or (os.path.abspath(os.path.join(args.dados, 'pdfs')) if args.dados else None)
+    if 'mesclar' in cenarios and not pasta_pdfs:
+        parser.error("o cenário mesclar requer --dados ou --pasta-pdfs")
+
+    processo = subir_servidor(args) if args.subir_servidor else None
+    try:
+        carga = Carga(args.url, cenarios, pasta_pdfs, args.semente)
+        carga.preparar()
+        print(f"Carga: {args.clientes} clientes por {args.duracao:.0f}s ({', '.join(cenarios)})")
+        duracao = carga.rodar(args.clientes, args.duracao)
+    finally:
+        if processo is not None:
+            parar_servidor(processo)
+
+    resultados = {c: resumo(carga.latencias[c], duracao, carga.erros[c]) for c in cenarios}
+    todas = [l for c in cenarios for l in carga.latencias[c]]
+    resultados['total'] = resumo(todas, duracao, sum(carga.erros.values()))
+    for nome, r in resultados.items():
+        print(f"  {nome:10} n={r['n']:<6} erros={r['erros']:<4} p50 {r['p50_ms']} ms  p95 {r['p95_ms']} ms  "
+              f"p99 {r['p99_ms']} ms  {r['vazao_ops']} req/s")
+    salvar_resultado(args.saida, 'carga', {
+        "url": args.url, "clientes": args.clientes, "duracao_s": args.duracao,
+        "cenarios": cenarios, "pesos": {c: PESOS[c] for c in cenarios}, "semente": args.semente,
+    }, resultados)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Compara dois resultados (micro.py ou carga.py) e aponta regressões.
+# Sai com código 1 se algum p95 piorou além do limite, para uso em script/CI.
+#
+# Uso: python benchmarks/comparar.py resultados/antes.json resultados/depois.json [--limite 10]
+
+import argparse
+import json
+import sys
+
+METRICAS = ('p50_ms', 'p95_ms', 'p99_ms', 'vazao_ops')
+
+
+def carregar(caminho):
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def variacao(antes, depois):
+    """Variação percentual de `antes` para `depois` (None se não dá para calcular)."""
+    if antes is None or depois is None or not antes:
+        return None
+    return (depois - antes) / antes * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara dois resultados de benchmark.")
+    parser.add_argument('antes')
+    parser.add_argument('depois')
+    parser.add_argument('--limite', type=float, default=10.0, help="piora máxima do p95, em %% (padrão 10)")
+    args = parser.parse_args()
+
+    antes, depois = carregar(args.antes), carregar(args.depois)
+    if antes.get('tipo') != depois.get('tipo'):
+        sys.exit(f"Resultados de tipos diferentes: {antes.get('tipo')} x {depois.get('tipo')}")
+    print(f"{antes['versao']} ({antes['executado_em']})  ->  {depois['versao']} ({depois['executado_em']})")
+    if antes.get('parametros') != depois.get('parametros'):
+        print("Aviso: parâmetros diferentes entre as execuções.")
+
+    regressoes = []
+    for nome in depois['resultados']:
+        a, d = antes['resultados'].get(nome), depois['resultados'][nome]
+        if a is None:
+            print(f"  {nome:18} (novo)")
+            continue
+        colunas = []
+        for metrica in METRICAS:
+            v = variacao(a.get(metrica), d.get(metrica))
+            colunas.append(f"{metrica} {a.get(metrica)} -> {d.get(metrica)}" + (f" ({v:+.1f}%)" if v is not None else ""))
+        print(f"  {nome:18} " + "  ".join(colunas))
+        v95 = variacao(a.get('p95_ms'), d.get('p95_ms'))
+        if v95 is not None and v95 > args.limite:
+            regressoes.append((nome, v95))
+
+    if regressoes:
+        print(f"\nRegressões de p95 acima de {args.limite:g}%:")
+        for nome, v in regressoes:
+            print(f"  {nome}: {v:+.1f}%")
+        sys.exit(1)
+    print(f"\nSem regressões de p95 acima de {args.limite:g}%.")
+
+
+if __name__ == '__main__':
+    main()
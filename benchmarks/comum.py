@@ -0,0 +1,105 @@
+# Funções compartilhadas pelos benchmarks: ambiente, percentis e gravação do resultado.
+
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+# Tamanhos da base sintética (linhas de protocolo)
+TAMANHOS = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+
+def url_postgres_bench():
+    """BENCH_DATABASE_URL: banco PostgreSQL só dos benchmarks. Nunca o DATABASE_URL do app."""
+    url = os.getenv('BENCH_DATABASE_URL')
+    if not url:
+        sys.exit("--postgres requer BENCH_DATABASE_URL (banco só para benchmarks).")
+    if url == os.getenv('DATABASE_URL'):
+        sys.exit("BENCH_DATABASE_URL igual a DATABASE_URL: use um banco separado para benchmarks.")
+    return url
+
+
+def configurar_ambiente(dados, postgres=False):
+    """Aponta o app.py para a base sintética em `dados` (antes de importar app).
+
+    DATABASE_URL é sempre sobrescrito (load_dotenv não troca variáveis já definidas):
+    vazio força o SQLite mesmo com .env configurado; com --postgres vira o
+    BENCH_DATABASE_URL. No SQLite o DriftBrake (que exige DATABASE_URL) não roda.
+    """
+    dados = os.path.abspath(dados)
+    os.environ['SQLITE_DB_PATH'] = os.path.join(dados, 'sisregip.db')
+    os.environ['SECRETARIA_DB_PATH'] = os.path.join(dados, 'secretaria.db')
+    os.environ['NETWORK_DATA_PATH'] = os.path.join(dados, 'rede')
+    if postgres:
+        os.environ['DATABASE_URL'] = url_postgres_bench()
+    else:
+        os.environ['DATABASE_URL'] = ''
+        from driftbrake import DriftBrake
+        DriftBrake.run_from_env = staticmethod(lambda *args, **kwargs: None)
+    return dados
+
+
+def percentil(valores_ordenados, p):
+    """Percentil p (0-100) com interpolação linear, de uma lista já ordenada."""
+    if not valores_ordenados:
+        return None
+    k = (len(valores_ordenados) - 1) * p / 100
+    i = int(k)
+    if i + 1 >= len(valores_ordenados):
+        return valores_ordenados[-1]
+    return valores_ordenados[i] + (valores_ordenados[i + 1] - valores_ordenados[i]) * (k - i)
+
+
+def resumo(latencias, duracao, erros=0):
+    """p50/p95/p99/média/máximo (ms) e vazão (operações por segundo)."""
+    ordenadas = sorted(latencias)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "n": len(ordenadas),
+        "erros": erros,
+        "p50_ms": ms(percentil(ordenadas, 50)),
+        "p95_ms": ms(percentil(ordenadas, 95)),
+        "p99_ms": ms(percentil(ordenadas, 99)),
+        "media_ms": ms(sum(ordenadas) / len(ordenadas)) if ordenadas else None,
+        "max_ms": ms(ordenadas[-1]) if ordenadas else None,
+        "vazao_ops": round(len(ordenadas) / duracao, 2) if duracao > 0 else None,
+    }
+
+
+def versao_codigo():
+    """Commit atual (com '+' se houver mudanças não commitadas), ou None fora do git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        sujo = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=RAIZ,
+                              capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ('+' if sujo else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def salvar_resultado(caminho, tipo, parametros, resultados):
+    """Grava o JSON do benchmark (comparável entre versões com comparar.py)."""
+    documento = {
+        "tipo": tipo,
+        "versao": versao_codigo(),
+        "executado_em": datetime.now().isoformat(timespec='seconds'),
+        "ambiente": {
+            "python": platform.python_version(),
+            "sistema": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "parametros": parametros,
+        "resultados": resultados,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    with open(caminho, 'w', encoding='utf-8') as f:
+        json.dump(documento, f, ensure_ascii=False, indent=2)
+    print(f"Resultado salvo em {caminho}")
+    return documento
@@ -0,0 +1,276 @@
+# Gera base sintética reprodutível (mesma semente, mesmos dados) para os benchmarks:
+# usuario, recebedor, protocolo e registro_operacional no SQLite (ou no PostgreSQL
+# de BENCH_DATABASE_URL com --postgres --recriar), tabela `protocolos` da Secretaria
+# e um acervo de PDFs com páginas em branco.
+#
+# Uso: python benchmarks/gerar_dados.py --tamanho 100k [--postgres --recriar] [--pdfs 20]
+
+import argparse
+import io
+import os
+import random
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+from comum import TAMANHOS, RAIZ, url_postgres_bench
+
+PRIMEIROS = ['JOSÉ', 'MARIA', 'JOÃO', 'ANA', 'ANTÔNIO', 'FRANCISCO', 'CARLOS', 'PAULO', 'PEDRO',
+             'LUCAS', 'LUÍZA', 'MÁRCIA', 'FÁBIO', 'SÉRGIO', 'CONCEIÇÃO', 'RAIMUNDO', 'SEBASTIÃO',
+             'TEREZA', 'JÚLIA', 'ROGÉRIO', 'VALÉRIA', 'CÉLIA', 'MÔNICA', 'OTÁVIO', 'INÊS',
+             'RENATA', 'GUILHERME', 'BEATRIZ', 'ANDRÉ', 'LÚCIA']
+SOBRENOMES = ['DA SILVA', 'DOS SANTOS', 'PEREIRA', 'ALVES', 'FERREIRA', 'RODRIGUES', 'GOMES',
+              'MARTINS', 'ARAÚJO', 'CARVALHO', 'GONÇALVES', 'LOPES', 'RIBEIRO', 'SOUZA', 'LIMA',
+              'BARBOSA', 'CASTRO', 'MOREIRA', 'CAVALCANTI', 'ASSUNÇÃO', 'BRANDÃO', 'DAMIÃO',
+              'FALCÃO', 'MACHADO', 'NOGUEIRA', 'TEIXEIRA', 'VIEIRA', 'MONTEIRO', 'MENDES', 'FREITAS']
+POSTOS = ['SD', 'CB', '3º SGT', '2º SGT', '1º SGT', 'ST', 'ASP', '2º TEN']
+FINALIDADES = ['PERÍCIA', 'AUDITORIA', 'INSS', 'PARTICULAR', 'JUDICIAL', 'SEGURO']
+ANOS_HISTORICO = 8
+LOTE = 50_000
+
+# Espelha schema/*.json (metadados do PostgreSQL de produção) e o registro_operacional
+TABELAS_SQLITE = [
+    '''CREATE TABLE usuario (id INTEGER PRIMARY KEY AUTOINCREMENT, nome VARCHAR(200), prontuario VARCHAR(10),
+        ativo BOOLEAN DEFAULT 1, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, created_by VARCHAR(100), updated_by VARCHAR(100))''',
+    '''CREATE TABLE recebedor (id INTEGER PRIMARY KEY AUTOINCREMENT, nome VARCHAR(200) NOT NULL UNIQUE,
+        ativo BOOLEAN DEFAULT 1, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE TABLE protocolo (id INTEGER PRIMARY KEY AUTOINCREMENT, prot VARCHAR(20) NOT NULL, data_protocolo DATE,
+        usuario_id INTEGER REFERENCES usuario(id), pmh VARCHAR(10), data_entrega DATE,
+        recebedor_id INTEGER REFERENCES recebedor(id), observacoes TEXT, ativo BOOLEAN DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_by VARCHAR(100), updated_by VARCHAR(100))''',
+    '''CREATE TABLE registro_operacional (id INTEGER PRIMARY KEY AUTOINCREMENT, operador VARCHAR(100),
+        acao VARCHAR(50), detalhes TEXT, data_hora VARCHAR(20))''',
+]
+TABELAS_POSTGRES = [
+    '''CREATE TABLE usuario (id SERIAL PRIMARY KEY, nome VARCHAR(200), prontuario VARCHAR(10),
+        ativo BOOLEAN DEFAULT true, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, created_by VARCHAR(100), updated_by VARCHAR(100))''',
+    '''CREATE TABLE recebedor (id SERIAL PRIMARY KEY, nome VARCHAR(200) NOT NULL UNIQUE,
+        ativo BOOLEAN DEFAULT true, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE TABLE protocolo (id SERIAL PRIMARY KEY, prot VARCHAR(20) NOT NULL, data_protocolo DATE,
+        usuario_id INTEGER REFERENCES usuario(id), pmh VARCHAR(10), data_entrega DATE,
+        recebedor_id INTEGER REFERENCES recebedor(id), observacoes TEXT, ativo BOOLEAN DEFAULT true,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_by VARCHAR(100), updated_by VARCHAR(100))''',
+    '''CREATE TABLE registro_operacional (id SERIAL PRIMARY KEY, operador VARCHAR(100),
+        acao VARCHAR(50), detalhes TEXT, data_hora VARCHAR(20))''',
+]
+INDICES = [
+    'CREATE INDEX idx_usuario_nome ON usuario (nome)',
+    'CREATE INDEX idx_usuario_ativo ON usuario (ativo)',
+    'CREATE INDEX idx_recebedor_nome ON recebedor (nome)',
+    'CREATE INDEX idx_protocolo_data ON protocolo (data_protocolo)',
+    'CREATE INDEX idx_protocolo_ativo ON protocolo (ativo)',
+    'CREATE INDEX idx_protocolo_prot ON protocolo (prot)',
+    'CREATE INDEX idx_protocolo_usuario ON protocolo (usuario_id)',
+    'CREATE INDEX idx_protocolo_recebedor ON protocolo (recebedor_id)',
+]
+COLUNAS = {
+    'usuario': ('id', 'nome', 'prontuario', 'created_at', 'updated_at'),
+    'recebedor': ('id', 'nome'),
+    'protocolo': ('id', 'prot', 'data_protocolo', 'usuario_id', 'pmh', 'data_entrega', 'recebedor_id',
+                  'ativo', 'created_at', 'updated_at'),
+}
+
+
+def gerar_usuarios(rng, quantidade, hoje):
+    """(id, nome, prontuario, created_at, updated_at) com nomes únicos."""
+    vistos = set()
+    inicio = hoje - timedelta(days=365 * ANOS_HISTORICO)
+    for i in range(1, quantidade + 1):
+        while True:
+            nome = ' '.join([rng.choice(PRIMEIROS), rng.choice(PRIMEIROS), rng.choice(SOBRENOMES), rng.choice(SOBRENOMES)])
+            if nome in vistos:
+                nome = f"{nome} {rng.choice(SOBRENOMES)}"
+            if nome not in vistos:
+                break
+        vistos.add(nome)
+        criado = datetime.combine(inicio + timedelta(days=rng.randrange(365 * ANOS_HISTORICO)), datetime.min.time())
+        yield (i, nome, str(rng.randint(10000, 999999)), criado, criado)
+
+
+def gerar_recebedores(rng, quantidade):
+    vistos = set()
+    while len(vistos) < quantidade:
+        vistos.add(f"{rng.choice(POSTOS)} {rng.choice(SOBRENOMES)}")
+    return [(i, nome) for i, nome in enumerate(sorted(vistos), 1)]
+
+
+def gerar_protocolos(rng, quantidade, usuarios, n_recebedores, hoje):
+    """Protocolos em ordem de data; pacientes frequentes aparecem mais (distribuição enviesada)."""
+    dias = 365 * ANOS_HISTORICO
+    inicio = hoje - timedelta(days=dias)
+    for i in range(1, quantidade + 1):
+        data_protocolo = inicio + timedelta(days=dias * i // quantidade)
+        usuario = usuarios[int(rng.random() ** 2 * len(usuarios))]
+        entrega, recebedor = None, None
+        if rng.random() < 0.85:
+            entrega = min(data_protocolo + timedelta(days=rng.randint(0, 45)), hoje)
+            recebedor = rng.randint(1, n_recebedores)
+        criado = datetime.combine(data_protocolo, datetime.min.time()) + timedelta(minutes=rng.randrange(600))
+        atualizado = datetime.combine(entrega, datetime.min.time()) if entrega else criado
+        yield (i, f"{i:07d}", data_protocolo.isoformat(), usuario[0], usuario[2],
+               entrega.isoformat() if entrega else None, recebedor, rng.random() >= 0.02,
+               criado, atualizado)
+
+
+def lotes(linhas, tamanho=LOTE):
+    lote = []
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def carregar_sqlite(caminho, usuarios, recebedores, protocolos):
+    if os.path.exists(caminho):
+        os.remove(caminho)
+    conn = sqlite3.connect(caminho)
+    # Só durante a geração: sem diário, a carga de 1M de linhas leva segundos
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    for ddl in TABELAS_SQLITE:
+        conn.execute(ddl)
+    for tabela, linhas in (('usuario', usuarios), ('recebedor', recebedores), ('protocolo', protocolos)):
+        colunas = COLUNAS[tabela]
+        sql = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})"
+        for lote in lotes(linhas):
+            conn.executemany(sql, [tuple(str(v) if isinstance(v, datetime) else v for v in linha) for linha in lote])
+    for ddl in INDICES:
+        conn.execute(ddl)
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def carregar_postgres(url, usuarios, recebedores, protocolos):
+    """Recria as tabelas no PostgreSQL de `url` e carrega com COPY."""
+    import psycopg2
+
+    def copy_valor(v):
+        if v is None:
+            return r'\N'
+        return str(v).replace('\\', '\\\\').replace('\t', ' ').replace('\n', ' ')
+
+    conn = psycopg2.connect(url)
+    # Nomes com acento: o COPY lê o buffer na codificação do cliente
+    conn.set_client_encoding('UTF8')
+    cursor = conn.cursor()
+    cursor.execute('DROP TABLE IF EXISTS protocolo, usuario, recebedor, registro_operacional CASCADE')
+    for ddl in TABELAS_POSTGRES:
+        cursor.execute(ddl)
+    for tabela, linhas in (('usuario', usuarios), ('recebedor', recebedores), ('protocolo', protocolos)):
+        colunas = COLUNAS[tabela]
+        for lote in lotes(linhas):
+            buffer = io.StringIO(''.join('\t'.join(copy_valor(v) for v in linha) + '\n' for linha in lote))
+            cursor.copy_expert(f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN", buffer)
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{tabela}', 'id'), (SELECT MAX(id) FROM {tabela}))")
+    for ddl in INDICES:
+        cursor.execute(ddl)
+    conn.commit()
+    cursor.execute('ANALYZE')
+    conn.close()
+
+
+def gerar_secretaria(caminho, rng, quantidade, usuarios, hoje):
+    """Tabela `protocolos` da Secretaria SAME (datas DD/MM/YYYY, como no banco original)."""
+    if os.path.exists(caminho):
+        os.remove(caminho)
+    conn = sqlite3.connect(caminho)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('''CREATE TABLE protocolos (id INTEGER PRIMARY KEY, protocolo TEXT, prontuario TEXT, nome TEXT,
+                    data_prot TEXT, finalidade TEXT, alta TEXT, obs TEXT)''')
+    dias = 365 * ANOS_HISTORICO
+
+    def linhas():
+        for i in range(1, quantidade + 1):
+            usuario = rng.choice(usuarios)
+            data = hoje - timedelta(days=dias - dias * i // quantidade)
+            yield (i, f"S{i:07d}", usuario[2], usuario[1], data.strftime('%d/%m/%Y'),
+                   rng.choice(FINALIDADES), rng.choice(['SIM', 'NÃO', '']), '')
+
+    for lote in lotes(linhas()):
+        conn.executemany('INSERT INTO protocolos VALUES (?, ?, ?, ?, ?, ?, ?, ?)', lote)
+    conn.commit()
+    conn.close()
+
+
+def gerar_pdfs(pasta, rng, arquivos, paginas_max, fracao_branco=0.2):
+    """PDFs com páginas de texto, páginas vazias e páginas quase vazias (só o rodapé).
+
+    Retorna quantas páginas em branco foram geradas (vazias + quase vazias).
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    os.makedirs(pasta, exist_ok=True)
+    em_branco = 0
+    for n in range(1, arquivos + 1):
+        c = canvas.Canvas(os.path.join(pasta, f"prontuario_{n:03d}.pdf"), pagesize=A4)
+        for pagina in range(rng.randint(5, paginas_max)):
+            sorteio = rng.random()
+            if sorteio < fracao_branco / 2:
+                em_branco += 1            # página vazia
+            elif sorteio < fracao_branco:
+                em_branco += 1            # quase vazia: só espaços no texto
+                c.drawString(300, 30, ' ')
+            else:
+                y = 800
+                for _ in range(rng.randint(10, 40)):
+                    c.drawString(50, y, ' '.join(rng.choice(SOBRENOMES) for _ in range(8)))
+                    y -= 18
+                c.drawString(500, 30, f"fl. {pagina + 1}")
+            c.showPage()
+        c.save()
+    return em_branco
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera base sintética para os benchmarks.")
+    parser.add_argument('--tamanho', choices=sorted(TAMANHOS), default='10k', help="linhas de protocolo")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', help="pasta de saída (padrão: benchmarks/dados/<tamanho>)")
+    parser.add_argument('--postgres', action='store_true', help="carrega no PostgreSQL de BENCH_DATABASE_URL")
+    parser.add_argument('--recriar', action='store_true',
+                        help="confirma que as tabelas do banco de --postgres podem ser apagadas")
+    parser.add_argument('--pdfs', type=int, default=20, help="arquivos do acervo de PDFs (0 para não gerar)")
+    parser.add_argument('--paginas-max', type=int, default=40)
+    args = parser.parse_args()
+    if args.postgres and not args.recriar:
+        parser.error("--postgres apaga e recria as tabelas do banco: confirme com --recriar")
+    url = url_postgres_bench() if args.postgres else None
+
+    quantidade = TAMANHOS[args.tamanho]
+    saida = os.path.abspath(args.saida or os.path.join(RAIZ, 'benchmarks', 'dados', args.tamanho))
+    os.makedirs(os.path.join(saida, 'rede'), exist_ok=True)
+    # Datas relativas a um dia fixo: a mesma semente gera sempre a mesma base
+    hoje = date(2026, 1, 1)
+
+    inicio = time.perf_counter()
+    rng = random.Random(args.semente)
+    usuarios = list(gerar_usuarios(rng, max(quantidade // 5, 10), hoje))
+    recebedores = gerar_recebedores(rng, 40)
+    protocolos = gerar_protocolos(rng, quantidade, usuarios, len(recebedores), hoje)
+    if args.postgres:
+        carregar_postgres(url, usuarios, recebedores, protocolos)
+        print(f"PostgreSQL: {quantidade} protocolos, {len(usuarios)} usuários")
+    else:
+        carregar_sqlite(os.path.join(saida, 'sisregip.db'), usuarios, recebedores, protocolos)
+        print(f"SQLite: {quantidade} protocolos, {len(usuarios)} usuários em {saida}")
+
+    gerar_secretaria(os.path.join(saida, 'secretaria.db'), rng, quantidade, usuarios, hoje)
+    print(f"Secretaria: {quantidade} registros")
+
+    if args.pdfs:
+        em_branco = gerar_pdfs(os.path.join(saida, 'pdfs'), rng, args.pdfs, args.paginas_max)
+        print(f"PDFs: {args.pdfs} arquivos, {em_branco} páginas em branco")
+    print(f"Concluído em {time.perf_counter() - inicio:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
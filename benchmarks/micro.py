@@ -0,0 +1,124 @@
+# Microbenchmarks de funções do app.py sobre a base sintética (gerar_dados.py):
+# format_date_br, geração do corpo do relatório, protocol_to_json, serialização da
+# listagem (objetos + json da stdlib vs. format=compact + app.json_dumps), fold_text
+# e a detecção de páginas em branco (pdf_blank.page_is_blank).
+#
+# Uso: python benchmarks/micro.py --dados benchmarks/dados/100k [--saida resultados/micro.json]
+
+import argparse
+import glob
+import json
+import os
+import time
+
+from comum import configurar_ambiente, resumo, salvar_resultado
+
+
+def medir(funcao, amostras, chamadas_por_amostra=1, aquecimento=3):
+    """Latência por chamada (s) de `amostras` rodadas, cada uma com N chamadas."""
+    for _ in range(aquecimento):
+        funcao()
+    latencias = []
+    inicio_total = time.perf_counter()
+    for _ in range(amostras):
+        inicio = time.perf_counter()
+        for _ in range(chamadas_por_amostra):
+            funcao()
+        latencias.append((time.perf_counter() - inicio) / chamadas_por_amostra)
+    duracao = time.perf_counter() - inicio_total
+    resultado = resumo(latencias, duracao)
+    # vazão em chamadas, não em amostras
+    resultado["vazao_ops"] = round(amostras * chamadas_por_amostra / duracao, 2)
+    resultado["chamadas"] = amostras * chamadas_por_amostra
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks do SISREGIP.")
+    parser.add_argument('--dados', required=True, help="pasta gerada por gerar_dados.py")
+    parser.add_argument('--postgres', action='store_true', help="usa o PostgreSQL de BENCH_DATABASE_URL")
+    parser.add_argument('--amostras', type=int, default=200)
+    parser.add_argument('--linhas-relatorio', type=int, default=10_000)
+    parser.add_argument('--saida', default=os.path.join('benchmarks', 'resultados', 'micro.json'))
+    args = parser.parse_args()
+
+    dados = configurar_ambiente(args.dados, args.postgres)
+    import app
+    import pdf_blank
+    from pypdf import PdfReader
+
+    app.init_app()
+    # Amostras reais da base: datas, linhas do relatório e linhas da listagem
+    conn = app.get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT data_protocolo FROM protocolo ORDER BY id LIMIT 1000')
+    datas = [row[0] for row in cursor.fetchall()]
+    cursor.execute(f"{app.PROTOCOL_SELECT} WHERE p.ativo = TRUE ORDER BY p.id LIMIT 1000")
+    listagem = cursor.fetchall()
+    conn.close()
+    linhas_relatorio = []
+    for row in app.iter_report_rows(['p.ativo = TRUE'], ()):
+        linhas_relatorio.append(row)
+        if len(linhas_relatorio) >= args.linhas_relatorio:
+            break
+    nomes = [row[3] or '' for row in listagem]
+
+    paginas = []
+    for caminho in sorted(glob.glob(os.path.join(dados, 'pdfs', '*.pdf'))):
+        paginas.extend(PdfReader(caminho).pages)
+
+    resultados = {}
+    print("format_date_br...")
+    resultados["format_date_br"] = medir(lambda: [app.format_date_br(d) for d in datas], args.amostras)
+    print("relatório (corpo)...")
+    resultados["report_body"] = medir(lambda: ''.join(app.iter_report_body(linhas_relatorio)),
+                                      max(args.amostras // 10, 5))
+    print("relatório (documento)...")
+    resultados["report_html"] = medir(
+        lambda: ''.join(app.iter_report_html(app.iter_report_body(linhas_relatorio), len(linhas_relatorio), 0, 0)),
+        max(args.amostras // 10, 5))
+    print("protocol_to_json...")
+    resultados["protocol_to_json"] = medir(lambda: [app.protocol_to_json(row) for row in listagem], args.amostras)
+    print("listagem JSON (objetos, json da stdlib)...")
+
+    def listagem_objetos():
+        # Caminho anterior: datas formatadas em Python e chaves repetidas por linha
+        return json.dumps([{
+            "ID": row["ID"], "PROT": row["PROT"], "DATA": app.format_date_br(row["data_protocolo"]),
+            "NOME": row["NOME"], "PMH": row["PMH"], "ENTREGA": app.format_date_br(row["data_entrega"]),
+            "RECEBIMENTO": row["RECEBIMENTO"],
+        } for row in listagem]).encode('utf-8')
+
+    resultados["listagem_json"] = medir(listagem_objetos, args.amostras)
+    print(f"listagem JSON (compacta, {'orjson' if app.orjson else 'json'})...")
+    resultados["listagem_compacta"] = medir(
+        lambda: app.json_dumps({"columns": app.PROTOCOL_FIELDS, "protocols": app.protocol_rows(listagem)}),
+        args.amostras)
+    print("fold_text...")
+    resultados["fold_text"] = medir(lambda: [app.fold_text(nome) for nome in nomes], args.amostras)
+    if paginas:
+        print("page_is_blank...")
+        resultados["page_is_blank"] = medir(lambda: [pdf_blank.page_is_blank(p) for p in paginas],
+                                            max(args.amostras // 20, 5))
+    else:
+        print("Sem PDFs em dados/pdfs: page_is_blank não medido.")
+
+    parametros = {
+        "dados": dados,
+        "backend": "postgresql" if app.USE_POSTGRES else "sqlite",
+        "amostras": args.amostras,
+        "orjson": app.orjson is not None,
+        "itens_por_chamada": {
+            "format_date_br": len(datas), "report_body": len(linhas_relatorio),
+            "report_html": len(linhas_relatorio), "protocol_to_json": len(listagem),
+            "listagem_json": len(listagem), "listagem_compacta": len(listagem),
+            "fold_text": len(nomes), "page_is_blank": len(paginas),
+        },
+    }
+    for nome, r in resultados.items():
+        print(f"  {nome:18} p50 {r['p50_ms']:>9} ms  p95 {r['p95_ms']:>9} ms  p99 {r['p99_ms']:>9} ms")
+    salvar_resultado(args.saida, 'micro', parametros, resultados)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+# Sobe o app.py sobre a base sintética, com o mesmo servidor do modo serviço, para
+# o carga.py. print_preview e merge_pdfs abrem navegador/visualizador na máquina do
+# servidor: aqui essas duas ações viram no-op para a carga não abrir centenas de janelas.
+#
+# Uso: python benchmarks/servidor.py --dados benchmarks/dados/100k [--postgres]
+
+import argparse
+
+from comum import configurar_ambiente
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor do SISREGIP para benchmarks.")
+    parser.add_argument('--dados', required=True, help="pasta gerada por gerar_dados.py")
+    parser.add_argument('--postgres', action='store_true', help="usa o PostgreSQL de BENCH_DATABASE_URL")
+    args = parser.parse_args()
+
+    configurar_ambiente(args.dados, args.postgres)
+    import app
+
+    app.init_app()
+    app.open_file = lambda filepath: None
+    app.webbrowser.open = lambda url, *a, **k: True
+    app.run_flask(service=True)
+
+
+if __name__ == '__main__':
+    main()
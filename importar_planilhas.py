@@ -0,0 +1,38 @@
+# Importa planilhas antigas de protocolos (.csv/.xlsx) para o banco do SISREGIP.
+# Usa a mesma configuração (.env) e as mesmas regras da rota /api/import/protocols.
+#
+# Uso: python importar_planilhas.py planilha.xlsx [outra.csv ...] [--operador NOME]
+
+import argparse
+import os
+import sys
+import time
+
+import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa planilhas de protocolos (.csv/.xlsx).")
+    parser.add_argument('planilhas', nargs='+', help="arquivos .csv ou .xlsx")
+    parser.add_argument('--operador', default='IMPORTACAO', help="nome registrado na auditoria")
+    args = parser.parse_args()
+    app.init_app()
+
+    falhas = 0
+    for planilha in args.planilhas:
+        inicio = time.perf_counter()
+        try:
+            result = app.import_protocols(planilha, args.operador)
+        except (app.ImportacaoError, OSError) as e:
+            print(f"{planilha}: {e}")
+            falhas += 1
+            continue
+        print(f"{planilha}: {result['imported']} importados, {result['rejected']} rejeitados "
+              f"de {result['total']} linhas em {time.perf_counter() - inicio:.1f}s")
+        if result['report']:
+            print(f"  rejeitados: {os.path.join(app.IMPORT_REPORT_DIR, result['report'])}")
+    return 1 if falhas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
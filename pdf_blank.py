@@ -0,0 +1,73 @@
+# Detecção de páginas em branco para a mesclagem de PDFs.
+# Fica fora do app.py de propósito: as funções daqui rodam nos processos do pool
+# (ProcessPoolExecutor) e importar este módulo não pode abrir banco, Flask ou Eel.
+# Com spawn (Windows) o processo do pool também reimporta o script principal como
+# __mp_main__; por isso o app.py só inicializa banco, rede e threads em init_app().
+# pypdf também só é importado quando há análise a fazer (app.py importa este módulo).
+
+CONTENT_THRESHOLD = 100      # content stream menor que isso pode ser página em branco
+IMAGE_THRESHOLD = 8 * 1024   # imagens (XObject) a partir disso indicam página com conteúdo
+
+# Muda quando as regras mudam: invalida os vereditos guardados em cache
+RULES = ('v2', CONTENT_THRESHOLD, IMAGE_THRESHOLD)
+
+
+def _xobject_info(page):
+    """Soma dos bytes das imagens da página e se há formulários (XObject /Form)."""
+    image_bytes, has_forms = 0, False
+    resources = page.get('/Resources')
+    if resources is None:
+        return image_bytes, has_forms
+    xobjects = resources.get_object().get('/XObject')
+    if xobjects is None:
+        return image_bytes, has_forms
+    for ref in xobjects.get_object().values():
+        xobj = ref.get_object()
+        subtype = xobj.get('/Subtype')
+        if subtype == '/Image':
+            length = xobj.get('/Length')
+            image_bytes += int(length.get_object()) if length is not None else 0
+        elif subtype == '/Form':
+            has_forms = True
+    return image_bytes, has_forms
+
+
+def page_is_blank(page, content_threshold=CONTENT_THRESHOLD, image_threshold=IMAGE_THRESHOLD):
+    """Verifica se página PDF está em branco, das checagens baratas para a cara.
+
+    extract_text() só é chamado quando o tamanho do conteúdo e das imagens não
+    decide: página sem operador de texto (BT) nem formulário não tem texto.
+    """
+    # ContentStream herda de dict e é "falso" quando vazio: comparar com None
+    content = page.get_contents()
+    data = content.get_data() if content is not None else b''
+    if len(data) >= content_threshold:
+        return False
+
+    image_bytes, has_forms = _xobject_info(page)
+    if image_bytes >= image_threshold:
+        return False
+    if b'BT' not in data and not has_forms:
+        return True
+
+    text = page.extract_text()
+    return not (text and text.strip())
+
+
+def analyze_pages(path, indices):
+    """Vereditos (True = em branco) das páginas `indices` do PDF em `path`.
+
+    Roda em processo do pool: abre o arquivo por conta própria, já que objetos
+    do pypdf não atravessam processos. Página com erro conta como não vazia.
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    verdicts = []
+    for i in indices:
+        try:
+            verdicts.append(page_is_blank(reader.pages[i]))
+        except Exception:
+            # Página que não dá para analisar é mantida na mescla
+            verdicts.append(False)
+    return verdicts
@@ -7,15 +7,24 @@ document.addEventListener('DOMContentLoaded', () => {
     const btnMergeBlank = document.getElementById('btn-merge-blank');
     const btnNewFolder = document.getElementById('btn-new-folder');
     const selectAllCheckbox = document.getElementById('select-all');
+    const mergeStatus = document.getElementById('merge-status');
+    const btnCancelMerge = document.getElementById('btn-cancel-merge');
 
     let currentFolderPath = '';
+    let currentJobId = null;
+    let nextOffset = null;
+    let loadingPage = false;
+
+    const POLL_INTERVAL_MS = 1000;
+    const PAGE_SIZE = 200;
+    const SCROLL_THRESHOLD_PX = 200;
 
     // FIX: Resolve URL do servidor dinamicamente (igual ao app.js principal)
     const serverUrl = `${window.location.protocol}//${window.location.hostname}:8001`;
 
     // FUNÇÕES AUXILIARES
 
-    /** Requisição à API com feedback e fechamento automático em sucesso. */
+    /** Requisição à API. Retorna o JSON ou null (com alerta) em caso de erro. */
     async function apiRequest(endpoint, method = 'POST', body = null) {
         try {
             const options = {
@@ -33,15 +42,57 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(errorData.message || `Erro ${response.status}`);
             }
 
-            const result = await response.json();
-            alert(result.message);
-
-            if (result.success) {
-                window.close();
-            }
+            return await response.json();
         } catch (error) {
             alert(`Erro de comunicação: ${error.message}`);
+            return null;
+        }
+    }
+
+    /** Liga/desliga os botões enquanto uma mesclagem está em andamento. */
+    function setMerging(active) {
+        btnMerge.disabled = active;
+        btnMergeBlank.disabled = active;
+        btnNewFolder.disabled = active;
+        btnCancelMerge.style.display = active ? 'block' : 'none';
+        mergeStatus.style.display = active ? 'block' : 'none';
+    }
+
+    /** Mostra o progresso do job no rodapé. */
+    function renderProgress(job) {
+        let text;
+        if (job.status === 'queued') {
+            text = 'Aguardando na fila...';
+        } else if (job.remove_blank && job.pages_analyzed < job.pages_total) {
+            text = `Procurando páginas em branco: ${job.pages_analyzed} de ${job.pages_total}`;
+        } else {
+            text = `Páginas: ${job.pages_processed} de ${job.pages_total} · arquivos: ${job.files_done} de ${job.files_total}`;
+        }
+        if (job.pages_skipped) text += ` · em branco removidas: ${job.pages_skipped}`;
+        mergeStatus.textContent = text;
+    }
+
+    /** Consulta o job até terminar; fecha a janela quando a mesclagem conclui. */
+    async function pollJob(jobId) {
+        const job = await apiRequest(`/api/merge_pdfs/${jobId}`, 'GET');
+        if (!job) {
+            setMerging(false);
+            currentJobId = null;
+            return;
+        }
+
+        renderProgress(job);
+        if (job.status === 'queued' || job.status === 'running') {
+            setTimeout(() => pollJob(jobId), POLL_INTERVAL_MS);
+            return;
         }
+
+        setMerging(false);
+        currentJobId = null;
+        let message = job.message;
+        if (job.errors.length) message += `\n\nArquivos com erro:\n${job.errors.join('\n')}`;
+        alert(message);
+        if (job.status === 'done') window.close();
     }
 
     /** Coleta nomes dos PDFs com checkbox marcado. */
@@ -50,8 +101,14 @@ document.addEventListener('DOMContentLoaded', () => {
         return Array.from(checked).map(cb => cb.value);
     }
 
+    /** Nomes desmarcados entre os já carregados (exclusões de "selecionar todos"). */
+    function getUncheckedFiles() {
+        const unchecked = document.querySelectorAll('.pdf-checkbox:not(:checked)');
+        return Array.from(unchecked).map(cb => cb.value);
+    }
+
     /** Valida seleção e dispara merge com ou sem remoção de páginas em branco. */
-    function handleMerge(removeBlank) {
+    async function handleMerge(removeBlank) {
         if (!currentFolderPath) return;
 
         const selectedFiles = getSelectedFiles();
@@ -60,11 +117,87 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
 
-        apiRequest('/api/merge_pdfs', 'POST', {
+        // A lista chega aos poucos: com "selecionar todos", o servidor resolve a
+        // pasta inteira pelo índice, menos o que foi desmarcado
+        const selection = selectAllCheckbox.checked
+            ? { select_all: true, exclude: getUncheckedFiles() }
+            : { files_to_merge: selectedFiles };
+
+        setMerging(true);
+        mergeStatus.textContent = 'Iniciando...';
+        const result = await apiRequest('/api/merge_pdfs', 'POST', {
             folder_path: currentFolderPath,
-            files_to_merge: selectedFiles,
+            ...selection,
             remove_blank: removeBlank,
         });
+        if (!result) {
+            setMerging(false);
+            return;
+        }
+
+        currentJobId = result.job_id;
+        pollJob(result.job_id);
+    }
+
+    /** Tamanho legível (KB/MB). */
+    function formatSize(bytes) {
+        if (bytes >= 1024 * 1024) return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+        return `${Math.max(1, Math.round(bytes / 1024))} KB`;
+    }
+
+    /** Linha da lista: checkbox, nome e páginas/tamanho vindos do índice. */
+    function renderPdfItem(file) {
+        const li = document.createElement('li');
+        const label = document.createElement('label');
+
+        const checkbox = document.createElement('input');
+        checkbox.type = 'checkbox';
+        checkbox.className = 'pdf-checkbox';
+        checkbox.value = file.name;
+        checkbox.checked = selectAllCheckbox.checked;
+
+        const span = document.createElement('span');
+        span.textContent = file.name;
+
+        const meta = document.createElement('small');
+        meta.className = 'pdf-meta';
+        const parts = [];
+        if (file.error) parts.push('erro ao ler');
+        else if (file.pages !== null) parts.push(`${file.pages} pág.`);
+        if (file.blank_pages) parts.push(`${file.blank_pages} em branco`);
+        parts.push(formatSize(file.size));
+        meta.textContent = parts.join(' · ');
+
+        label.appendChild(checkbox);
+        label.appendChild(span);
+        label.appendChild(meta);
+        li.appendChild(label);
+        return li;
+    }
+
+    /** Busca uma página da listagem (offset 0 também atualiza o índice no servidor). */
+    async function fetchPdfPage(offset) {
+        const response = await fetch(`${serverUrl}/api/list_pdfs`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ folder_path: currentFolderPath, offset, limit: PAGE_SIZE }),
+        });
+        return response.json();
+    }
+
+    async function loadMorePdfs() {
+        if (loadingPage || nextOffset === null) return;
+        loadingPage = true;
+        try {
+            const result = await fetchPdfPage(nextOffset);
+            if (!result.success) return;
+            result.files.forEach(file => pdfList.appendChild(renderPdfItem(file)));
+            nextOffset = result.next_offset;
+        } catch (error) {
+            console.error('Erro ao carregar mais PDFs:', error);
+        } finally {
+            loadingPage = false;
+        }
     }
 
     // CARREGAMENTO DA LISTA DE PDFS
@@ -82,13 +215,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         try {
-            const response = await fetch(`${serverUrl}/api/list_pdfs`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ folder_path: currentFolderPath }),
-            });
-
-            const result = await response.json();
+            const result = await fetchPdfPage(0);
             pdfList.innerHTML = '';
 
             if (!result.success) {
@@ -101,26 +228,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 return;
             }
 
-            result.files.forEach(fileName => {
-                const li = document.createElement('li');
-                const label = document.createElement('label');
-
-                const checkbox = document.createElement('input');
-                checkbox.type = 'checkbox';
-                checkbox.className = 'pdf-checkbox';
-                checkbox.value = fileName;
-                checkbox.checked = true;
-
-                const span = document.createElement('span');
-                span.textContent = fileName;
-
-                label.appendChild(checkbox);
-                label.appendChild(span);
-                li.appendChild(label);
-                pdfList.appendChild(li);
-            });
-
             selectAllCheckbox.checked = true;
+            result.files.forEach(file => pdfList.appendChild(renderPdfItem(file)));
+            nextOffset = result.next_offset;
         } catch (error) {
             pdfList.innerHTML = `<li>Erro ao carregar PDFs: ${error.message}</li>`;
         }
@@ -133,9 +243,22 @@ document.addEventListener('DOMContentLoaded', () => {
         allCheckboxes.forEach(cb => { cb.checked = selectAllCheckbox.checked; });
     });
 
+    // Rolagem infinita: carrega a próxima página perto do fim da lista
+    const listContainer = document.querySelector('.merger-body');
+    listContainer.addEventListener('scroll', () => {
+        const distance = listContainer.scrollHeight - listContainer.scrollTop - listContainer.clientHeight;
+        if (distance < SCROLL_THRESHOLD_PX) loadMorePdfs();
+    });
+
     btnMerge.addEventListener('click', () => handleMerge(false));
     btnMergeBlank.addEventListener('click', () => handleMerge(true));
 
+    btnCancelMerge.addEventListener('click', () => {
+        if (!currentJobId) return;
+        // O próximo polling mostra o status 'cancelled'
+        apiRequest(`/api/merge_pdfs/${currentJobId}/cancel`, 'POST');
+    });
+
     btnNewFolder.addEventListener('click', () => {
         eel.select_folder()();
         window.close();
@@ -40,26 +40,34 @@ document.addEventListener('DOMContentLoaded', () => {
     const closeModal = document.getElementById('close-modal');
     const btnCancelPrint = document.getElementById('btn-cancel-print');
     const btnConfirmPrint = document.getElementById('btn-confirm-print');
+    const btnExportCsv = document.getElementById('btn-export-csv');
+    const btnExportXlsx = document.getElementById('btn-export-xlsx');
     const monthSelect = document.getElementById('month-select');
     const monthYearSelect = document.getElementById('month-year-select');
     const yearSelect = document.getElementById('year-select');
     const monthFilterGroup = document.getElementById('month-filter-group');
     const yearFilterGroup = document.getElementById('year-filter-group');
+    const rangeFilterGroup = document.getElementById('range-filter-group');
+    const dateFrom = document.getElementById('date-from');
+    const dateTo = document.getElementById('date-to');
 
     let allProtocols = [];
+    let nextCursor = null;
+    let loadingPage = false;
+    let listTotal = 0;
+    let listGeneration = 0; // descarta páginas que chegam depois de uma nova busca
+    let syncCursor = null;  // token de versão para buscar só o que mudou (since)
+    let syncEtag = null;
     let selectedProtId = null;
     let protocolChart = null;
     let availableYears = [];
 
-    // FUNÇÕES AUXILIARES
+    const PAGE_SIZE = 100;
+    const SCROLL_THRESHOLD_PX = 200;
 
-    const extractYear = (dateStr) => {
-        if (!dateStr || !dateStr.trim()) return null;
-        const parts = dateStr.split('/');
-        if (parts.length !== 3) return null;
-        const year = parseInt(parts[2], 10);
-        return (!isNaN(year) && year > 2000) ? year : null;
-    };
+    const serverUrl = `${window.location.protocol}//${window.location.hostname}:8001`;
+
+    // FUNÇÕES AUXILIARES
 
     const populateYearSelect = (selectEl, years, placeholder) => {
         selectEl.innerHTML = '';
@@ -92,9 +100,9 @@ document.addEventListener('DOMContentLoaded', () => {
             : { text: 'Pendente', class: 'status-Pendente' };
     };
 
-    const renderList = (protocols) => {
+    const renderList = (protocols, append = false) => {
         const scrollPosition = listContainer.scrollTop;
-        listContainer.innerHTML = '';
+        if (!append) listContainer.innerHTML = '';
 
         protocols.forEach(p => {
             const item = mainTemplate.content.cloneNode(true).firstElementChild;
@@ -117,8 +125,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
         listContainer.scrollTop = scrollPosition;
 
-        // Atualiza contador
-        if (listCount) listCount.textContent = protocols.length;
+        // Atualiza contador (total do filtro no servidor, não só as páginas carregadas)
+        if (listCount) listCount.textContent = listTotal;
     };
 
     const showDetailsView = (protocol) => {
@@ -176,20 +184,11 @@ document.addEventListener('DOMContentLoaded', () => {
 
     Chart.register(centerTextPlugin);
 
-    const updateChart = (protocols) => {
-        let pendentes = 0;
-        let entregues = 0;
-
-        protocols.forEach(p => {
-            if (p.ENTREGA && p.ENTREGA.trim() !== '') {
-                entregues++;
-            } else {
-                pendentes++;
-            }
-        });
+    const updateChart = (summary) => {
+        const { total, entregues, pendentes } = summary;
 
         // Atualiza stat cards
-        if (statTotal) statTotal.textContent = protocols.length;
+        if (statTotal) statTotal.textContent = total;
         if (statEntregues) statEntregues.textContent = entregues;
         if (statPendentes) statPendentes.textContent = pendentes;
 
@@ -234,14 +233,11 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     };
 
-    const populateFilters = () => {
-        const years = new Set();
-        allProtocols.forEach(p => {
-            const year = extractYear(p.DATA);
-            if (year) years.add(year);
-        });
-
-        availableYears = Array.from(years).sort((a, b) => b - a);
+    const populateFilters = (years) => {
+        const validYears = years.filter(year => year > 2000);
+        // Não recria os selects (e não perde a seleção do modal) se os anos não mudaram
+        if (validYears.length && validYears.join() === availableYears.join()) return;
+        availableYears = validYears;
 
         if (availableYears.length === 0) {
             availableYears = [new Date().getFullYear()];
@@ -253,13 +249,23 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // CHAMADAS À API
 
-    async function apiRequest(endpoint, method = 'GET', body = null) {
-        const serverUrl = `${window.location.protocol}//${window.location.hostname}:8001`;
+    // Listagens com format=compact vêm como listas na ordem de data.columns
+    const expandRows = (columns, rows) => rows.map(row => {
+        const item = {};
+        columns.forEach((name, i) => { item[name] = row[i]; });
+        return item;
+    });
+
+    // Planilha baixada pelo navegador (o servidor envia como anexo)
+    const downloadExport = (endpoint, params) => {
+        window.location.href = `${serverUrl}${endpoint}?${params}`;
+    };
 
+    async function apiRequest(endpoint, method = 'GET', body = null, extraHeaders = {}) {
         try {
             const options = {
                 method,
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', ...extraHeaders },
             };
             if (body) {
                 // Injeta nome do operador em toda requisição POST
@@ -269,13 +275,23 @@ document.addEventListener('DOMContentLoaded', () => {
 
             const response = await fetch(`${serverUrl}${endpoint}`, options);
 
+            // If-None-Match coincidiu: nada mudou no servidor
+            if (response.status === 304) return { notModified: true };
+
             if (!response.ok) {
                 const errorData = await response.json();
                 throw new Error(errorData.message || 'Erro no servidor');
             }
 
             if (response.headers.get('content-type')?.includes('application/json')) {
-                return response.json();
+                const data = await response.json();
+                const etag = response.headers.get('ETag');
+                if (etag && data && typeof data === 'object') data.etag = etag;
+                if (data && Array.isArray(data.columns)) {
+                    if (data.protocols) data.protocols = expandRows(data.columns, data.protocols);
+                    if (data.rows) data.rows = expandRows(data.columns, data.rows);
+                }
+                return data;
             }
 
             return { success: true, message: 'Ação concluída.' };
@@ -286,13 +302,127 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    async function refreshProtocols() {
-        const data = await apiRequest('/api/protocols');
-        if (data) {
-            allProtocols = data;
+    // Página de protocolos filtrada no servidor pelo termo da caixa de busca
+    const protocolsUrl = (cursor = null, withSummary = false) => {
+        const params = new URLSearchParams({ limit: PAGE_SIZE, format: 'compact' });
+        const term = filtroInput.value.trim();
+        if (term) params.set('q', term);
+        if (cursor) params.set('cursor', cursor);
+        if (withSummary) params.set('summary', '1');
+        return `/api/protocols?${params}`;
+    };
+
+    async function refreshProtocols(withSummary = true) {
+        const generation = ++listGeneration;
+        const data = await apiRequest(protocolsUrl(null, withSummary));
+        if (generation !== listGeneration) return;
+        if (data && data.success) {
+            allProtocols = data.protocols;
+            nextCursor = data.next_cursor;
+            listTotal = data.total;
+            syncCursor = data.sync_cursor;
+            syncEtag = data.etag || null;
             renderList(allProtocols);
-            updateChart(allProtocols);
-            populateFilters();
+            if (data.summary) {
+                updateChart(data.summary);
+                populateFilters(data.summary.anos);
+            }
+        }
+    }
+
+    // Ordem igual à do servidor: data desc, depois ID desc (sem data por último, como no SQLite)
+    const protocolKey = (p) => {
+        const [d, m, y] = (p.DATA || '').split('/');
+        return [y ? `${y}-${m}-${d}` : '', Number(p.ID)];
+    };
+    const compareKeys = ([dateA, idA], [dateB, idB]) => dateB.localeCompare(dateA) || idB - idA;
+
+    // Aplica o delta do servidor na lista já carregada
+    const mergeProtocols = (changed, removed) => {
+        const replaced = new Set(removed.map(Number));
+        changed.forEach(p => replaced.add(Number(p.ID)));
+
+        let merged = allProtocols.filter(p => !replaced.has(Number(p.ID))).concat(changed);
+
+        // Com mais páginas por vir, o que cair depois da última carregada chega pela paginação
+        if (nextCursor) {
+            const [date, id] = nextCursor.split('~');
+            const boundary = [date, Number(id)];
+            merged = merged.filter(p => compareKeys(protocolKey(p), boundary) <= 0);
+        }
+
+        merged.sort((a, b) => compareKeys(protocolKey(a), protocolKey(b)));
+        allProtocols = merged;
+    };
+
+    // Busca só o que mudou desde a última sincronização (alguns bytes em vez da tabela)
+    async function syncProtocols() {
+        if (!syncCursor) return refreshProtocols();
+
+        const params = new URLSearchParams({ since: syncCursor, summary: '1', format: 'compact' });
+        const term = filtroInput.value.trim();
+        if (term) params.set('q', term);
+
+        const generation = listGeneration;
+        const headers = syncEtag ? { 'If-None-Match': syncEtag } : {};
+        const data = await apiRequest(`/api/protocols?${params}`, 'GET', null, headers);
+        if (generation !== listGeneration || !data || data.notModified) return;
+        if (!data.success || data.resync) return refreshProtocols();
+
+        mergeProtocols(data.protocols, data.removed);
+        syncCursor = data.sync_cursor;
+        syncEtag = data.etag || null;
+        listTotal = data.total;
+        renderList(allProtocols);
+        updateChart(data.summary);
+        populateFilters(data.summary.anos);
+    }
+
+    // Mudança publicada por outro terminal (SSE): aplica direto na lista carregada
+    const applyPushedChange = (event) => {
+        // Com busca ativa, só o servidor sabe o que atende ao filtro: pede o delta
+        if (filtroInput.value.trim()) {
+            syncProtocols();
+            return;
+        }
+        mergeProtocols(event.changed, event.removed);
+        listTotal = event.summary.total;
+        renderList(allProtocols);
+        updateChart(event.summary);
+        populateFilters(event.summary.anos);
+    };
+
+    const connectProtocolStream = () => {
+        if (!window.EventSource) return;
+
+        const source = new EventSource(`${serverUrl}/api/protocols/stream`);
+        let reconnecting = false;
+
+        source.addEventListener('protocolo', (e) => applyPushedChange(JSON.parse(e.data)));
+        // Fila do servidor transbordou: eventos foram descartados, recarrega a lista
+        source.addEventListener('resync', () => refreshProtocols());
+        source.addEventListener('error', () => { reconnecting = true; });
+        source.addEventListener('open', () => {
+            // Após queda da conexão, busca o que mudou enquanto esteve desconectado
+            if (reconnecting) syncProtocols();
+            reconnecting = false;
+        });
+    };
+
+    async function loadNextPage() {
+        if (!nextCursor || loadingPage) return;
+        loadingPage = true;
+        const generation = listGeneration;
+        try {
+            const data = await apiRequest(protocolsUrl(nextCursor));
+            if (generation !== listGeneration) return;
+            if (data && data.success) {
+                allProtocols = allProtocols.concat(data.protocols);
+                nextCursor = data.next_cursor;
+                renderList(data.protocols, true);
+            }
+        } finally {
+            loadingPage = false;
         }
     }
 
@@ -307,9 +437,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
             monthFilterGroup.style.display = 'none';
             yearFilterGroup.style.display = 'none';
+            rangeFilterGroup.style.display = 'none';
             monthSelect.disabled = true;
             monthYearSelect.disabled = true;
             yearSelect.disabled = true;
+            dateFrom.disabled = true;
+            dateTo.disabled = true;
 
             if (value === 'month') {
                 monthFilterGroup.style.display = 'block';
@@ -318,12 +451,22 @@ document.addEventListener('DOMContentLoaded', () => {
             } else if (value === 'year') {
                 yearFilterGroup.style.display = 'block';
                 yearSelect.disabled = false;
+            } else if (value === 'range') {
+                rangeFilterGroup.style.display = 'block';
+                dateFrom.disabled = false;
+                dateTo.disabled = false;
             }
         });
     });
 
     // EVENT LISTENERS
 
+    // Rolagem infinita: carrega a próxima página perto do fim da lista
+    listContainer.addEventListener('scroll', () => {
+        const distance = listContainer.scrollHeight - listContainer.scrollTop - listContainer.clientHeight;
+        if (distance < SCROLL_THRESHOLD_PX) loadNextPage();
+    });
+
     listContainer.addEventListener('click', (e) => {
         const li = e.target.closest('li');
         if (!li) return;
@@ -358,9 +501,16 @@ document.addEventListener('DOMContentLoaded', () => {
     const secStatFiltered = document.getElementById('sec-stat-filtered');
     const secStatTotal = document.getElementById('sec-stat-total');
 
-    let secAllData = [];
+    const secTableContainer = secTableBody.closest('.sec-table-container');
+
+    let secRows = [];
+    let secFiltered = 0;
     let secChart = null;
     let secDataLoaded = false;
+    let secLoading = false;
+    let secGeneration = 0; // descarta páginas de uma busca anterior
+
+    const SEC_PAGE_SIZE = 200;
 
     const openSecModal = async () => {
         secModal.style.display = 'flex';
@@ -373,27 +523,53 @@ document.addEventListener('DOMContentLoaded', () => {
         secModal.style.display = 'none';
     };
 
-    async function loadSecretariaData() {
-        const data = await apiRequest('/api/secretaria/protocols');
+    // Busca, paginação e contagem por mês são feitas no servidor (cache em memória)
+    const secretariaUrl = (offset, withSummary = false) => {
+        const params = new URLSearchParams({ offset, limit: SEC_PAGE_SIZE, format: 'compact' });
+        const term = secFiltro.value.trim();
+        if (term) params.set('q', term);
+        if (withSummary) params.set('summary', '1');
+        return `/api/secretaria/protocols?${params}`;
+    };
+
+    async function loadSecretariaData(withSummary = true) {
+        const generation = ++secGeneration;
+        const data = await apiRequest(secretariaUrl(0, withSummary));
+        if (generation !== secGeneration) return;
         if (!data || data.success === false) {
             secTableBody.innerHTML = '<tr><td colspan="7" style="text-align:center;color:var(--color-red);padding:40px;">Erro ao carregar dados da Secretaria.</td></tr>';
             return;
         }
 
-        secAllData = data;
+        secRows = data.rows;
+        secFiltered = data.filtered;
         secDataLoaded = true;
 
-        if (secStatTotal) secStatTotal.textContent = secAllData.length;
-        if (secTotalBadge) secTotalBadge.textContent = `${secAllData.length} registros`;
+        if (secStatTotal) secStatTotal.textContent = data.total;
+        if (secTotalBadge) secTotalBadge.textContent = `${data.total} registros`;
 
-        renderSecTable(secAllData);
-        renderSecChart(secAllData);
+        renderSecTable(secRows);
+        if (data.months) renderSecChart(data.months);
     }
 
-    function renderSecTable(rows) {
-        secTableBody.innerHTML = '';
+    async function loadMoreSecretaria() {
+        if (secLoading || secRows.length >= secFiltered) return;
+        secLoading = true;
+        const generation = secGeneration;
+        try {
+            const data = await apiRequest(secretariaUrl(secRows.length));
+            if (generation !== secGeneration || !data || data.success === false) return;
+            secRows = secRows.concat(data.rows);
+            renderSecTable(data.rows, true);
+        } finally {
+            secLoading = false;
+        }
+    }
 
-        if (rows.length === 0) {
+    function renderSecTable(rows, append = false) {
+        if (!append) secTableBody.innerHTML = '';
+
+        if (!append && rows.length === 0) {
             secTableBody.innerHTML = '<tr><td colspan="7" style="text-align:center;color:var(--text-muted);padding:40px;">Nenhum registro encontrado.</td></tr>';
             if (secStatFiltered) secStatFiltered.textContent = '0';
             return;
@@ -413,7 +589,7 @@ document.addEventListener('DOMContentLoaded', () => {
             secTableBody.appendChild(tr);
         });
 
-        if (secStatFiltered) secStatFiltered.textContent = rows.length;
+        if (secStatFiltered) secStatFiltered.textContent = secFiltered;
     }
 
     function esc(val) {
@@ -421,41 +597,16 @@ document.addEventListener('DOMContentLoaded', () => {
         return String(val).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
     }
 
-    function renderSecChart(data) {
-        // Agrupar por mês (YYYY-MM)
-        const monthCounts = {};
+    function renderSecChart(months) {
+        // Contagem por mês (YYYY-MM) já vem agregada do servidor: últimos 12 meses
         const monthNames = ['JAN','FEV','MAR','ABR','MAI','JUN','JUL','AGO','SET','OUT','NOV','DEZ'];
 
-        data.forEach(r => {
-            const dp = r.data_prot || '';
-            // Tenta extrair mês/ano de formatos comuns: DD/MM/YYYY ou YYYY-MM-DD
-            let key = null;
-            if (dp.includes('/')) {
-                const parts = dp.split('/');
-                if (parts.length === 3 && parts[2].length === 4) {
-                    key = `${parts[2]}-${parts[1].padStart(2, '0')}`;
-                }
-            } else if (dp.includes('-')) {
-                const parts = dp.split('-');
-                if (parts.length >= 2) {
-                    key = `${parts[0]}-${parts[1].padStart(2, '0')}`;
-                }
-            }
-            if (key) {
-                monthCounts[key] = (monthCounts[key] || 0) + 1;
-            }
-        });
-
-        // Ordenar por chave e pegar últimos 12 meses
-        const sortedKeys = Object.keys(monthCounts).sort();
-        const last12 = sortedKeys.slice(-12);
-
-        const labels = last12.map(k => {
-            const [y, m] = k.split('-');
+        const labels = months.map(({ month }) => {
+            const [y, m] = month.split('-');
             const mIdx = parseInt(m, 10) - 1;
             return `${monthNames[mIdx] || m}/${y.slice(2)}`;
         });
-        const values = last12.map(k => monthCounts[k]);
+        const values = months.map(({ count }) => count);
 
         if (secChart) {
             secChart.destroy();
@@ -519,23 +670,27 @@ document.addEventListener('DOMContentLoaded', () => {
     // Secretaria event listeners
     mainButtons.secretaria.addEventListener('click', openSecModal);
     closeSecretaria.addEventListener('click', closeSecModal);
+    document.getElementById('sec-export-csv').addEventListener('click', () => {
+        downloadExport('/api/export/secretaria', new URLSearchParams({ format: 'csv' }));
+    });
+    document.getElementById('sec-export-xlsx').addEventListener('click', () => {
+        downloadExport('/api/export/secretaria', new URLSearchParams({ format: 'xlsx' }));
+    });
     secModal.addEventListener('click', (e) => {
         if (e.target === secModal) closeSecModal();
     });
 
     secFiltro.addEventListener('input', debounce(() => {
-        const term = secFiltro.value.toLowerCase();
-        if (!term) {
-            renderSecTable(secAllData);
-            return;
-        }
-        const filtered = secAllData.filter(r =>
-            String(r.nome).toLowerCase().includes(term) ||
-            String(r.prontuario).toLowerCase().includes(term) ||
-            String(r.protocolo).toLowerCase().includes(term)
-        );
-        renderSecTable(filtered);
-    }, 200));
+        if (secTableContainer) secTableContainer.scrollTop = 0;
+        loadSecretariaData(false);
+    }, 300));
+
+    if (secTableContainer) {
+        secTableContainer.addEventListener('scroll', () => {
+            const distance = secTableContainer.scrollHeight - secTableContainer.scrollTop - secTableContainer.clientHeight;
+            if (distance < SCROLL_THRESHOLD_PX) loadMoreSecretaria();
+        });
+    }
 
     mainButtons.imprimir.addEventListener('click', openPrintModal);
 
@@ -545,7 +700,8 @@ document.addEventListener('DOMContentLoaded', () => {
         if (e.target === printModal) closePrintModal();
     });
 
-    btnConfirmPrint.addEventListener('click', async () => {
+    // Filtro do modal de impressão (relatório e exportação); null se incompleto
+    const printFilterParams = () => {
         const filterType = document.querySelector('input[name="print-filter"]:checked').value;
         let filterValue = '';
 
@@ -553,24 +709,51 @@ document.addEventListener('DOMContentLoaded', () => {
             const month = monthSelect.value;
             const year = monthYearSelect.value;
 
-            if (!month) { alert('Selecione um mês.'); return; }
-            if (!year)  { alert('Selecione um ano.'); return; }
+            if (!month) { alert('Selecione um mês.'); return null; }
+            if (!year)  { alert('Selecione um ano.'); return null; }
 
             filterValue = `${year}-${month}`;
         } else if (filterType === 'year') {
             filterValue = yearSelect.value;
-            if (!filterValue) { alert('Selecione um ano.'); return; }
+            if (!filterValue) { alert('Selecione um ano.'); return null; }
+        } else if (filterType === 'range') {
+            if (!dateFrom.value && !dateTo.value) { alert('Informe ao menos uma data.'); return null; }
+            if (dateFrom.value && dateTo.value && dateFrom.value > dateTo.value) {
+                alert('A data inicial deve ser anterior à final.');
+                return null;
+            }
         }
 
-        const result = await apiRequest('/api/print/preview', 'POST', {
+        return new URLSearchParams({
             filter_type: filterType,
             filter_value: filterValue,
+            date_from: dateFrom.value,
+            date_to: dateTo.value,
+            OPERADOR: sessionStorage.getItem('operador') || 'NÃO IDENTIFICADO',
         });
+    };
 
-        if (result && result.success) {
-            alert('Relatório gerado! Verifique seu navegador.');
-            closePrintModal();
+    btnConfirmPrint.addEventListener('click', () => {
+        const params = printFilterParams();
+        if (!params) return;
+
+        // O servidor transmite o relatório aos poucos; abre direto nesta máquina
+        const reportWindow = window.open(`${serverUrl}/api/print/report?${params}`, '_blank');
+        if (!reportWindow) {
+            alert('Permita pop-ups para abrir o relatório.');
+            return;
         }
+        closePrintModal();
+    });
+
+    [[btnExportCsv, 'csv'], [btnExportXlsx, 'xlsx']].forEach(([button, format]) => {
+        button.addEventListener('click', () => {
+            const params = printFilterParams();
+            if (!params) return;
+            params.set('format', format);
+            downloadExport('/api/export/protocols', params);
+            closePrintModal();
+        });
     });
 
     mainButtons.excluir.addEventListener('click', async () => {
@@ -582,7 +765,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if (result && result.success) {
             alert(result.message);
             selectedProtId = null;
-            await refreshProtocols();
+            await syncProtocols();
             showDetailsView(null);
         }
     });
@@ -608,25 +791,22 @@ document.addEventListener('DOMContentLoaded', () => {
         if (result && result.success) {
             alert(result.message);
             selectedProtId = null;
-            await refreshProtocols();
+            await syncProtocols();
             showDetailsView(null);
         }
     });
 
     filtroInput.addEventListener('input', debounce(() => {
-        const searchTerm = filtroInput.value.toLowerCase();
-        const filteredData = allProtocols.filter(p =>
-            String(p.NOME).toLowerCase().includes(searchTerm) ||
-            String(p.PROT).toLowerCase().includes(searchTerm)
-        );
-        renderList(filteredData);
-    }, 200));
+        listContainer.scrollTop = 0;
+        refreshProtocols(false);
+    }, 300));
 
     // INICIALIZAÇÃO
 
     welcomeMessage.style.display = 'block';
     detailContent.style.display = 'none';
     refreshProtocols();
+    connectProtocolStream();
 });
 
 // FUNÇÃO EXPOSTA PARA O PYTHON (Eel)
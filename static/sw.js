@@ -0,0 +1,55 @@
+// sw.js
+// Service worker do SISREGIP. CACHE_NAME e PRECACHE_URLS são gerados pelo servidor
+// (build_static_assets, em app.py) e mudam quando qualquer arquivo estático muda.
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then((cache) => cache.addAll(PRECACHE_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+// Remove caches de versões anteriores
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then((keys) => Promise.all(keys.filter((key) => key !== CACHE_NAME).map((key) => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    const url = new URL(request.url);
+
+    // API (dados, SSE, relatórios) e outros servidores: sempre direto na rede
+    if (request.method !== 'GET' || url.origin !== self.location.origin || url.pathname.startsWith('/api/')) return;
+
+    // Páginas: rede primeiro; a cópia em cache só é usada com o servidor fora do ar
+    if (request.mode === 'navigate') {
+        event.respondWith(
+            fetch(request)
+                .then((response) => {
+                    if (response.ok) {
+                        const copy = response.clone();
+                        caches.open(CACHE_NAME).then((cache) => cache.put(request, copy));
+                    }
+                    return response;
+                })
+                .catch(() => caches.match(request))
+        );
+        return;
+    }
+
+    // Assets versionados (?v=hash) nunca mudam: cache primeiro
+    event.respondWith(
+        caches.match(request).then((cached) => cached || fetch(request).then((response) => {
+            if (response.ok && url.searchParams.has('v')) {
+                const copy = response.clone();
+                caches.open(CACHE_NAME).then((cache) => cache.put(request, copy));
+            }
+            return response;
+        }))
+    );
+});
@@ -0,0 +1,11 @@
+# Testes rodam contra o SQLite: importar app não abre banco nem rede (ver init_app).
+
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+# Vazio (e não ausente) para o load_dotenv não trazer o PostgreSQL do .env
+os.environ['DATABASE_URL'] = ''
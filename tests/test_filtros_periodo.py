@@ -0,0 +1,60 @@
+# Filtros por período (mês, ano, intervalo) devem virar busca por faixa no índice
+# composto idx_protocolo_ativo_data, e não varredura por idx_protocolo_ativo.
+
+import sqlite3
+
+import pytest
+
+import app
+
+# Espelha schema/*.json com os índices de produção que competem pelo plano
+TABELAS = [
+    'CREATE TABLE usuario (id INTEGER PRIMARY KEY AUTOINCREMENT, nome VARCHAR(200), prontuario VARCHAR(10))',
+    'CREATE TABLE recebedor (id INTEGER PRIMARY KEY AUTOINCREMENT, nome VARCHAR(200) NOT NULL UNIQUE)',
+    '''CREATE TABLE protocolo (id INTEGER PRIMARY KEY AUTOINCREMENT, prot VARCHAR(20) NOT NULL,
+        data_protocolo DATE, usuario_id INTEGER REFERENCES usuario(id), pmh VARCHAR(10),
+        data_entrega DATE, recebedor_id INTEGER REFERENCES recebedor(id), ativo BOOLEAN DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    'CREATE INDEX idx_protocolo_data ON protocolo (data_protocolo)',
+    'CREATE INDEX idx_protocolo_ativo ON protocolo (ativo)',
+]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'sisregip.db')
+    for statement in TABELAS + app.SCHEMA_STATEMENTS:
+        conn.execute(statement)
+    conn.executemany(
+        'INSERT INTO protocolo (prot, data_protocolo, ativo) VALUES (?, ?, ?)',
+        [(f'{i:07d}', f'20{20 + i % 6}-{1 + i % 12:02d}-{1 + i % 28:02d}', i % 10 != 0) for i in range(500)]
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def query_plan(conn, args):
+    where, params = app.build_protocol_filters(args)
+    rows = conn.execute(
+        f"EXPLAIN QUERY PLAN {app.PROTOCOL_SELECT} WHERE {' AND '.join(where)}", params
+    ).fetchall()
+    return ' | '.join(row[-1] for row in rows)
+
+
+@pytest.mark.parametrize('args', [
+    {'month': '2024-03'},
+    {'year': '2023'},
+    {'from': '2021-05-10', 'to': '2022-02-01'},
+    {'from': '01/01/2025'},
+    {'to': '31/12/2021'},
+])
+def test_periodo_usa_indice_ativo_data(conn, args):
+    assert 'USING INDEX idx_protocolo_ativo_data' in query_plan(conn, args)
+
+
+def test_periodo_semiaberto():
+    assert app.build_protocol_filters({'month': '2024-12'}) == (
+        ['p.ativo = TRUE', 'p.data_protocolo >= ?', 'p.data_protocolo < ?'], ['2024-12-01', '2025-01-01'])
+    assert app.build_protocol_filters({'year': '2023'})[1] == ['2023-01-01', '2024-01-01']
+    assert app.build_protocol_filters({'from': '10/05/2021', 'to': '2021-05-10'})[1] == ['2021-05-10', '2021-05-11']